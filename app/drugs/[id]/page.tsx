@@ -10,13 +10,14 @@ import { ArrowLeft, Edit, AlertTriangle } from "lucide-react"
 import Link from "next/link"
 import { DrugDialog } from "@/components/drug-dialog"
 import { DeleteConfirmDialog } from "@/components/delete-confirm-dialog"
-import type { Drug } from "@/lib/types"
-import { fetchDrug, fetchCategories, deleteDrug } from "@/lib/api"
+import type { Drug, SimilarDrug } from "@/lib/types"
+import { fetchDrug, fetchCategories, fetchSimilarDrugs, deleteDrug } from "@/lib/api"
 import { useToast } from "@/components/ui/use-toast"
 
 export default function DrugDetailPage({ params }: { params: { id: string } }) {
   const [drug, setDrug] = useState<Drug | null>(null)
   const [categories, setCategories] = useState<string[]>([])
+  const [similarDrugs, setSimilarDrugs] = useState<SimilarDrug[]>([])
   const [loading, setLoading] = useState(true)
   const [showEditDialog, setShowEditDialog] = useState(false)
   const [showDeleteDialog, setShowDeleteDialog] = useState(false)
@@ -34,6 +35,11 @@ export default function DrugDetailPage({ params }: { params: { id: string } }) {
 
           const categoriesData = await fetchCategories()
           setCategories(categoriesData)
+
+          // Related drugs are optional; the page works without them
+          fetchSimilarDrugs(params.id)
+            .then(setSimilarDrugs)
+            .catch((similarError) => console.warn("Related drugs not available:", similarError))
         } catch (apiError) {
           console.warn("API not available:", apiError)
 
@@ -197,6 +203,31 @@ export default function DrugDetailPage({ params }: { params: { id: string } }) {
               </div>
             </CardContent>
           </Card>
+
+          {similarDrugs.length > 0 && (
+            <Card className="mt-6">
+              <CardHeader>
+                <CardTitle>Related Drugs</CardTitle>
+                <CardDescription>Drugs with similar ingredients, category and side effects</CardDescription>
+              </CardHeader>
+              <CardContent>
+                <ul className="space-y-3">
+                  {similarDrugs.map((similar) => (
+                    <li key={similar.id}>
+                      <Link href={`/drugs/${similar.id}`} className="font-medium hover:underline">
+                        {similar.name}
+                      </Link>
+                      <p className="text-sm text-gray-500">
+                        {similar.shared_ingredients.length > 0
+                          ? `Shares ${similar.shared_ingredients.join(", ")}`
+                          : similar.category}
+                      </p>
+                    </li>
+                  ))}
+                </ul>
+              </CardContent>
+            </Card>
+          )}
         </div>
 
         <div className="md:col-span-2">
@@ -1,4 +1,4 @@
-import type { Drug } from "./types"
+import type { Drug, SimilarDrug } from "./types"
 import { config } from "./config"
 import { logger } from "./logger"
 
@@ -12,6 +12,7 @@ interface FetchDrugsParams {
   created_before?: string
   skip?: number
   limit?: number
+  fields?: string
 }
 
 async function handleApiResponse(response: Response) {
@@ -90,6 +91,10 @@ export async function fetchDrug(id: string): Promise<Drug> {
   return makeApiRequest(`${API_URL}/drugs/${id}`)
 }
 
+export async function fetchSimilarDrugs(id: string, limit = 5): Promise<SimilarDrug[]> {
+  return makeApiRequest(`${API_URL}/drugs/${id}/similar?limit=${limit}`)
+}
+
 export async function fetchCategories(): Promise<string[]> {
   return makeApiRequest(`${API_URL}/categories`)
 }
@@ -10,3 +10,11 @@ export interface Drug {
   created_at: string
   updated_at: string
 }
+
+export interface SimilarDrug {
+  id: string
+  name: string
+  category: string
+  score: number
+  shared_ingredients: string[]
+}
@@ -0,0 +1,206 @@
+"""
+Rate limiting and admission control.
+
+Two layers protect the database from bursts:
+
+- A token bucket per client (``X-API-Key`` header, else client address)
+  refills at ``rate_limit_per_second`` up to ``rate_limit_burst`` tokens.
+  Expensive endpoints cost ``rate_limit_expensive_cost`` tokens. Buckets
+  live in process memory, or in Redis (``rate_limit_backend="redis"``) so
+  all workers share them. An empty bucket answers 429.
+- Admission control caps concurrent requests separately for cheap and
+  expensive endpoints. Requests over the cap wait in a short queue; when
+  the queue is full or the wait times out the request is shed with 503.
+
+Both responses carry ``Retry-After``.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+from config import Settings
+
+# Endpoints that fan out into large scans, aggregates or counts
+EXPENSIVE_ROUTES = {("GET", "/drugs"), ("GET", "/drugs/search")}
+
+# Never limited: probes, metrics, docs and the change feed (whose
+# long-polls wait rather than work)
+EXEMPT_PATHS = {
+    "/", "/health", "/health/live", "/health/ready", "/metrics", "/docs", "/redoc", "/openapi.json", "/changes",
+}
+
+class MemoryRateLimiter:
+    """Token buckets in process memory; each worker limits on its own"""
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = Lock()
+
+    async def acquire(self, key: str, cost: float = 1) -> float:
+        """Take ``cost`` tokens; returns 0 if allowed, else seconds until
+        enough tokens will have refilled"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+# Refill, take and store atomically inside Redis, on Redis' clock
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisRateLimiter:
+    """Token buckets in Redis, shared by every worker and instance"""
+
+    def __init__(self, rate: float, burst: int, url: str, prefix: str = "drug-api:ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("rate_limit_backend='redis' requires the redis package") from None
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key: str, cost: float = 1) -> float:
+        wait = await self._script(keys=[self.prefix + key], args=[self.rate, self.burst, cost])
+        return float(wait)
+
+class AdmissionController:
+    """At most ``max_inflight`` requests at once, plus up to ``max_queue``
+    waiting no longer than ``queue_timeout`` seconds"""
+
+    def __init__(self, max_inflight: int, max_queue: int, queue_timeout: float):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_inflight)
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        return True
+
+    def release(self):
+        self.inflight -= 1
+        self._semaphore.release()
+
+def create_rate_limiter(app_settings: Settings):
+    if app_settings.rate_limit_backend == "redis":
+        return RedisRateLimiter(
+            app_settings.rate_limit_per_second, app_settings.rate_limit_burst, app_settings.rate_limit_redis_url
+        )
+    return MemoryRateLimiter(app_settings.rate_limit_per_second, app_settings.rate_limit_burst)
+
+def client_key(request: Request) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return f"key:{api_key}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def is_expensive(request: Request) -> bool:
+    return (request.method, request.url.path.rstrip("/") or "/") in EXPENSIVE_ROUTES
+
+def shed_response(status_code: int, code: str, message: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"code": code, "message": message, "status": status_code}},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+class AdmissionMiddleware(BaseHTTPMiddleware):
+    """Applies the rate limiter and the per-cost admission controllers"""
+
+    def __init__(self, app, app_settings: Settings):
+        super().__init__(app)
+        self.settings = app_settings
+        self.rate_limiter = create_rate_limiter(app_settings) if app_settings.rate_limit_enabled else None
+        self.controllers = None
+        if app_settings.admission_control:
+            self.controllers = {
+                False: AdmissionController(
+                    app_settings.admission_max_inflight_cheap,
+                    app_settings.admission_max_queue,
+                    app_settings.admission_queue_timeout,
+                ),
+                True: AdmissionController(
+                    app_settings.admission_max_inflight_expensive,
+                    app_settings.admission_max_queue,
+                    app_settings.admission_queue_timeout,
+                ),
+            }
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path in EXEMPT_PATHS:
+            return await call_next(request)
+        expensive = is_expensive(request)
+
+        if self.rate_limiter is not None:
+            cost = self.settings.rate_limit_expensive_cost if expensive else 1
+            wait = await self.rate_limiter.acquire(client_key(request), cost)
+            if wait > 0:
+                return shed_response(
+                    status.HTTP_429_TOO_MANY_REQUESTS, "rate_limited", "Too many requests", wait
+                )
+
+        if self.controllers is None:
+            return await call_next(request)
+        controller = self.controllers[expensive]
+        if not await controller.acquire():
+            return shed_response(
+                status.HTTP_503_SERVICE_UNAVAILABLE, "overloaded",
+                "Server is busy, retry shortly", controller.queue_timeout
+            )
+        try:
+            return await call_next(request)
+        finally:
+            controller.release()
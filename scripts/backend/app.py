@@ -1,250 +1,162 @@
-from fastapi import FastAPI, HTTPException, Query, status, Depends, Request
+from fastapi import APIRouter, Body, FastAPI, Header, HTTPException, Query, status, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy import create_engine, Column, String, DateTime, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.dialects.sqlite import JSON
-from typing import List, Optional
-from pydantic import BaseModel, validator, ValidationError
-import uuid
-from datetime import datetime, date
-import uvicorn
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from typing import List, Literal, Optional, Tuple
+from pydantic import ValidationError
+from datetime import date
 import logging
-import traceback
+import os
+import time
+import uuid
 
 # Import configuration
-from config import settings
-
-# Configure structured logging
-logging.basicConfig(
-    level=getattr(logging, settings.log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from config import Settings, settings, ensure_database_directory, use_settings, validate_settings
+import database
+from database import Base, ReadSessionLocal, SessionLocal, get_db, get_read_db
+from models import Drug as DrugModel
+from schemas import (
+    DRUG_FIELDS, ArrayPatchOperation, Drug, DrugChange, DrugCreate, DrugSearchResult,
+    DrugSuggestion, DrugUpdate, Job, JobCreate, ScreeningResult, SimilarDrug, get_projection_model,
 )
-logger = logging.getLogger(__name__)
-
-# Database setup with configuration
-engine = create_engine(
-    settings.database_url,
-    connect_args=settings.get_database_connect_args()
+from crud import (
+    backfill_facet_rows, build_search_indexes, count_drugs, create_drug, delete_drug,
+    facet_cache, get_categories, get_changes, get_drug_by_id, get_drugs, get_facet_counts, get_similar_drugs,
+    init_table_counts, patch_drug, read_flights, update_drug, VersionConflictError,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Database Models
-class DrugModel(Base):
-    __tablename__ = "drugs"
-
-    id = Column(String, primary_key=True, index=True)
-    name = Column(String, nullable=False, index=True)
-    category = Column(String, nullable=False, index=True)
-    description = Column(Text, nullable=False)
-    active_ingredients = Column(JSON, nullable=False)
-    dosage_forms = Column(JSON, nullable=False)
-    side_effects = Column(JSON, nullable=True, default=[])
-    contraindications = Column(JSON, nullable=True, default=[])
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# FastAPI app with configuration
-app = FastAPI(
-    title=settings.api_title,
-    description=settings.api_description,
-    version=settings.api_version,
-    docs_url="/docs" if settings.enable_swagger_ui else None,
-    redoc_url="/redoc" if settings.enable_swagger_ui else None,
+from admission import AdmissionMiddleware
+from changes import change_notifier
+from formats import JSON, encode as encode_records, negotiate
+from health import readiness_probe
+from jobs import (
+    JOB_KINDS, SUCCEEDED, JobQueueFull, cancel_job, get_job, job_runner, list_jobs, queue_similar_rebuild, submit_job,
 )
+from screening import MAX_CONDITIONS as MAX_SCREENING_CONDITIONS, contraindication_index
+from similar import similar_drugs
+from snapshot import catalogue
+from logs import client_error_level, configure_logging, stop_logging
+from tracing import (
+    TracedJSONResponse, TracedRoute, TracingMiddleware, instrument_engine, start_span, tracer,
+)
+from suggest import suggest_index
+from trigram import ensure_pg_trgm_index
+from writer import group_writer
+
+logger = logging.getLogger(__name__)
+
+def bootstrap_schema(app_settings: Settings):
+    """Create missing tables and indexes (development convenience; disable
+    with BOOTSTRAP_SCHEMA=false when the schema is managed by migrations)"""
+    ensure_database_directory(app_settings)
+    Base.metadata.create_all(bind=database.engine)
+    if app_settings.is_postgresql:
+        ensure_pg_trgm_index(database.engine)
+
+router = APIRouter(route_class=TracedRoute)
 
 # Global exception handlers
-@app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    logger.error(f"HTTP Exception: {exc.status_code} - {exc.detail}", 
-                extra={"status_code": exc.status_code, "path": request.url.path})
+    level = logging.ERROR if exc.status_code >= 500 else client_error_level(request)
+    if logger.isEnabledFor(level):
+        logger.log(
+            level, "HTTP exception: %s - %s", exc.status_code, exc.detail,
+            extra={"status_code": exc.status_code, "path": request.url.path}
+        )
     return JSONResponse(
         status_code=exc.status_code,
         content={"error": {"code": "http_error", "message": exc.detail, "status": exc.status_code}}
     )
 
-@app.exception_handler(ValidationError)
 async def validation_exception_handler(request: Request, exc: ValidationError):
-    logger.error(f"Validation Error: {exc.errors()}", 
-                extra={"path": request.url.path, "errors": exc.errors()})
+    level = client_error_level(request)
+    if logger.isEnabledFor(level):
+        logger.log(level, "Validation error", extra={"path": request.url.path, "errors": exc.errors()})
     return JSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content={"error": {"code": "validation_error", "message": "Validation failed", "details": exc.errors()}}
     )
 
-@app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled Exception: {str(exc)}", 
-                extra={"path": request.url.path, "traceback": traceback.format_exc()})
+    # The traceback is rendered by the log writer thread, not here
+    logger.error(
+        "Unhandled exception: %s", exc,
+        exc_info=(type(exc), exc, exc.__traceback__), extra={"path": request.url.path}
+    )
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"error": {"code": "internal_error", "message": "An internal server error occurred"}}
     )
 
-# Add CORS middleware if enabled
-if settings.enable_cors:
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=settings.cors_origins_list,
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
-    logger.info(f"CORS enabled for origins: {settings.cors_origins_list}")
+# Optimistic concurrency
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Read the expected version from an ``If-Match`` header.
 
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
+    Accepts ``"3"``, ``W/"3"`` or a bare ``3``; ``*`` (or no header) means
+    any version.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
     try:
-        yield db
-    finally:
-        db.close()
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a drug version ETag")
 
-# Pydantic Models
-class DrugBase(BaseModel):
-    name: str
-    category: str
-    description: str
-    active_ingredients: List[str]
-    dosage_forms: List[str]
-    side_effects: List[str] = []
-    contraindications: List[str] = []
-
-    @validator('name')
-    def name_must_not_be_empty(cls, v):
-        if not v or not v.strip():
-            raise ValueError('Name cannot be empty')
-        return v.strip()
-
-    @validator('category')
-    def category_must_not_be_empty(cls, v):
-        if not v or not v.strip():
-            raise ValueError('Category cannot be empty')
-        return v.strip()
-
-class DrugCreate(DrugBase):
-    id: Optional[str] = None
-
-class DrugUpdate(BaseModel):
-    name: Optional[str] = None
-    category: Optional[str] = None
-    description: Optional[str] = None
-    active_ingredients: Optional[List[str]] = None
-    dosage_forms: Optional[List[str]] = None
-    side_effects: Optional[List[str]] = None
-    contraindications: Optional[List[str]] = None
-
-    @validator('name')
-    def name_must_not_be_empty(cls, v):
-        if v is not None and not v.strip():
-            raise ValueError('Name cannot be empty')
-        return v.strip() if v else v
-
-    @validator('category')
-    def category_must_not_be_empty(cls, v):
-        if v is not None and not v.strip():
-            raise ValueError('Category cannot be empty')
-        return v.strip() if v else v
-
-class Drug(DrugBase):
-    id: str
-    created_at: datetime
-    updated_at: datetime
-
-    class Config:
-        orm_mode = True
-
-class ErrorResponse(BaseModel):
-    detail: str
-
-# Database operations
-def get_drug_by_id(db: Session, drug_id: str):
-    return db.query(DrugModel).filter(DrugModel.id == drug_id).first()
-
-def get_drugs(
-    db: Session,
-    name: Optional[str] = None,
-    category: Optional[str] = None,
-    ingredient: Optional[str] = None,
-    created_after: Optional[date] = None,
-    created_before: Optional[date] = None,
-    skip: int = 0,
-    limit: int = 100
-):
-    query = db.query(DrugModel)
-    
-    if name:
-        query = query.filter(DrugModel.name.ilike(f"%{name}%"))
-    if category:
-        query = query.filter(DrugModel.category.ilike(f"%{category}%"))
-    if ingredient:
-        query = query.filter(DrugModel.active_ingredients.like(f"%{ingredient}%"))
-    if created_after:
-        query = query.filter(DrugModel.created_at >= created_after)
-    if created_before:
-        query = query.filter(DrugModel.created_at <= created_before)
-    
-    return query.order_by(DrugModel.name).offset(skip).limit(limit).all()
-
-def get_categories(db: Session):
-    categories = db.query(DrugModel.category).distinct().all()
-    return [category[0] for category in categories]
-
-def create_drug(db: Session, drug: DrugCreate):
-    if drug.id:
-        existing_drug = get_drug_by_id(db, drug.id)
-        if existing_drug:
-            return existing_drug
-        drug_id = drug.id
-    else:
-        drug_id = str(uuid.uuid4())
-    
-    db_drug = DrugModel(
-        id=drug_id,
-        name=drug.name,
-        category=drug.category,
-        description=drug.description,
-        active_ingredients=drug.active_ingredients,
-        dosage_forms=drug.dosage_forms,
-        side_effects=drug.side_effects,
-        contraindications=drug.contraindications
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+async def version_conflict_handler(request: Request, exc: VersionConflictError):
+    level = client_error_level(request)
+    if logger.isEnabledFor(level):
+        logger.log(level, "Version conflict: %s", exc, extra={"path": request.url.path})
+    return JSONResponse(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        content={"error": {"code": "version_conflict", "message": str(exc), "status": 412}}
     )
-    
-    db.add(db_drug)
-    db.commit()
-    db.refresh(db_drug)
-    return db_drug
-
-def update_drug(db: Session, drug_id: str, drug_update: DrugUpdate):
-    db_drug = get_drug_by_id(db, drug_id)
-    if not db_drug:
+
+# Sparse fieldsets
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Parse a comma-separated ``fields`` parameter into an ordered projection.
+
+    Returns None when no projection was requested. The ``id`` field is always
+    included so clients can address the returned records.
+    """
+    if not fields:
         return None
-    
-    update_data = drug_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_drug, field, value)
-    
-    db_drug.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_drug)
-    return db_drug
-
-def delete_drug(db: Session, drug_id: str):
-    db_drug = get_drug_by_id(db, drug_id)
-    if not db_drug:
-        return False
-    
-    db.delete(db_drug)
-    db.commit()
-    return True
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(DRUG_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    requested.add("id")
+    return tuple(field for field in DRUG_FIELDS if field in requested)
+
+def encode_drugs(rows, fields: Optional[Tuple[str, ...]]):
+    """JSON-ready content for drug rows; projected rows go through their
+    projection model instead of the full ``Drug`` model"""
+    if fields is None:
+        def encode(row):
+            return Drug.from_orm(row)
+    else:
+        model = get_projection_model(fields)
+
+        def encode(row):
+            return model(**row._mapping)
+    if rows is None:
+        return None
+    with start_span("orm.validate", rows=len(rows) if isinstance(rows, list) else 1):
+        models = [encode(row) for row in rows] if isinstance(rows, list) else encode(rows)
+    with start_span("response.encode"):
+        return jsonable_encoder(models)
 
 # API Endpoints
-@app.get("/")
+@router.get("/")
 def read_root():
     return {
         "message": f"Welcome to {settings.api_title}",
@@ -252,118 +164,520 @@ def read_root():
         "environment": "development" if settings.debug else "production"
     }
 
-@app.get("/health")
+@router.get("/health")
+@router.get("/health/live")
 def health_check():
+    """Liveness: the process is up and serving requests"""
     return {
         "status": "healthy",
-        "database": "connected",
         "version": settings.api_version
     }
 
-@app.get("/drugs", response_model=List[Drug])
+@router.get("/health/ready")
+async def readiness_check():
+    """Readiness: dependencies answer quickly enough to take traffic"""
+    result = await readiness_probe.check()
+    status_code = status.HTTP_200_OK if result["status"] == "ready" else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=status_code, content={**result, "version": settings.api_version})
+
+@router.get("/metrics")
+def metrics():
+    return {"coalescing": read_flights.stats(), "snapshot": catalogue.stats()}
+
+@router.get("/drugs", response_model=List[Drug])
 def get_drugs_endpoint(
     name: Optional[str] = None,
-    category: Optional[str] = None,
+    category: Optional[str] = Query(None, description="Exact category, as listed by GET /categories"),
     ingredient: Optional[str] = None,
     created_after: Optional[date] = None,
     created_before: Optional[date] = None,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    fuzzy: bool = Query(False, description="Match names by trigram similarity instead of substring"),
+    include_total: Optional[Literal["exact", "estimated", "capped"]] = Query(
+        None, description="Report the total match count in the X-Total-Count header"
+    ),
+    accept: Optional[str] = Header(None, description="application/msgpack or application/vnd.apache.arrow.stream for binary pages"),
+    db: Session = Depends(get_read_db)
+):
+    projection = parse_fields(fields)
+    media_type = negotiate(accept)
+    snapshot = catalogue.get()
+    # Fuzzy matching on PostgreSQL ranks with pg_trgm, which only the database can do
+    if snapshot is not None and not (name and fuzzy and settings.is_postgresql):
+        matches = snapshot.matches(name, category, ingredient, created_after, created_before, fuzzy)
+        if include_total:
+            matches = list(matches)
+        if media_type == JSON:
+            body = snapshot.render_drugs(matches, skip, limit, projection)
+        else:
+            records = snapshot.records(matches, skip, limit, projection)
+            body = encode_records(media_type, records, projection or DRUG_FIELDS)
+        response = Response(body, media_type=media_type)
+        if include_total:
+            # Counting the snapshot is cheap, so every mode gets an exact count
+            response.headers["X-Total-Count"] = str(snapshot.count(matches))
+            response.headers["X-Total-Count-Mode"] = "exact"
+    else:
+        # Identical concurrent listings share one query and its encoded result
+        content = read_flights.do(
+            ("drugs", name, category, ingredient, created_after, created_before, skip, limit, projection, fuzzy),
+            lambda: encode_drugs(
+                get_drugs(db, name, category, ingredient, created_after, created_before, skip, limit, projection, fuzzy),
+                projection,
+            ),
+        )
+        if media_type == JSON:
+            response = TracedJSONResponse(content=content)
+        else:
+            response = Response(encode_records(media_type, content, projection or DRUG_FIELDS), media_type=media_type)
+        if include_total:
+            total, mode = count_drugs(
+                db, include_total, name, category, ingredient, created_after, created_before, fuzzy
+            )
+            response.headers["X-Total-Count"] = total
+            response.headers["X-Total-Count-Mode"] = mode
+    response.headers["Vary"] = "Accept"
+    return response
+
+@router.get("/drugs/suggest", response_model=List[DrugSuggestion])
+def suggest_drugs_endpoint(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    fuzzy: bool = False
+):
+    return suggest_index.suggest(q, limit, fuzzy)
+
+@router.get("/drugs/screen", response_model=ScreeningResult)
+def screen_drugs_endpoint(
+    condition: List[str] = Query(..., description="Patient condition; repeat for several"),
+    match: Literal["any", "all"] = "any",
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
 ):
-    return get_drugs(db, name, category, ingredient, created_after, created_before, skip, limit)
+    if len(condition) > MAX_SCREENING_CONDITIONS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_SCREENING_CONDITIONS} conditions can be screened at once"
+        )
+    return contraindication_index.screen(condition, match == "all", skip, limit)
+
+@router.get("/drugs/search", response_model=DrugSearchResult)
+def search_drugs_endpoint(
+    name: Optional[str] = None,
+    category: Optional[str] = Query(None, description="Exact category, as listed by GET /categories"),
+    ingredient: Optional[str] = None,
+    dosage_form: Optional[str] = None,
+    created_after: Optional[date] = None,
+    created_before: Optional[date] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    facet_limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    results = get_drugs(
+        db, name, category, ingredient, created_after, created_before, skip, limit,
+        dosage_form=dosage_form
+    )
+    facets = get_facet_counts(
+        db, name, category, ingredient, dosage_form, created_after, created_before, facet_limit
+    )
+    return {"results": results, "facets": facets}
 
-@app.get("/categories")
-def get_categories_endpoint(db: Session = Depends(get_db)):
-    return get_categories(db)
+@router.get("/categories")
+def get_categories_endpoint(db: Session = Depends(get_read_db)):
+    snapshot = catalogue.get()
+    if snapshot is not None:
+        return snapshot.categories
+    return read_flights.do(("categories",), lambda: get_categories(db))
 
-@app.get("/drugs/{drug_id}", response_model=Drug)
-def get_drug_endpoint(drug_id: str, db: Session = Depends(get_db)):
-    drug = get_drug_by_id(db, drug_id)
-    if not drug:
+def read_changes(db: Session, since: int, limit: int) -> List[DrugChange]:
+    try:
+        return [DrugChange.from_orm(change) for change in get_changes(db, since, limit)]
+    finally:
+        # End the read transaction so waiting between polls holds no locks
+        db.rollback()
+
+async def wait_for_changes(db: Session, since: int, limit: int, timeout: float) -> List[DrugChange]:
+    """Changes after ``since``, waiting up to ``timeout`` seconds for one.
+
+    Commits in this process wake the wait immediately; the log is re-read
+    at least every ``change_poll_interval`` for writes from other workers.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        published = change_notifier.latest
+        changes = await run_in_threadpool(read_changes, db, since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        await change_notifier.wait(published, min(remaining, settings.change_poll_interval))
+
+async def stream_changes(request: Request, db: Session, since: int, limit: int):
+    """Server-sent events: one ``change`` event per log entry, ``id`` = seq"""
+    while not await request.is_disconnected():
+        changes = await wait_for_changes(db, since, limit, settings.change_heartbeat_seconds)
+        if not changes:
+            yield ": keep-alive\n\n"
+        for change in changes:
+            yield f"id: {change.seq}\nevent: change\ndata: {change.json()}\n\n"
+            since = change.seq
+
+@router.get("/changes", response_model=List[DrugChange])
+async def list_changes_endpoint(
+    request: Request,
+    since: int = Query(0, ge=0, description="Return changes with a sequence number above this"),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=60, description="Seconds to long-poll when there are no changes yet"),
+    stream: bool = Query(False, description="Stream changes as server-sent events"),
+    last_event_id: Optional[int] = Header(None),
+    db: Session = Depends(get_read_db)
+):
+    """Change feed of drug creates, updates and deletes in commit order"""
+    if stream or "text/event-stream" in request.headers.get("accept", ""):
+        # Reconnecting EventSource clients resume from the last event they saw
+        if last_event_id is not None:
+            since = max(since, last_event_id)
+        return StreamingResponse(
+            stream_changes(request, db, since, limit),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
+    return await wait_for_changes(db, since, limit, wait)
+
+@router.get("/drugs/{drug_id}", response_model=Drug)
+def get_drug_endpoint(
+    drug_id: str,
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    db: Session = Depends(get_read_db)
+):
+    projection = parse_fields(fields)
+    snapshot = catalogue.get()
+    if snapshot is not None:
+        body = snapshot.render_drug(drug_id, projection)
+        if body is None:
+            raise HTTPException(status_code=404, detail="Drug not found")
+        response = Response(body, media_type="application/json")
+        version = snapshot.drug_version(drug_id)
+    else:
+        content = read_flights.do(
+            ("drug", drug_id, projection),
+            lambda: encode_drugs(get_drug_by_id(db, drug_id, projection), projection),
+        )
+        if content is None:
+            raise HTTPException(status_code=404, detail="Drug not found")
+        response = TracedJSONResponse(content=content)
+        version = content.get("version")
+    if projection is None or "version" in projection:
+        response.headers["ETag"] = etag(version)
+    return response
+
+@router.get("/drugs/{drug_id}/similar", response_model=List[SimilarDrug])
+def get_similar_drugs_endpoint(
+    drug_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_read_db)
+):
+    drug = get_drug_by_id(db, drug_id, ("id", "active_ingredients"))
+    if drug is None:
         raise HTTPException(status_code=404, detail="Drug not found")
-    return drug
+    return get_similar_drugs(db, drug_id, drug.active_ingredients, limit)
 
-@app.post("/drugs", response_model=Drug, status_code=status.HTTP_201_CREATED)
-def create_drug_endpoint(drug: DrugCreate, db: Session = Depends(get_db)):
-    return create_drug(db, drug)
+def write(db: Session, operation, *args):
+    """Run a crud write on the request session, or batch it with other
+    requests' writes when group commit is enabled"""
+    if group_writer.running:
+        return group_writer.submit(lambda batch_db: operation(batch_db, *args))
+    return operation(db, *args)
 
-@app.put("/drugs/{drug_id}", response_model=Drug)
-def update_drug_endpoint(drug_id: str, drug_update: DrugUpdate, db: Session = Depends(get_db)):
-    updated_drug = update_drug(db, drug_id, drug_update)
+@router.post("/drugs", response_model=Drug, status_code=status.HTTP_201_CREATED)
+def create_drug_endpoint(drug: DrugCreate, db: Session = Depends(get_db)):
+    return write(db, create_drug, drug)
+
+@router.put("/drugs/{drug_id}", response_model=Drug)
+def update_drug_endpoint(
+    response: Response,
+    drug_id: str,
+    drug_update: DrugUpdate,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    updated_drug = write(db, update_drug, drug_id, drug_update, parse_if_match(if_match))
     if not updated_drug:
         raise HTTPException(status_code=404, detail="Drug not found")
+    response.headers["ETag"] = etag(updated_drug.version)
     return updated_drug
 
-@app.delete("/drugs/{drug_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_drug_endpoint(drug_id: str, db: Session = Depends(get_db)):
-    if not delete_drug(db, drug_id):
+@router.patch("/drugs/{drug_id}", response_model=Drug)
+def patch_drug_endpoint(
+    response: Response,
+    drug_id: str,
+    operations: List[ArrayPatchOperation] = Body(..., min_items=1),
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Add or remove individual array elements without resending the lists"""
+    patched_drug = write(db, patch_drug, drug_id, operations, parse_if_match(if_match))
+    if not patched_drug:
+        raise HTTPException(status_code=404, detail="Drug not found")
+    response.headers["ETag"] = etag(patched_drug.version)
+    return patched_drug
+
+@router.delete("/drugs/{drug_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_drug_endpoint(
+    drug_id: str,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    if not write(db, delete_drug, drug_id, parse_if_match(if_match)):
         raise HTTPException(status_code=404, detail="Drug not found")
     return None
 
+# Background jobs
+def queue_job(db: Session, response: Response, kind: str, params: Optional[dict] = None,
+              job_id: Optional[str] = None) -> Job:
+    try:
+        job = submit_job(db, kind, params, settings.job_max_queued, job_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except JobQueueFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "30"})
+    job_runner.wake()
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return Job.from_orm(job)
+
+@router.post("/jobs", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+def create_job_endpoint(job: JobCreate, response: Response, db: Session = Depends(get_db)):
+    """Start an export or analytics run; poll the returned job for progress"""
+    return queue_job(db, response, job.kind, job.params)
+
+@router.post("/jobs/import", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def create_import_job_endpoint(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Create or update drugs from a JSON lines body (one drug per line, as
+    produced by an export job)"""
+    job_id = str(uuid.uuid4())
+    path = job_runner.input_path(job_id)
+    os.makedirs(job_runner.directory, exist_ok=True)
+    with open(path, "wb") as upload:
+        async for chunk in request.stream():
+            upload.write(chunk)
+    try:
+        return await run_in_threadpool(queue_job, db, response, "import", None, job_id)
+    except Exception:
+        os.remove(path)
+        raise
+
+@router.get("/jobs", response_model=List[Job])
+def list_jobs_endpoint(
+    status: Optional[Literal["queued", "running", "succeeded", "failed", "cancelled"]] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    return list_jobs(db, status, limit)
+
+@router.get("/jobs/{job_id}", response_model=Job)
+def get_job_endpoint(job_id: str, db: Session = Depends(get_db)):
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.delete("/jobs/{job_id}", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+def cancel_job_endpoint(job_id: str, db: Session = Depends(get_db)):
+    """Cancel a queued job, or ask a running one to stop"""
+    job = cancel_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+def get_job_result_endpoint(job_id: str, db: Session = Depends(get_db)):
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != SUCCEEDED or not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=409, detail=f"Job has no result (status: {job.status})")
+    kind = JOB_KINDS[job.kind]
+    return FileResponse(job.result_path, media_type=kind.media_type, filename=f"{job.kind}-{job.id}.{kind.extension}")
+
 # Seed data on startup if enabled
-@app.on_event("startup")
-def seed_data():
+def seed_data(db: Session):
     if not settings.seed_database:
         logger.info("Database seeding disabled")
         return
         
+    if db.query(DrugModel).count() == 0:
+        sample_drugs = [
+            DrugCreate(
+                id="amoxicillin-123",
+                name="Amoxicillin",
+                category="Antibiotics",
+                description="A penicillin antibiotic that fights bacteria",
+                active_ingredients=["Amoxicillin Trihydrate"],
+                dosage_forms=["Capsule", "Tablet", "Oral suspension"],
+                side_effects=["Diarrhea", "Stomach upset", "Nausea", "Vomiting", "Rash"],
+                contraindications=["Penicillin allergy", "Mononucleosis"]
+            ),
+            DrugCreate(
+                id="ibuprofen-456",
+                name="Ibuprofen",
+                category="Analgesics",
+                description="Reduces inflammation and treats pain or fever",
+                active_ingredients=["Ibuprofen"],
+                dosage_forms=["Tablet", "Capsule", "Oral suspension", "Topical gel"],
+                side_effects=["Upset stomach", "Heartburn", "Dizziness", "Headache"],
+                contraindications=["Aspirin allergy", "Heart failure", "Stomach ulcers"]
+            ),
+            DrugCreate(
+                id="lisinopril-789",
+                name="Lisinopril",
+                category="Cardiovascular",
+                description="ACE inhibitor that treats high blood pressure",
+                active_ingredients=["Lisinopril"],
+                dosage_forms=["Tablet"],
+                side_effects=["Dizziness", "Headache", "Dry cough", "Fatigue"],
+                contraindications=["Pregnancy", "History of angioedema", "Kidney disease"]
+            ),
+            DrugCreate(
+                id="metformin-101",
+                name="Metformin",
+                category="Antidiabetic",
+                description="Used to treat type 2 diabetes",
+                active_ingredients=["Metformin Hydrochloride"],
+                dosage_forms=["Tablet", "Extended-release tablet"],
+                side_effects=["Nausea", "Diarrhea", "Stomach upset", "Metallic taste"],
+                contraindications=["Kidney disease", "Liver disease", "Heart failure"]
+            ),
+        ]
+        
+        for drug_data in sample_drugs:
+            create_drug(db, drug_data)
+            
+        logger.info("Database seeded with sample data")
+    else:
+        logger.info("Database already contains data, skipping seed")
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API for ``app_settings`` (the process-wide settings by default).
+
+    The settings become the process configuration: the database engine is
+    bound to them and, if ``bootstrap_schema`` is enabled, missing tables
+    are created. Seeding and search index builds run at startup.
+    """
+    if app_settings is not None:
+        use_settings(app_settings)
+    facet_cache.ttl = settings.facet_cache_ttl
+
+    configure_logging(settings)
+
+    database.configure(settings)
+    readiness_probe.reset()
+    tracer.configure(settings)
+    catalogue.configure(settings)
+    job_runner.configure(settings)
+    similar_drugs.configure(settings)
+    if tracer.enabled:
+        instrument_engine(database.engine)
+        instrument_engine(database.read_engine)
+    if settings.bootstrap_schema:
+        bootstrap_schema(settings)
+
+    app = FastAPI(
+        title=settings.api_title,
+        description=settings.api_description,
+        version=settings.api_version,
+        docs_url="/docs" if settings.enable_swagger_ui else None,
+        redoc_url="/redoc" if settings.enable_swagger_ui else None,
+        default_response_class=TracedJSONResponse,
+    )
+    app.add_exception_handler(HTTPException, http_exception_handler)
+    app.add_exception_handler(ValidationError, validation_exception_handler)
+    app.add_exception_handler(VersionConflictError, version_conflict_handler)
+    app.add_exception_handler(Exception, global_exception_handler)
+
+    # Registered before CORS so shed responses still get CORS headers
+    if settings.rate_limit_enabled or settings.admission_control:
+        app.add_middleware(AdmissionMiddleware, app_settings=settings)
+        logger.info(
+            "Rate limiting %s (%s), admission control %s",
+            "on" if settings.rate_limit_enabled else "off", settings.rate_limit_backend,
+            "on" if settings.admission_control else "off"
+        )
+
+    # Add CORS middleware if enabled
+    if settings.enable_cors:
+        app.add_middleware(
+            CORSMiddleware,
+            allow_origins=settings.cors_origins_list,
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["ETag", "Location", "Retry-After", "X-Total-Count", "X-Total-Count-Mode"],
+        )
+        logger.info("CORS enabled for origins: %s", settings.cors_origins_list)
+
+    group_writer.max_batch = settings.group_commit_max_batch
+    group_writer.window = settings.group_commit_window_ms / 1000
+
+    # Outermost, so the request span covers the other middleware too
+    if tracer.enabled:
+        app.add_middleware(TracingMiddleware)
+        logger.info(
+            "Tracing to %s, sampling %s of traces", settings.tracing_exporter, settings.tracing_sample_rate
+        )
+
+    app.include_router(router)
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", job_runner.stop)
+    app.add_event_handler("shutdown", similar_drugs.stop)
+    app.add_event_handler("shutdown", group_writer.stop)
+    app.add_event_handler("shutdown", catalogue.stop)
+    app.add_event_handler("shutdown", tracer.shutdown)
+    app.add_event_handler("shutdown", stop_logging)
+    return app
+
+def startup():
+    """Seed the database and build the in-memory indexes, within a time budget"""
+    started = time.perf_counter()
     db = SessionLocal()
     try:
-        if db.query(DrugModel).count() == 0:
-            sample_drugs = [
-                DrugCreate(
-                    id="amoxicillin-123",
-                    name="Amoxicillin",
-                    category="Antibiotics",
-                    description="A penicillin antibiotic that fights bacteria",
-                    active_ingredients=["Amoxicillin Trihydrate"],
-                    dosage_forms=["Capsule", "Tablet", "Oral suspension"],
-                    side_effects=["Diarrhea", "Stomach upset", "Nausea", "Vomiting", "Rash"],
-                    contraindications=["Penicillin allergy", "Mononucleosis"]
-                ),
-                DrugCreate(
-                    id="ibuprofen-456",
-                    name="Ibuprofen",
-                    category="Analgesics",
-                    description="Reduces inflammation and treats pain or fever",
-                    active_ingredients=["Ibuprofen"],
-                    dosage_forms=["Tablet", "Capsule", "Oral suspension", "Topical gel"],
-                    side_effects=["Upset stomach", "Heartburn", "Dizziness", "Headache"],
-                    contraindications=["Aspirin allergy", "Heart failure", "Stomach ulcers"]
-                ),
-                DrugCreate(
-                    id="lisinopril-789",
-                    name="Lisinopril",
-                    category="Cardiovascular",
-                    description="ACE inhibitor that treats high blood pressure",
-                    active_ingredients=["Lisinopril"],
-                    dosage_forms=["Tablet"],
-                    side_effects=["Dizziness", "Headache", "Dry cough", "Fatigue"],
-                    contraindications=["Pregnancy", "History of angioedema", "Kidney disease"]
-                ),
-                DrugCreate(
-                    id="metformin-101",
-                    name="Metformin",
-                    category="Antidiabetic",
-                    description="Used to treat type 2 diabetes",
-                    active_ingredients=["Metformin Hydrochloride"],
-                    dosage_forms=["Tablet", "Extended-release tablet"],
-                    side_effects=["Nausea", "Diarrhea", "Stomach upset", "Metallic taste"],
-                    contraindications=["Kidney disease", "Liver disease", "Heart failure"]
-                ),
-            ]
-            
-            for drug_data in sample_drugs:
-                create_drug(db, drug_data)
-                
-            logger.info("Database seeded with sample data")
-        else:
-            logger.info("Database already contains data, skipping seed")
+        init_table_counts(db)
+        seed_data(db)
+        backfill_facet_rows(db)
+        build_search_indexes(db)
+        queue_similar_rebuild(db)
     finally:
         db.close()
+    catalogue.start(ReadSessionLocal)
+    similar_drugs.start(SessionLocal)
+    job_runner.start()
+    elapsed = time.perf_counter() - started
+    if elapsed > settings.startup_budget_seconds:
+        logger.warning(
+            "Startup took %.2fs, over the %ss budget", elapsed, settings.startup_budget_seconds
+        )
+    else:
+        logger.info("Startup completed in %.2fs", elapsed)
+
+    if settings.group_commit:
+        group_writer.start()
+        logger.info(
+            "Group commit enabled: up to %d writes per %sms window",
+            group_writer.max_batch, settings.group_commit_window_ms
+        )
+
+def __getattr__(name):
+    # Build the default application on first access (``uvicorn app:app``,
+    # ``from app import app``) so importing this module stays side-effect free
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
+    import uvicorn
+
+    validate_settings()
     uvicorn.run(
         "app:app",
         host=settings.host,
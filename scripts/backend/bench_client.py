@@ -0,0 +1,88 @@
+"""
+Benchmark the client access patterns against a local API server.
+
+Starts the API on a free port backed by a throwaway SQLite database, seeds it
+through the client, then times fetching every drug by id:
+
+    naive     one module-level requests.get per drug (new connection each)
+    pooled    DrugClient, sequential calls over one keep-alive session
+    threaded  DrugClient.get_drugs on a thread pool
+    async     AsyncDrugClient.get_drugs with bounded concurrency
+
+Usage: python bench_client.py [--drugs 500] [--concurrency 10]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+def start_server(database_url: str):
+    # Settings are read at import time, so configure before importing the app
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["SEED_DATABASE"] = "false"
+    os.environ["LOG_LEVEL"] = "WARNING"
+
+    import uvicorn
+    from app import app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+def timed(label: str, count: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed:8.3f}s {count / elapsed:10.1f} req/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--drugs", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, base_url = start_server(f"sqlite:///{tmp}/bench.db")
+
+        import requests
+        from client import AsyncDrugClient, DrugClient
+
+        with DrugClient(base_url, pool_size=args.concurrency) as client:
+            drugs = client.create_drugs(
+                {
+                    "name": f"Bench Drug {i}",
+                    "category": f"Category {i % 10}",
+                    "description": "Benchmark drug",
+                    "active_ingredients": [f"Ingredient {i % 50}"],
+                    "dosage_forms": ["Tablet"],
+                }
+                for i in range(args.drugs)
+            )
+            ids = [drug["id"] for drug in drugs]
+            print(f"Seeded {len(ids)} drugs against {base_url}\n")
+
+            timed("naive", len(ids), lambda: [requests.get(f"{base_url}/drugs/{i}") for i in ids])
+            timed("pooled", len(ids), lambda: [client.get_drug(i) for i in ids])
+            timed("threaded", len(ids), lambda: client.get_drugs(ids))
+
+        async def fetch_async():
+            async with AsyncDrugClient(base_url, concurrency=args.concurrency) as async_client:
+                await async_client.get_drugs(ids)
+
+        timed("async", len(ids), lambda: asyncio.run(fetch_async()))
+
+        server.should_exit = True
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark contraindication screening on a synthetic catalogue.
+
+Builds the in-memory ``ContraindicationIndex`` over generated drugs, each
+with a few contraindications drawn from a skewed vocabulary (a handful of
+conditions such as "Pregnancy" are on a large share of drugs, most are
+rare), then times screening queries of one to five conditions, matching any
+or all of them, returning the first page of 100.
+
+Usage: python bench_screening.py [--drugs 1000000] [--conditions 2000] [--queries 200]
+"""
+
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from screening import ContraindicationIndex
+
+COMMON = ["Pregnancy", "Kidney disease", "Liver disease", "Heart failure", "Hypersensitivity"]
+
+def generate(drugs: int, conditions: int, seed: int = 1):
+    rng = random.Random(seed)
+    vocabulary = COMMON + [f"Condition {i}" for i in range(conditions - len(COMMON))]
+    # Zipf-like: the i-th condition is picked in proportion to 1/(i+1)
+    weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(vocabulary))))
+    return [
+        (f"drug-{i:07d}", f"Drug {i}", list(set(rng.choices(vocabulary, cum_weights=weights, k=rng.randrange(5)))))
+        for i in range(drugs)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--drugs", type=int, default=1_000_000)
+    parser.add_argument("--conditions", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    drugs = generate(args.drugs, args.conditions)
+    index = ContraindicationIndex()
+    start = time.perf_counter()
+    index.build(drugs)
+    print(f"Indexed {len(index):,} drugs in {time.perf_counter() - start:.1f}s\n")
+
+    rng = random.Random(2)
+    vocabulary = COMMON + [f"Condition {i}" for i in range(args.conditions - len(COMMON))]
+    print(f"{'conditions':>10} {'match':>6} {'p50':>8} {'p95':>8} {'matches':>10}")
+    for size in (1, 3, 5):
+        for match_all in (False, True):
+            timings, totals = [], []
+            for _ in range(args.queries):
+                # Always include a common condition, as a real patient list would
+                query = [rng.choice(COMMON)] + rng.sample(vocabulary, size - 1)
+                start = time.perf_counter()
+                result = index.screen(query, match_all, limit=100)
+                timings.append(time.perf_counter() - start)
+                totals.append(result["total"])
+            timings.sort()
+            print(
+                f"{size:>10} {'all' if match_all else 'any':>6} "
+                f"{statistics.median(timings) * 1000:>6.2f}ms {timings[int(len(timings) * 0.95)] * 1000:>6.2f}ms "
+                f"{int(statistics.mean(totals)):>10,}"
+            )
+
+    # Writes keep the index current
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add(f"drug-{rng.randrange(args.drugs):07d}", f"Drug {i}", rng.sample(COMMON, 2))
+    print(f"\n1,000 updates in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark the wire formats for drug listings against a local API server.
+
+Starts the API on a free port backed by a throwaway SQLite database, seeds it
+through the client, then fetches every page of ``GET /drugs`` in each format
+and reports the payload size and the client-side decode time:
+
+    json      application/json
+    msgpack   application/msgpack
+    arrow     application/vnd.apache.arrow.stream (dictionary-encoded)
+
+Formats whose package (msgpack, pyarrow) isn't installed are skipped.
+
+Usage: python bench_wire.py [--drugs 5000] [--page-size 1000] [--rounds 5]
+"""
+
+import argparse
+import tempfile
+import time
+
+from bench_client import start_server
+
+def measure(client, base_url: str, wire_format: str, drugs: int, page_size: int, rounds: int):
+    from client import WIRE_FORMATS, _decode_drugs
+
+    pages = []
+    for skip in range(0, drugs, page_size):
+        response = client.session.get(
+            f"{base_url}/drugs",
+            params={"skip": skip, "limit": page_size},
+            headers={"Accept": WIRE_FORMATS[wire_format]},
+        )
+        response.raise_for_status()
+        pages.append((response.headers["content-type"], response.content))
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decoded = [_decode_drugs(content_type, content) for content_type, content in pages]
+    decode = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        client.list_drugs(limit=page_size)
+    fetch = (time.perf_counter() - start) / rounds
+    return sum(len(content) for _, content in pages), decode, fetch, decoded
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--drugs", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, base_url = start_server(f"sqlite:///{tmp}/bench.db")
+
+        from client import WIRE_FORMATS, DrugClient
+
+        with DrugClient(base_url) as client:
+            # One at a time: concurrent creates contend for SQLite's write lock
+            for drug in (
+                {
+                    "name": f"Bench Drug {i}",
+                    "category": f"Category {i % 10}",
+                    "description": f"Benchmark drug {i}",
+                    "active_ingredients": [f"Ingredient {i % 50}", "Shared Excipient"],
+                    "dosage_forms": ["Tablet", "Capsule"][: 1 + i % 2],
+                    "side_effects": ["Nausea", "Headache", "Dizziness"][: i % 4],
+                    "contraindications": ["Pregnancy"] if i % 3 == 0 else [],
+                }
+                for i in range(args.drugs)
+            ):
+                client.create_drug(drug)
+        print(f"Seeded {args.drugs} drugs against {base_url}\n")
+        print(f"{'format':<10} {'bytes':>12} {'vs json':>8} {'decode/all':>11} {'fetch/page':>11}")
+
+        baseline = None
+        for wire_format in WIRE_FORMATS:
+            try:
+                client = DrugClient(base_url, wire_format=wire_format)
+            except ImportError as exc:
+                print(f"{wire_format:<10} skipped: {exc}")
+                continue
+            with client:
+                size, decode, fetch, decoded = measure(
+                    client, base_url, wire_format, args.drugs, args.page_size, args.rounds
+                )
+            if baseline is None:
+                baseline, expected = size, decoded
+            elif decoded != expected:
+                print(f"{wire_format:<10} decoded drugs differ from JSON")
+            print(
+                f"{wire_format:<10} {size:>12,} {size / baseline:>7.0%} "
+                f"{decode * 1000:>9.1f}ms {fetch * 1000:>9.1f}ms"
+            )
+
+        server.should_exit = True
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Small in-process caches shared by the API's read paths.
+"""
+
+from collections import OrderedDict
+from threading import Event, Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    A ``ttl`` of 0 disables the cache: ``get`` always misses and ``set`` is
+    a no-op, so callers don't need to branch on whether caching is enabled.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait and receive the same result (or exception). Keys are
+    tuples whose first element names the call, which is what ``stats``
+    counts by. ``forget`` makes later callers start a fresh flight, e.g.
+    after a write, so nobody joins a read that began before it.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Tuple, _Flight] = {}
+        self._executions: Dict[str, int] = {}
+        self._coalesced: Dict[str, int] = {}
+        self._lock = Lock()
+
+    def do(self, key: Tuple, func: Callable[[], T]) -> T:
+        name = key[0]
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._executions[name] = self._executions.get(name, 0) + 1
+            else:
+                self._coalesced[name] = self._coalesced.get(name, 0) + 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self):
+        with self._lock:
+            self._flights.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                name: {"executions": executions, "coalesced": self._coalesced.get(name, 0)}
+                for name, executions in self._executions.items()
+            }
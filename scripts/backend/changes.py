@@ -0,0 +1,50 @@
+"""
+Wake-ups for change feed consumers.
+
+Writes append to the ``drug_changes`` log in their own transaction and
+publish the new sequence number here once committed. Long-poll and SSE
+requests wait on the notifier instead of re-querying in a loop; writes made
+by other processes are picked up by the periodic re-check the endpoint does
+anyway (``change_poll_interval``).
+"""
+
+import asyncio
+from threading import Lock
+from typing import Set, Tuple
+
+class ChangeNotifier:
+    """Latest committed change sequence plus the asyncio waiters for it"""
+
+    def __init__(self):
+        self.latest = 0
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._lock = Lock()
+
+    def publish(self, seq: int):
+        """Record a committed change; safe to call from any thread"""
+        with self._lock:
+            self.latest = max(self.latest, seq)
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, since: int, timeout: float) -> bool:
+        """Wait until a change after ``since`` is published or ``timeout``
+        passes; returns whether one was"""
+        if self.latest > since:
+            return True
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            if self.latest > since:
+                return True
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+change_notifier = ChangeNotifier()
@@ -1,117 +1,543 @@
 """
-Example client script to interact with the Drug Data API.
-This demonstrates how to use the API programmatically.
+Python client for the Drug Data API.
+
+``DrugClient`` keeps a pooled, keep-alive ``requests.Session`` with automatic
+retries and runs batch helpers on a thread pool sized to the connection pool.
+``AsyncDrugClient`` offers the same API on ``httpx`` with bounded concurrency.
+
+Both can fetch drug listings as msgpack or Arrow instead of JSON
+(``wire_format="msgpack"`` / ``"arrow"``), which is smaller and faster to
+decode on large pages; the decoded drugs are the same dicts either way.
+
+Run this module directly for a short demo against a local server.
 """
 
-import requests
+import asyncio
 import json
-from datetime import datetime
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # only needed by AsyncDrugClient
+    httpx = None
 
 BASE_URL = "http://localhost:8000"
 
-def print_response(response):
-    """Pretty print the API response"""
+# Largest page GET /drugs will return
+MAX_PAGE_SIZE = 1000
+
+# Accept header sent for drug listings in each wire format
+WIRE_FORMATS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Job states after which a job won't change again
+FINISHED_JOB_STATUSES = ("succeeded", "failed", "cancelled")
+
+# Responses worth retrying: throttling and transient server/proxy failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Methods that are safe to send again. POST is only retried for creates,
+# which carry a client-side id; job submissions would queue duplicate jobs
+IDEMPOTENT_METHODS = Retry.DEFAULT_ALLOWED_METHODS
+
+class DrugAPIError(Exception):
+    """Raised for any non-2xx response from the API"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+def _raise_for_status(response):
+    if response.status_code < 400:
+        return
     try:
-        print(f"Status Code: {response.status_code}")
-        print(f"Response: {json.dumps(response.json(), indent=2)}")
-    except:
-        print(f"Response: {response.text}")
-    print("-" * 50)
-
-def get_all_drugs():
-    """Get all drugs"""
-    print("\nGetting all drugs...")
-    response = requests.get(f"{BASE_URL}/drugs")
-    print_response(response)
-    return response.json() if response.status_code == 200 else []
-
-def search_drugs(name=None, category=None, ingredient=None):
-    """Search for drugs with filters"""
-    params = {}
-    if name:
-        params["name"] = name
-    if category:
-        params["category"] = category
-    if ingredient:
-        params["ingredient"] = ingredient
-    
-    print(f"\nSearching drugs with params: {params}...")
-    response = requests.get(f"{BASE_URL}/drugs", params=params)
-    print_response(response)
-
-def get_drug(drug_id):
-    """Get a specific drug by ID"""
-    print(f"\nGetting drug with ID: {drug_id}...")
-    response = requests.get(f"{BASE_URL}/drugs/{drug_id}")
-    print_response(response)
-
-def create_drug(drug_data):
-    """Create a new drug"""
-    print(f"\nCreating new drug: {drug_data['name']}...")
-    response = requests.post(f"{BASE_URL}/drugs", json=drug_data)
-    print_response(response)
-    return response.json() if response.status_code == 201 else None
-
-def update_drug(drug_id, update_data):
-    """Update an existing drug"""
-    print(f"\nUpdating drug with ID: {drug_id}...")
-    response = requests.put(f"{BASE_URL}/drugs/{drug_id}", json=update_data)
-    print_response(response)
-
-def delete_drug(drug_id):
-    """Delete a drug"""
-    print(f"\nDeleting drug with ID: {drug_id}...")
-    response = requests.delete(f"{BASE_URL}/drugs/{drug_id}")
-    print(f"Status Code: {response.status_code}")
-    print("-" * 50)
+        payload = response.json()
+    except ValueError:
+        raise DrugAPIError(response.status_code, response.text) from None
+    error = payload.get("error") if isinstance(payload, dict) else None
+    if isinstance(error, dict):
+        message = error.get("message", response.text)
+    elif isinstance(payload, dict):
+        message = payload.get("detail", response.text)
+    else:
+        message = response.text
+    raise DrugAPIError(response.status_code, str(message))
+
+def _with_id(drug: Dict[str, Any]) -> Dict[str, Any]:
+    """Give a new drug a client-side id so a retried create stays idempotent"""
+    if drug.get("id"):
+        return drug
+    return {**drug, "id": str(uuid.uuid4())}
+
+def _if_match(version: Optional[int]) -> Dict[str, str]:
+    return {} if version is None else {"If-Match": f'"{version}"'}
+
+def _drop_empty(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in params.items() if value is not None}
+
+def _check_wire_format(wire_format: str):
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"wire_format must be one of {', '.join(WIRE_FORMATS)}")
+    package = {"msgpack": "msgpack", "arrow": "pyarrow"}.get(wire_format)
+    if package is not None:
+        try:
+            __import__(package)
+        except ImportError:
+            raise ImportError(f"wire_format={wire_format!r} requires {package}: pip install {package}") from None
+
+def _decode_drugs(content_type: str, content: bytes) -> List[dict]:
+    """Decode a listing by its Content-Type; the server falls back to JSON
+    when it can't produce the requested format"""
+    media_type = content_type.split(";")[0].strip()
+    if media_type == WIRE_FORMATS["msgpack"]:
+        import msgpack
+
+        return msgpack.unpackb(content, raw=False)
+    if media_type == WIRE_FORMATS["arrow"]:
+        import pyarrow as pa
+
+        drugs = pa.ipc.open_stream(content).read_all().to_pylist()
+        # Timestamps arrive as datetimes; match the JSON strings
+        for drug in drugs:
+            for field in ("created_at", "updated_at"):
+                if drug.get(field) is not None:
+                    drug[field] = drug[field].isoformat()
+        return drugs
+    return json.loads(content)
+
+class DrugClient:
+    """Synchronous client sharing one pooled keep-alive session.
+
+    ``session`` may be any object with a ``requests``-compatible ``request``
+    method (e.g. FastAPI's ``TestClient``); retries and pooling are then up
+    to that object.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.2,
+        timeout: float = 10.0,
+        session=None,
+        wire_format: str = "json"
+    ):
+        _check_wire_format(wire_format)
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.wire_format = wire_format
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=IDEMPOTENT_METHODS,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            # POST /drugs is the only POST under /drugs, and creates are
+            # idempotent by their client-side id (see _with_id)
+            create_retry = retry.new(allowed_methods=IDEMPOTENT_METHODS | {"POST"})
+            session.mount(
+                f"{self.base_url}/drugs",
+                HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=create_retry),
+            )
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method: str, path: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        _raise_for_status(response)
+        return response
+
+    def _map(self, func, items: Iterable) -> List:
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            return list(executor.map(func, items))
+
+    # Reads
+    def list_drugs(self, skip: int = 0, limit: int = 100, **filters) -> List[dict]:
+        params = _drop_empty({**filters, "skip": skip, "limit": limit})
+        headers = {"Accept": WIRE_FORMATS[self.wire_format]}
+        response = self._request("GET", "/drugs", params=params, headers=headers)
+        return _decode_drugs(response.headers.get("content-type", ""), response.content)
+
+    def iter_drugs(self, page_size: int = MAX_PAGE_SIZE, **filters) -> Iterator[dict]:
+        """Yield every drug matching ``filters``, fetching pages as needed"""
+        skip = 0
+        while True:
+            page = self.list_drugs(skip=skip, limit=page_size, **filters)
+            yield from page
+            if len(page) < page_size:
+                return
+            skip += page_size
+
+    def get_drug(self, drug_id: str) -> Optional[dict]:
+        """Fetch one drug, or None if it doesn't exist"""
+        try:
+            return self._request("GET", f"/drugs/{drug_id}").json()
+        except DrugAPIError as exc:
+            if exc.status_code == 404:
+                return None
+            raise
+
+    def get_drugs(self, drug_ids: Iterable[str]) -> List[Optional[dict]]:
+        """Fetch many drugs concurrently; results follow the order of ``drug_ids``"""
+        return self._map(self.get_drug, drug_ids)
+
+    def search(self, **filters) -> dict:
+        return self._request("GET", "/drugs/search", params=_drop_empty(filters)).json()
+
+    def suggest(self, q: str, limit: int = 10, fuzzy: bool = False) -> List[dict]:
+        params = {"q": q, "limit": limit, "fuzzy": str(fuzzy).lower()}
+        return self._request("GET", "/drugs/suggest", params=params).json()
+
+    def screen(self, conditions: Iterable[str], match: str = "any", skip: int = 0, limit: int = 100) -> dict:
+        """Drugs contraindicated in any (``match="all"``: every one) of the
+        patient's ``conditions``"""
+        params = {"condition": list(conditions), "match": match, "skip": skip, "limit": limit}
+        return self._request("GET", "/drugs/screen", params=params).json()
+
+    def categories(self) -> List[str]:
+        return self._request("GET", "/categories").json()
+
+    def get_changes(self, since: int = 0, limit: int = 100, wait: float = 0) -> List[dict]:
+        """Change log entries after ``since``, long-polling up to ``wait`` seconds"""
+        params = {"since": since, "limit": limit, "wait": wait}
+        return self._request("GET", "/changes", params=params, timeout=self.timeout + wait).json()
+
+    # Writes
+    def create_drug(self, drug: Dict[str, Any]) -> dict:
+        return self._request("POST", "/drugs", json=_with_id(drug)).json()
+
+    def create_drugs(self, drugs: Iterable[Dict[str, Any]]) -> List[dict]:
+        """Create many drugs concurrently; results follow the input order"""
+        return self._map(self.create_drug, drugs)
+
+    def update_drug(
+        self, drug_id: str, update: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> dict:
+        """Update a drug; with ``expected_version`` a concurrent edit raises a 412"""
+        headers = _if_match(expected_version)
+        return self._request("PUT", f"/drugs/{drug_id}", json=update, headers=headers).json()
+
+    def patch_drug(
+        self, drug_id: str, operations: List[Dict[str, str]], expected_version: Optional[int] = None
+    ) -> dict:
+        """Apply ``{"op": "add"|"remove", "path": "/field", "value": ...}`` operations"""
+        headers = _if_match(expected_version)
+        return self._request("PATCH", f"/drugs/{drug_id}", json=operations, headers=headers).json()
+
+    def delete_drug(self, drug_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a drug; returns False if it was already gone"""
+        try:
+            self._request("DELETE", f"/drugs/{drug_id}", headers=_if_match(expected_version))
+        except DrugAPIError as exc:
+            if exc.status_code == 404:
+                return False
+            raise
+        return True
+
+    # Bulk export
+    def export_drugs(self, path: str, page_size: int = MAX_PAGE_SIZE, **filters) -> int:
+        """Write every matching drug to ``path`` as JSON lines; returns the count"""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for drug in self.iter_drugs(page_size=page_size, **filters):
+                f.write(json.dumps(drug) + "\n")
+                count += 1
+        return count
+
+    # Background jobs
+    def start_job(self, kind: str, **params) -> dict:
+        """Start an ``export`` or ``analytics`` job; returns the queued job"""
+        return self._request("POST", "/jobs", json={"kind": kind, "params": params}).json()
+
+    def start_import(self, path: str) -> dict:
+        """Upload a JSON lines file (as written by an export) for re-import"""
+        with open(path, "rb") as f:
+            return self._request(
+                "POST", "/jobs/import", data=f, headers={"Content-Type": "application/x-ndjson"}
+            ).json()
+
+    def get_job(self, job_id: str) -> dict:
+        return self._request("GET", f"/jobs/{job_id}").json()
+
+    def cancel_job(self, job_id: str) -> dict:
+        return self._request("DELETE", f"/jobs/{job_id}").json()
+
+    def wait_for_job(self, job_id: str, poll_interval: float = 1.0, timeout: Optional[float] = None) -> dict:
+        """Poll until the job finishes; returns it whatever the outcome"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job["status"] in FINISHED_JOB_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            time.sleep(poll_interval)
+
+    def download_job_result(self, job_id: str, path: str) -> int:
+        """Save a finished job's result to ``path``; returns the bytes written"""
+        response = self._request("GET", f"/jobs/{job_id}/result", stream=True)
+        written = 0
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+class AsyncDrugClient:
+    """Asynchronous client on ``httpx`` with at most ``concurrency`` requests
+    in flight. ``transport`` can be any httpx transport, e.g.
+    ``httpx.ASGITransport(app=app)`` to talk to the API in-process.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        concurrency: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.2,
+        timeout: float = 10.0,
+        transport=None,
+        wire_format: str = "json"
+    ):
+        if httpx is None:
+            raise ImportError("AsyncDrugClient requires httpx: pip install httpx")
+        _check_wire_format(wire_format)
+        self.wire_format = wire_format
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def _backoff(self, attempt: int, response) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def _request(self, method: str, path: str, idempotent: Optional[bool] = None, **kwargs):
+        """Send a request, retrying idempotent ones (``idempotent`` defaults
+        to whether the method is) on transport errors and RETRY_STATUSES"""
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retries = self.retries if idempotent else 0
+        for attempt in range(retries + 1):
+            response = None
+            async with self._semaphore:
+                try:
+                    response = await self._client.request(method, path, **kwargs)
+                except httpx.TransportError:
+                    if attempt == retries:
+                        raise
+            if response is not None and (
+                response.status_code not in RETRY_STATUSES or attempt == retries
+            ):
+                break
+            await asyncio.sleep(self._backoff(attempt, response))
+        _raise_for_status(response)
+        return response
+
+    # Reads
+    async def list_drugs(self, skip: int = 0, limit: int = 100, **filters) -> List[dict]:
+        params = _drop_empty({**filters, "skip": skip, "limit": limit})
+        headers = {"Accept": WIRE_FORMATS[self.wire_format]}
+        response = await self._request("GET", "/drugs", params=params, headers=headers)
+        return _decode_drugs(response.headers.get("content-type", ""), response.content)
+
+    async def iter_drugs(self, page_size: int = MAX_PAGE_SIZE, **filters) -> AsyncIterator[dict]:
+        """Yield every drug matching ``filters``, fetching pages as needed"""
+        skip = 0
+        while True:
+            page = await self.list_drugs(skip=skip, limit=page_size, **filters)
+            for drug in page:
+                yield drug
+            if len(page) < page_size:
+                return
+            skip += page_size
+
+    async def get_drug(self, drug_id: str) -> Optional[dict]:
+        """Fetch one drug, or None if it doesn't exist"""
+        try:
+            return (await self._request("GET", f"/drugs/{drug_id}")).json()
+        except DrugAPIError as exc:
+            if exc.status_code == 404:
+                return None
+            raise
+
+    async def get_drugs(self, drug_ids: Iterable[str]) -> List[Optional[dict]]:
+        """Fetch many drugs concurrently; results follow the order of ``drug_ids``"""
+        return list(await asyncio.gather(*(self.get_drug(drug_id) for drug_id in drug_ids)))
+
+    async def get_changes(self, since: int = 0, limit: int = 100, wait: float = 0) -> List[dict]:
+        """Change log entries after ``since``, long-polling up to ``wait`` seconds"""
+        params = {"since": since, "limit": limit, "wait": wait}
+        timeout = self._client.timeout.read
+        if timeout is not None:
+            timeout += wait
+        return (await self._request("GET", "/changes", params=params, timeout=timeout)).json()
+
+    # Writes
+    async def create_drug(self, drug: Dict[str, Any]) -> dict:
+        return (await self._request("POST", "/drugs", idempotent=True, json=_with_id(drug))).json()
+
+    async def create_drugs(self, drugs: Iterable[Dict[str, Any]]) -> List[dict]:
+        """Create many drugs concurrently; results follow the input order"""
+        return list(await asyncio.gather(*(self.create_drug(drug) for drug in drugs)))
+
+    async def update_drug(
+        self, drug_id: str, update: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> dict:
+        """Update a drug; with ``expected_version`` a concurrent edit raises a 412"""
+        headers = _if_match(expected_version)
+        return (await self._request("PUT", f"/drugs/{drug_id}", json=update, headers=headers)).json()
+
+    async def patch_drug(
+        self, drug_id: str, operations: List[Dict[str, str]], expected_version: Optional[int] = None
+    ) -> dict:
+        """Apply ``{"op": "add"|"remove", "path": "/field", "value": ...}`` operations"""
+        headers = _if_match(expected_version)
+        return (await self._request("PATCH", f"/drugs/{drug_id}", json=operations, headers=headers)).json()
+
+    async def delete_drug(self, drug_id: str, expected_version: Optional[int] = None) -> bool:
+        """Delete a drug; returns False if it was already gone"""
+        try:
+            await self._request("DELETE", f"/drugs/{drug_id}", headers=_if_match(expected_version))
+        except DrugAPIError as exc:
+            if exc.status_code == 404:
+                return False
+            raise
+        return True
+
+    # Bulk export
+    async def export_drugs(self, path: str, page_size: int = MAX_PAGE_SIZE, **filters) -> int:
+        """Write every matching drug to ``path`` as JSON lines; returns the count"""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            async for drug in self.iter_drugs(page_size=page_size, **filters):
+                f.write(json.dumps(drug) + "\n")
+                count += 1
+        return count
+
+    # Background jobs
+    async def start_job(self, kind: str, **params) -> dict:
+        """Start an ``export`` or ``analytics`` job; returns the queued job"""
+        return (await self._request("POST", "/jobs", json={"kind": kind, "params": params})).json()
+
+    async def start_import(self, path: str) -> dict:
+        """Upload a JSON lines file (as written by an export) for re-import"""
+        with open(path, "rb") as f:
+            content = f.read()
+        headers = {"Content-Type": "application/x-ndjson"}
+        return (await self._request("POST", "/jobs/import", content=content, headers=headers)).json()
+
+    async def get_job(self, job_id: str) -> dict:
+        return (await self._request("GET", f"/jobs/{job_id}")).json()
+
+    async def cancel_job(self, job_id: str) -> dict:
+        return (await self._request("DELETE", f"/jobs/{job_id}")).json()
+
+    async def wait_for_job(self, job_id: str, poll_interval: float = 1.0, timeout: Optional[float] = None) -> dict:
+        """Poll until the job finishes; returns it whatever the outcome"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = await self.get_job(job_id)
+            if job["status"] in FINISHED_JOB_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            await asyncio.sleep(poll_interval)
+
+    async def download_job_result(self, job_id: str, path: str) -> int:
+        """Save a finished job's result to ``path``; returns the bytes written"""
+        response = await self._request("GET", f"/jobs/{job_id}/result")
+        with open(path, "wb") as f:
+            f.write(response.content)
+        return len(response.content)
 
 def main():
-    """Main function to demonstrate API usage"""
+    """Short demo of the client against a running API"""
     print("Drug Data API Client Demo")
     print("=" * 50)
-    
-    # Get all drugs
-    drugs = get_all_drugs()
-    
-    # Search for drugs
-    search_drugs(name="amox")
-    search_drugs(category="Analgesics")
-    search_drugs(ingredient="Ibuprofen")
-    
-    # Get a specific drug
-    if drugs:
-        get_drug(drugs[0]["id"])
-    
-    # Create a new drug
-    new_drug = {
-        "id": "metformin-test-123",  # Client-provided ID for idempotency
-        "name": "Metformin",
-        "category": "Antidiabetic",
-        "description": "Used to treat type 2 diabetes",
-        "active_ingredients": ["Metformin Hydrochloride"],
-        "dosage_forms": ["Tablet", "Extended-release tablet"],
-        "side_effects": ["Nausea", "Diarrhea", "Stomach upset"],
-        "contraindications": ["Kidney disease", "Liver disease"]
-    }
-    created_drug = create_drug(new_drug)
-    
-    # Test idempotency by creating the same drug again
-    if created_drug:
-        print("\nTesting idempotency by creating the same drug again...")
-        create_drug(new_drug)
-    
-    # Update a drug
-    if created_drug:
-        update_data = {
+
+    with DrugClient() as client:
+        drugs = list(client.iter_drugs())
+        print(f"Catalogue contains {len(drugs)} drugs")
+
+        for filters in ({"name": "amox"}, {"category": "Analgesics"}, {"ingredient": "Ibuprofen"}):
+            matches = client.list_drugs(**filters)
+            print(f"Search {filters}: {[drug['name'] for drug in matches]}")
+
+        if drugs:
+            drug = client.get_drug(drugs[0]["id"])
+            print(f"Fetched {drug['id']}: {drug['name']}")
+
+        new_drug = {
+            "id": "metformin-test-123",  # Client-provided ID for idempotency
+            "name": "Metformin",
+            "category": "Antidiabetic",
+            "description": "Used to treat type 2 diabetes",
+            "active_ingredients": ["Metformin Hydrochloride"],
+            "dosage_forms": ["Tablet", "Extended-release tablet"],
+            "side_effects": ["Nausea", "Diarrhea", "Stomach upset"],
+            "contraindications": ["Kidney disease", "Liver disease"]
+        }
+        created = client.create_drug(new_drug)
+        again = client.create_drug(new_drug)
+        print(f"Created {created['id']}; repeat create returned same drug: {created['id'] == again['id']}")
+
+        updated = client.update_drug(created["id"], {
             "description": "Updated description: First-line medication for type 2 diabetes",
             "side_effects": ["Nausea", "Diarrhea", "Stomach upset", "Vitamin B12 deficiency"]
-        }
-        update_drug(created_drug["id"], update_data)
-    
-    # Delete a drug
-    if created_drug:
-        delete_drug(created_drug["id"])
-    
+        })
+        print(f"Updated description: {updated['description']}")
+
+        print(f"Deleted: {client.delete_drug(created['id'])}")
+
     print("\nDemo completed!")
 
 if __name__ == "__main__":
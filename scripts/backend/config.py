@@ -1,5 +1,5 @@
 from pydantic import BaseSettings, validator
-from typing import List, Optional
+from typing import Dict, List, Optional
 import os
 from pathlib import Path
 
@@ -11,6 +11,7 @@ class Settings(BaseSettings):
     
     # Database Configuration
     database_url: str = "sqlite:///./drug_database.db"
+    read_database_url: Optional[str] = None
     
     # Server Configuration
     host: str = "0.0.0.0"
@@ -30,9 +31,73 @@ class Settings(BaseSettings):
     enable_cors: bool = True
     enable_swagger_ui: bool = True
     seed_database: bool = True
+    bootstrap_schema: bool = True
+    
+    # Startup Configuration
+    startup_budget_seconds: float = 5.0
+    
+    # Write Batching Configuration
+    group_commit: bool = False
+    group_commit_max_batch: int = 64
+    group_commit_window_ms: float = 5.0
+    
+    # Change Feed Configuration
+    change_poll_interval: float = 1.0
+    change_heartbeat_seconds: float = 15.0
+    
+    # Rate Limiting and Admission Control
+    rate_limit_enabled: bool = False
+    rate_limit_redis_url: Optional[str] = None
+    rate_limit_backend: str = "memory"
+    rate_limit_per_second: float = 10.0
+    rate_limit_burst: int = 50
+    rate_limit_expensive_cost: float = 5.0
+    admission_control: bool = False
+    admission_max_inflight_cheap: int = 64
+    admission_max_inflight_expensive: int = 8
+    admission_max_queue: int = 32
+    admission_queue_timeout: float = 1.0
+    
+    # Readiness Probe Configuration
+    readiness_budget_seconds: float = 1.0
+    readiness_cache_seconds: float = 2.0
+    readiness_max_db_latency_ms: float = 250.0
+    readiness_max_pool_saturation: float = 0.9
+    readiness_max_loop_lag_ms: float = 200.0
+    
+    # Catalogue Snapshot Configuration
+    snapshot_mode: str = "off"
+    snapshot_directory: str = "./snapshots"
+    snapshot_refresh_interval: float = 5.0
+    snapshot_rebuild_delay: float = 0.25
+    
+    # Background Job Configuration
+    job_workers: int = 2
+    job_max_queued: int = 100
+    job_directory: str = "./jobs"
+    job_poll_interval: float = 1.0
+    job_stale_seconds: float = 60.0
+    
+    # Similar Drugs Configuration (0 neighbours turns it off)
+    similar_top_k: int = 10
+    similar_refresh_delay: float = 0.25
+    
+    # Search Configuration
+    fuzzy_similarity_threshold: float = 0.3
+    fuzzy_max_candidates: int = 500
+    facet_cache_ttl: int = 0
+    total_count_cap: int = 1000
+    
+    # Tracing Configuration
+    tracing_exporter: str = "none"
+    tracing_file: str = "./traces.jsonl"
+    tracing_sample_rate: float = 1.0
     
     # Logging Configuration
     log_level: str = "INFO"
+    log_format: str = "json"
+    log_client_error_sample_rate: float = 0.01
+    log_route_sample_rates: Dict[str, float] = {}
     
     @validator('database_url')
     def validate_database_url(cls, v):
@@ -52,6 +117,73 @@ class Settings(BaseSettings):
             raise ValueError('Secret key must be at least 32 characters long')
         return v
     
+    @validator('fuzzy_similarity_threshold')
+    def validate_fuzzy_similarity_threshold(cls, v):
+        if not 0 < v <= 1:
+            raise ValueError('Fuzzy similarity threshold must be between 0 and 1')
+        return v
+    
+    @validator('group_commit_max_batch')
+    def validate_group_commit_max_batch(cls, v):
+        if v < 1:
+            raise ValueError('Group commit batch size must be at least 1')
+        return v
+    
+    @validator('similar_top_k')
+    def validate_similar_top_k(cls, v):
+        if v < 0:
+            raise ValueError('Similar drugs top k must not be negative')
+        return v
+    
+    @validator('rate_limit_backend')
+    def validate_rate_limit_backend(cls, v, values):
+        if v not in ('memory', 'redis'):
+            raise ValueError("Rate limit backend must be 'memory' or 'redis'")
+        if v == 'redis' and not values.get('rate_limit_redis_url'):
+            raise ValueError('rate_limit_redis_url is required for the redis backend')
+        return v
+    
+    @validator(
+        'rate_limit_per_second', 'rate_limit_burst', 'admission_max_inflight_cheap',
+        'admission_max_inflight_expensive', 'readiness_budget_seconds', 'job_workers', 'job_max_queued',
+        'job_poll_interval', 'job_stale_seconds'
+    )
+    def validate_positive(cls, v):
+        if v <= 0:
+            raise ValueError('Must be greater than 0')
+        return v
+    
+    @validator('log_format')
+    def validate_log_format(cls, v):
+        if v not in ('json', 'text'):
+            raise ValueError("Log format must be 'json' or 'text'")
+        return v
+    
+    @validator('snapshot_mode')
+    def validate_snapshot_mode(cls, v):
+        if v not in ('off', 'memory', 'mmap'):
+            raise ValueError("Snapshot mode must be 'off', 'memory' or 'mmap'")
+        return v
+    
+    @validator('tracing_exporter')
+    def validate_tracing_exporter(cls, v):
+        if v not in ('none', 'console', 'file'):
+            raise ValueError("Tracing exporter must be 'none', 'console' or 'file'")
+        return v
+    
+    @validator('log_client_error_sample_rate', 'tracing_sample_rate')
+    def validate_sample_rate(cls, v):
+        if not 0 <= v <= 1:
+            raise ValueError('Sample rate must be between 0 and 1')
+        return v
+    
+    @validator('log_route_sample_rates')
+    def validate_route_sample_rates(cls, v):
+        for route, rate in v.items():
+            if not 0 <= rate <= 1:
+                raise ValueError(f'Sample rate for {route} must be between 0 and 1')
+        return v
+    
     @validator('log_level')
     def validate_log_level(cls, v):
         valid_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
@@ -95,29 +227,41 @@ class Settings(BaseSettings):
 # Create settings instance
 settings = Settings()
 
-# Validation on import
-def validate_settings():
+def use_settings(app_settings: Settings):
+    """Make ``app_settings`` the process-wide configuration.
+
+    The shared ``settings`` object is updated in place so every module that
+    imported it sees the new values.
+    """
+    for field in Settings.__fields__:
+        setattr(settings, field, getattr(app_settings, field))
+
+def ensure_database_directory(app_settings: Optional[Settings] = None):
+    """Create the parent directory of a file-based SQLite database"""
+    app_settings = app_settings or settings
+    if app_settings.is_sqlite:
+        db_path = app_settings.database_url.replace("sqlite:///", "")
+        if not db_path.startswith("./"):
+            # Create directory if it doesn't exist
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+# Called explicitly by entry points (not on import) so importing the
+# configuration stays free of output and filesystem access
+def validate_settings(app_settings: Optional[Settings] = None):
     """Validate settings and print configuration info"""
+    app_settings = app_settings or settings
     try:
-        # Test database URL format
-        if settings.is_sqlite:
-            db_path = settings.database_url.replace("sqlite:///", "")
-            if not db_path.startswith("./"):
-                # Create directory if it doesn't exist
-                Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        ensure_database_directory(app_settings)
         
         print("✅ Configuration loaded successfully:")
-        print(f"   Database: {settings.database_url}")
-        print(f"   Server: {settings.host}:{settings.port}")
-        print(f"   Debug: {settings.debug}")
-        print(f"   API Title: {settings.api_title}")
-        print(f"   CORS Origins: {settings.cors_origins}")
-        print(f"   Log Level: {settings.log_level}")
-        print(f"   Features: CORS={settings.enable_cors}, Swagger={settings.enable_swagger_ui}, Seed={settings.seed_database}")
+        print(f"   Database: {app_settings.database_url}")
+        print(f"   Server: {app_settings.host}:{app_settings.port}")
+        print(f"   Debug: {app_settings.debug}")
+        print(f"   API Title: {app_settings.api_title}")
+        print(f"   CORS Origins: {app_settings.cors_origins}")
+        print(f"   Log Level: {app_settings.log_level}")
+        print(f"   Features: CORS={app_settings.enable_cors}, Swagger={app_settings.enable_swagger_ui}, Seed={app_settings.seed_database}")
         
     except Exception as e:
         print(f"❌ Configuration validation failed: {e}")
         raise
-
-# Validate on import
-validate_settings()
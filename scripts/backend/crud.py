@@ -1,47 +1,383 @@
+"""
+Data access layer shared by every entry point.
+
+All queries and writes go through these functions, which also keep the
+derived structures (facet side tables, counters, in-memory search indexes,
+caches) in step with the data.
+"""
+
+from sqlalchemy import Text, case, cast, delete, func, literal, select, text, union_all, update
+from sqlalchemy.dialects.postgresql import JSON as PGJSON, JSONB
 from sqlalchemy.orm import Session
-from models import Drug as DrugModel
-from schemas import DrugCreate, DrugUpdate
-from typing import List, Optional
-from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+from datetime import date, datetime
+import json
+import logging
 import uuid
 
-def get_drug(db: Session, drug_id: str):
-    return db.query(DrugModel).filter(DrugModel.id == drug_id).first()
+from cache import SingleFlight, TTLCache
+from changes import change_notifier
+from config import settings
+from models import (
+    Drug as DrugModel,
+    DrugChange as DrugChangeModel,
+    DrugDosageForm as DrugDosageFormModel,
+    DrugIngredient as DrugIngredientModel,
+    DrugSimilar as DrugSimilarModel,
+    TableCount as TableCountModel,
+)
+from schemas import ArrayPatchOperation, DrugCreate, DrugUpdate
+from screening import contraindication_index
+from snapshot import catalogue
+from similar import similar_drugs
+from suggest import suggest_index
+from trigram import trigram_index
 
-def get_drugs(
-    db: Session,
+logger = logging.getLogger(__name__)
+
+class VersionConflictError(Exception):
+    """The drug exists but no longer has the version the caller expected"""
+
+    def __init__(self, drug_id: str, expected_version: int):
+        super().__init__(f"Drug {drug_id} is no longer at version {expected_version}")
+        self.drug_id = drug_id
+        self.expected_version = expected_version
+
+def drug_columns(fields: Optional[Tuple[str, ...]] = None):
+    """Entities to SELECT: the full model, or only the projected columns"""
+    if fields is None:
+        return [DrugModel]
+    return [getattr(DrugModel, field) for field in fields]
+
+def get_drug_by_id(db: Session, drug_id: str, fields: Optional[Tuple[str, ...]] = None):
+    return db.query(*drug_columns(fields)).filter(DrugModel.id == drug_id).first()
+
+def filter_drugs(
+    query,
     name: Optional[str] = None,
     category: Optional[str] = None,
     ingredient: Optional[str] = None,
+    dosage_form: Optional[str] = None,
     created_after: Optional[date] = None,
-    created_before: Optional[date] = None,
-    skip: int = 0,
-    limit: int = 100
+    created_before: Optional[date] = None
 ):
-    query = db.query(DrugModel)
-    
+    """Apply the filters shared by the list, search and facet queries"""
     if name:
         query = query.filter(DrugModel.name.ilike(f"%{name}%"))
     if category:
-        query = query.filter(DrugModel.category.ilike(f"%{category}%"))
+        query = query.filter(DrugModel.category == category)
     if ingredient:
-        # For SQLite JSON search
         query = query.filter(DrugModel.active_ingredients.like(f"%{ingredient}%"))
+    if dosage_form:
+        query = query.filter(DrugModel.id.in_(
+            select(DrugDosageFormModel.drug_id).where(DrugDosageFormModel.value == dosage_form)
+        ))
     if created_after:
         query = query.filter(DrugModel.created_at >= created_after)
     if created_before:
         query = query.filter(DrugModel.created_at <= created_before)
+    return query
+
+def build_drugs_query(
+    db: Session,
+    name: Optional[str] = None,
+    category: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    created_after: Optional[date] = None,
+    created_before: Optional[date] = None,
+    fields: Optional[Tuple[str, ...]] = None,
+    fuzzy: bool = False,
+    dosage_form: Optional[str] = None
+):
+    """Build the filtered drug query with its ordering.
+
+    Returns ``(query, ordering, ranks)``; ``ranks`` maps drug ids to their
+    position when fuzzy matching was resolved by the in-process index.
+    """
+    query = db.query(*drug_columns(fields))
+    ordering = [DrugModel.name]
+    ranks = None
     
-    return query.order_by(DrugModel.name).offset(skip).limit(limit).all()
+    if name and fuzzy and settings.is_postgresql:
+        # The % operator can use the GIN trigram index; similarity() alone cannot
+        db.execute(
+            text("SELECT set_config('pg_trgm.similarity_threshold', :threshold, true)"),
+            {"threshold": str(settings.fuzzy_similarity_threshold)}
+        )
+        query = query.filter(DrugModel.name.op("%")(name))
+        ordering = [func.similarity(DrugModel.name, name).desc(), DrugModel.name]
+    elif name and fuzzy:
+        matches = trigram_index.search(
+            name, settings.fuzzy_similarity_threshold, settings.fuzzy_max_candidates
+        )
+        ranks = {drug_id: rank for rank, (drug_id, _) in enumerate(matches)}
+        query = query.filter(DrugModel.id.in_(list(ranks)))
+    query = filter_drugs(
+        query, None if fuzzy else name, category, ingredient, dosage_form,
+        created_after, created_before
+    )
+    return query, ordering, ranks
+
+def get_drugs(
+    db: Session,
+    name: Optional[str] = None,
+    category: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    created_after: Optional[date] = None,
+    created_before: Optional[date] = None,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[Tuple[str, ...]] = None,
+    fuzzy: bool = False,
+    dosage_form: Optional[str] = None
+):
+    query, ordering, ranks = build_drugs_query(
+        db, name, category, ingredient, created_after, created_before, fields, fuzzy, dosage_form
+    )
+    
+    if ranks is not None:
+        # Candidates are capped by fuzzy_max_candidates, so rank them in Python
+        drugs = sorted(query.all(), key=lambda drug: ranks[drug.id])
+        return drugs[skip:skip + limit]
+    return query.order_by(*ordering).offset(skip).limit(limit).all()
+
+def get_drug_count(db: Session) -> int:
+    """Total number of drugs without scanning the table.
+
+    PostgreSQL answers from planner statistics; elsewhere the counter row in
+    ``table_counts`` is used (see init_table_counts). Never writes, so it is
+    safe on a read replica.
+    """
+    if settings.is_postgresql:
+        estimate = db.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = 'drugs'::regclass")
+        ).scalar()
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+        return db.query(func.count(DrugModel.id)).scalar()
+
+    counter = db.get(TableCountModel, "drugs")
+    if counter is None:
+        return db.query(func.count(DrugModel.id)).scalar()
+    return counter.row_count
+
+def init_table_counts(db: Session):
+    """Create the ``drugs`` counter row from an exact count if it is missing"""
+    if settings.is_postgresql or db.get(TableCountModel, "drugs") is not None:
+        return
+    db.add(TableCountModel(
+        table_name="drugs", row_count=db.query(func.count(DrugModel.id)).scalar()
+    ))
+    db.commit()
+
+def adjust_drug_count(db: Session, delta: int):
+    """Keep the ``drugs`` counter row in step with inserts and deletes"""
+    if settings.is_postgresql:
+        return
+    db.query(TableCountModel).filter(TableCountModel.table_name == "drugs").update(
+        {TableCountModel.row_count: TableCountModel.row_count + delta},
+        synchronize_session=False
+    )
+
+def count_drugs(
+    db: Session,
+    mode: str,
+    name: Optional[str] = None,
+    category: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    created_after: Optional[date] = None,
+    created_before: Optional[date] = None,
+    fuzzy: bool = False,
+    dosage_form: Optional[str] = None
+) -> Tuple[str, str]:
+    """Count the drugs matching a filter set.
+
+    Returns ``(total, mode)`` where ``total`` is rendered for the
+    ``X-Total-Count`` header. ``capped`` stops counting after
+    ``total_count_cap`` rows and reports e.g. "1000+". ``estimated`` uses
+    maintained counts or planner estimates, falling back to ``capped`` for
+    filtered queries on databases without a planner estimate.
+    """
+    filtered = any((name, category, ingredient, created_after, created_before, dosage_form))
+    if mode == "estimated" and not filtered:
+        return str(get_drug_count(db)), mode
+
+    query, _, _ = build_drugs_query(
+        db, name, category, ingredient, created_after, created_before, ("id",), fuzzy, dosage_form
+    )
+    if mode == "estimated" and settings.is_postgresql:
+        compiled = query.statement.compile(dialect=db.get_bind().dialect)
+        plan = db.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return str(int(plan[0]["Plan"]["Plan Rows"])), mode
+
+    if mode == "exact":
+        return str(query.count()), mode
+
+    cap = settings.total_count_cap
+    total = db.query(func.count()).select_from(query.limit(cap + 1).subquery()).scalar()
+    return (f"{cap}+" if total > cap else str(total)), "capped"
 
 def get_categories(db: Session):
     categories = db.query(DrugModel.category).distinct().all()
     return [category[0] for category in categories]
 
+def get_similar_drugs(db: Session, drug_id: str, ingredients: Sequence[str], limit: int = 10):
+    """Precomputed neighbours of a drug, closest first, with the active
+    ingredients each shares with ``ingredients``"""
+    rows = (
+        db.query(DrugModel.id, DrugModel.name, DrugModel.category, DrugModel.active_ingredients, DrugSimilarModel.score)
+        .join(DrugSimilarModel, DrugSimilarModel.similar_id == DrugModel.id)
+        .filter(DrugSimilarModel.drug_id == drug_id)
+        .order_by(DrugSimilarModel.rank)
+        .limit(limit)
+        .all()
+    )
+    wanted = {ingredient.casefold() for ingredient in ingredients}
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "category": row.category,
+            "score": row.score,
+            "shared_ingredients": [value for value in row.active_ingredients if value.casefold() in wanted],
+        }
+        for row in rows
+    ]
+
+facet_cache = TTLCache(settings.facet_cache_ttl)
+
+# Shares one database call among concurrent identical reads
+read_flights = SingleFlight()
+
+def get_facet_counts(
+    db: Session,
+    name: Optional[str] = None,
+    category: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    dosage_form: Optional[str] = None,
+    created_after: Optional[date] = None,
+    created_before: Optional[date] = None,
+    facet_limit: int = 20
+):
+    """Count category, dosage form and ingredient values over the filtered
+    drugs with a single UNION ALL of grouped aggregates"""
+    signature = (name, category, ingredient, dosage_form, created_after, created_before, facet_limit)
+    cached = facet_cache.get(signature)
+    if cached is not None:
+        return cached
+
+    matching = filter_drugs(
+        db.query(DrugModel.id), name, category, ingredient, dosage_form,
+        created_after, created_before
+    ).subquery()
+    matching_ids = select(matching.c.id)
+
+    statement = union_all(
+        select(literal("category").label("facet"), DrugModel.category.label("value"), func.count().label("count"))
+        .where(DrugModel.id.in_(matching_ids))
+        .group_by(DrugModel.category),
+        select(literal("dosage_forms"), DrugDosageFormModel.value, func.count())
+        .where(DrugDosageFormModel.drug_id.in_(matching_ids))
+        .group_by(DrugDosageFormModel.value),
+        select(literal("ingredient"), DrugIngredientModel.value, func.count())
+        .where(DrugIngredientModel.drug_id.in_(matching_ids))
+        .group_by(DrugIngredientModel.value),
+    )
+
+    facets = {"category": [], "dosage_forms": [], "ingredient": []}
+    for facet, value, count in db.execute(statement):
+        facets[facet].append({"value": value, "count": count})
+    for facet, counts in facets.items():
+        counts.sort(key=lambda item: (-item["count"], item["value"]))
+        del counts[facet_limit:]
+
+    facet_cache.set(signature, facets)
+    return facets
+
+def sync_facet_rows(
+    db: Session,
+    drug_id: str,
+    ingredients: Optional[List[str]] = None,
+    dosage_forms: Optional[List[str]] = None
+):
+    """Rewrite a drug's facet side-table rows; None leaves a facet untouched"""
+    for model, values in ((DrugIngredientModel, ingredients), (DrugDosageFormModel, dosage_forms)):
+        if values is None:
+            continue
+        db.query(model).filter(model.drug_id == drug_id).delete(synchronize_session=False)
+        db.bulk_insert_mappings(model, [
+            {"drug_id": drug_id, "value": value} for value in dict.fromkeys(values)
+        ])
+
+def after_commit(db: Session, callback):
+    """Run ``callback`` once the session's writes are durable.
+
+    Sessions owned by the group-commit writer collect callbacks in
+    ``db.info["after_commit"]`` and run them after the batch commits.
+    """
+    deferred = db.info.get("after_commit")
+    if deferred is None:
+        callback()
+    else:
+        deferred.append(callback)
+
+# Arbitrary key for the PostgreSQL advisory lock serializing change log writers
+CHANGE_LOG_LOCK = 7_301_337
+
+def record_change(db: Session, drug_id: str, operation: str, version: Optional[int] = None):
+    """Append to the change log inside the caller's transaction.
+
+    On PostgreSQL writers take a transaction-scoped advisory lock first, so
+    sequence numbers become visible in commit order and a consumer reading
+    ``since`` its last seen value can't skip a slower transaction's change.
+    SQLite already serializes writers.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_LOG_LOCK})
+    change = DrugChangeModel(drug_id=drug_id, operation=operation, version=version)
+    db.add(change)
+    db.flush()
+    after_commit(db, lambda: change_notifier.publish(change.seq))
+    return change
+
+def get_changes(db: Session, since: int = 0, limit: int = 100):
+    return (
+        db.query(DrugChangeModel)
+        .filter(DrugChangeModel.seq > since)
+        .order_by(DrugChangeModel.seq)
+        .limit(limit)
+        .all()
+    )
+
+def get_latest_change_seq(db: Session) -> int:
+    return db.query(func.max(DrugChangeModel.seq)).scalar() or 0
+
+def index_drug(db_drug: DrugModel):
+    """Refresh the in-memory search structures after a committed write"""
+    suggest_index.add(db_drug.id, db_drug.name, db_drug.active_ingredients)
+    trigram_index.add(db_drug.id, db_drug.name)
+    contraindication_index.add(db_drug.id, db_drug.name, db_drug.contraindications)
+    similar_drugs.changed(db_drug)
+    facet_cache.clear()
+    read_flights.forget()
+    catalogue.invalidate()
+
+def unindex_drug(drug_id: str):
+    suggest_index.remove(drug_id)
+    trigram_index.remove(drug_id)
+    contraindication_index.remove(drug_id)
+    similar_drugs.removed(drug_id)
+    facet_cache.clear()
+    read_flights.forget()
+    catalogue.invalidate()
+
 def create_drug(db: Session, drug: DrugCreate):
-    # Handle idempotency
     if drug.id:
-        existing_drug = get_drug(db, drug.id)
+        existing_drug = get_drug_by_id(db, drug.id)
         if existing_drug:
             return existing_drug
         drug_id = drug.id
@@ -60,29 +396,183 @@ def create_drug(db: Session, drug: DrugCreate):
     )
     
     db.add(db_drug)
+    db.flush()
+    sync_facet_rows(db, drug_id, drug.active_ingredients, drug.dosage_forms)
+    adjust_drug_count(db, 1)
+    record_change(db, drug_id, "create", 1)
     db.commit()
     db.refresh(db_drug)
+    after_commit(db, lambda: index_drug(db_drug))
     return db_drug
 
-def update_drug(db: Session, drug_id: str, drug_update: DrugUpdate):
-    db_drug = get_drug(db, drug_id)
-    if not db_drug:
+def _raise_if_conflict(db: Session, drug_id: str, expected_version: Optional[int]):
+    """After a conditional write matched no row, tell a stale version apart
+    from a missing drug (only runs on the failure path)"""
+    db.rollback()
+    if expected_version is not None and get_drug_by_id(db, drug_id, ("id",)) is not None:
+        raise VersionConflictError(drug_id, expected_version)
+
+def _conditional_update(
+    db: Session,
+    drug_id: str,
+    values: dict,
+    expected_version: Optional[int] = None
+):
+    """Run one conditional UPDATE and return the new row, uncommitted.
+
+    With ``expected_version`` the row only changes if it is still at that
+    version; otherwise VersionConflictError is raised. Returns None if the
+    drug doesn't exist. On databases with UPDATE ... RETURNING the new row
+    comes back from the same statement.
+    """
+    statement = update(DrugModel).where(DrugModel.id == drug_id)
+    if expected_version is not None:
+        statement = statement.where(DrugModel.version == expected_version)
+    statement = statement.values(
+        **values,
+        updated_at=datetime.utcnow(),
+        version=DrugModel.version + 1
+    ).execution_options(synchronize_session=False)
+
+    returning = db.get_bind().dialect.full_returning
+    if returning:
+        statement = statement.returning(*DrugModel.__table__.columns)
+    result = db.execute(statement)
+    if result.rowcount == 0:
+        _raise_if_conflict(db, drug_id, expected_version)
         return None
-    
+    db_drug = result.first() if returning else get_drug_by_id(db, drug_id)
+    record_change(db, drug_id, "update", db_drug.version)
+    return db_drug
+
+def update_drug(
+    db: Session,
+    drug_id: str,
+    drug_update: DrugUpdate,
+    expected_version: Optional[int] = None
+):
+    """Apply a partial update with a single conditional UPDATE"""
     update_data = drug_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_drug, field, value)
-    
-    db_drug.updated_at = datetime.utcnow()
+    db_drug = _conditional_update(db, drug_id, update_data, expected_version)
+    if db_drug is None:
+        return None
+
+    sync_facet_rows(
+        db, drug_id, update_data.get("active_ingredients"), update_data.get("dosage_forms")
+    )
     db.commit()
-    db.refresh(db_drug)
+    after_commit(db, lambda: index_drug(db_drug))
     return db_drug
 
-def delete_drug(db: Session, drug_id: str):
-    db_drug = get_drug(db, drug_id)
-    if not db_drug:
+def json_array_expression(column, operations: Sequence[ArrayPatchOperation], dialect_name: str):
+    """Fold add/remove operations on a JSON array column into one SQL
+    expression, so the database edits the array in place"""
+    if dialect_name == "postgresql":
+        array = func.coalesce(cast(column, JSONB), cast("[]", JSONB))
+        for operation in operations:
+            value = cast(operation.value, Text)
+            if operation.op == "add":
+                array = case(
+                    (array.op("?", is_comparison=True)(value), array),
+                    else_=array.op("||")(func.jsonb_build_array(value))
+                )
+            else:
+                array = array.op("-")(value)
+        return cast(array, PGJSON)
+
+    # SQLite JSON1
+    array = func.coalesce(column, "[]")
+    for operation in operations:
+        elements = func.json_each(array).table_valued("value")
+        if operation.op == "add":
+            present = select(elements.c.value).where(elements.c.value == operation.value).exists()
+            array = case((present, array), else_=func.json_insert(array, "$[#]", operation.value))
+        else:
+            array = (
+                select(func.json_group_array(elements.c.value))
+                .where(elements.c.value != operation.value)
+                .scalar_subquery()
+            )
+    return array
+
+def patch_drug(
+    db: Session,
+    drug_id: str,
+    operations: Sequence[ArrayPatchOperation],
+    expected_version: Optional[int] = None
+):
+    """Apply array add/remove operations in a single conditional UPDATE.
+
+    Only the facet side-table rows and in-memory index entries for the
+    touched values are refreshed, not the whole arrays.
+    """
+    by_field: Dict[str, List[ArrayPatchOperation]] = {}
+    for operation in operations:
+        by_field.setdefault(operation.field, []).append(operation)
+
+    dialect_name = db.get_bind().dialect.name
+    values = {
+        field: json_array_expression(getattr(DrugModel, field), field_operations, dialect_name)
+        for field, field_operations in by_field.items()
+    }
+    db_drug = _conditional_update(db, drug_id, values, expected_version)
+    if db_drug is None:
+        return None
+
+    for field, model in (("active_ingredients", DrugIngredientModel), ("dosage_forms", DrugDosageFormModel)):
+        touched = {operation.value for operation in by_field.get(field, ())}
+        if not touched:
+            continue
+        db.query(model).filter(model.drug_id == drug_id, model.value.in_(touched)).delete(
+            synchronize_session=False
+        )
+        present = touched & set(getattr(db_drug, field) or ())
+        db.bulk_insert_mappings(model, [{"drug_id": drug_id, "value": value} for value in present])
+    db.commit()
+    after_commit(db, lambda: index_drug(db_drug))
+    return db_drug
+
+def delete_drug(db: Session, drug_id: str, expected_version: Optional[int] = None):
+    """Delete a drug, optionally only if it is still at ``expected_version``.
+
+    Returns False if the drug doesn't exist; raises VersionConflictError on
+    a stale version.
+    """
+    statement = delete(DrugModel).where(DrugModel.id == drug_id)
+    if expected_version is not None:
+        statement = statement.where(DrugModel.version == expected_version)
+    sync_facet_rows(db, drug_id, [], [])
+    result = db.execute(statement.execution_options(synchronize_session=False))
+    if result.rowcount == 0:
+        _raise_if_conflict(db, drug_id, expected_version)
         return False
-    
-    db.delete(db_drug)
+
+    adjust_drug_count(db, -1)
+    record_change(db, drug_id, "delete")
     db.commit()
+    after_commit(db, lambda: unindex_drug(drug_id))
     return True
+
+def backfill_facet_rows(db: Session):
+    """Populate facet side tables for drugs written before they existed"""
+    if db.query(DrugIngredientModel).first() is not None:
+        return
+    drugs = db.query(DrugModel.id, DrugModel.active_ingredients, DrugModel.dosage_forms)
+    for drug_id, ingredients, dosage_forms in drugs.yield_per(1000):
+        sync_facet_rows(db, drug_id, ingredients or [], dosage_forms or [])
+    db.commit()
+
+def build_search_indexes(db: Session):
+    """Load the in-memory search indexes from the database"""
+    suggest_index.build(
+        db.query(DrugModel.id, DrugModel.name, DrugModel.active_ingredients)
+    )
+    logger.info("Suggest index built with %d drugs", len(suggest_index))
+    if not settings.is_postgresql:
+        trigram_index.build(db.query(DrugModel.id, DrugModel.name))
+        logger.info("Trigram index built with %d drugs", len(trigram_index))
+    contraindication_index.build(
+        db.query(DrugModel.id, DrugModel.name, DrugModel.contraindications).order_by(DrugModel.name, DrugModel.id)
+    )
+    logger.info("Contraindication index built with %d drugs", len(contraindication_index))
+    similar_drugs.load(db)
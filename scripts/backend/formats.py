@@ -0,0 +1,110 @@
+"""
+Binary wire formats for drug listings.
+
+``GET /drugs`` negotiates on ``Accept``:
+
+- ``application/msgpack``: the same records as the JSON response, packed
+  with msgpack
+- ``application/vnd.apache.arrow.stream``: an Arrow IPC stream, one
+  column per field; categories and the list fields are dictionary-encoded
+  so each distinct string is sent once per page, and timestamps are native
+  Arrow timestamps
+
+Both need optional packages (``msgpack``, ``pyarrow``). A format whose
+package isn't installed is simply not offered, and the client gets JSON;
+clients should go by the response ``Content-Type``.
+"""
+
+import io
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+# Alternative names clients send for the same formats
+_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.apache.arrow.file": ARROW}
+
+# Columns whose values repeat across drugs
+_DICTIONARY_FIELDS = {"category"}
+_LIST_FIELDS = {"active_ingredients", "dosage_forms", "side_effects", "contraindications"}
+_TIMESTAMP_FIELDS = {"created_at", "updated_at"}
+
+def _available(media_type: str) -> bool:
+    try:
+        if media_type == MSGPACK:
+            import msgpack  # noqa: F401
+        elif media_type == ARROW:
+            import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def negotiate(accept: Optional[str]) -> str:
+    """The media type to answer with: the client's most preferred format
+    this server can produce, JSON otherwise"""
+    if not accept:
+        return JSON
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, _ALIASES.get(media_type.lower(), media_type.lower())))
+    for negative_quality, _, media_type in sorted(ranges):
+        if negative_quality == 0:
+            break
+        if media_type in (MSGPACK, ARROW) and _available(media_type):
+            return media_type
+        if media_type in (JSON, "application/*", "*/*"):
+            return JSON
+    return JSON
+
+def encode_msgpack(records: List[Dict]) -> bytes:
+    import msgpack
+
+    return msgpack.packb(records, use_bin_type=True)
+
+def _arrow_type(pa, field: str):
+    if field in _DICTIONARY_FIELDS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if field in _LIST_FIELDS:
+        return pa.list_(pa.dictionary(pa.int32(), pa.string()))
+    if field in _TIMESTAMP_FIELDS:
+        return pa.timestamp("us")
+    if field == "version":
+        return pa.int64()
+    return pa.string()
+
+def _arrow_column(pa, field: str, values: list):
+    if field in _DICTIONARY_FIELDS:
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    if field in _LIST_FIELDS:
+        lists = pa.array(values, type=pa.list_(pa.string()))
+        return pa.ListArray.from_arrays(lists.offsets, lists.flatten().dictionary_encode(), mask=lists.is_null())
+    if field in _TIMESTAMP_FIELDS:
+        parsed = [datetime.fromisoformat(value) if value is not None else None for value in values]
+        return pa.array(parsed, type=pa.timestamp("us"))
+    return pa.array(values, type=_arrow_type(pa, field))
+
+def encode_arrow(records: List[Dict], fields: Sequence[str]) -> bytes:
+    """An Arrow IPC stream with one record batch holding ``records``"""
+    import pyarrow as pa
+
+    schema = pa.schema([(field, _arrow_type(pa, field)) for field in fields])
+    columns = [_arrow_column(pa, field, [record.get(field) for record in records]) for field in fields]
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(columns, schema=schema))
+    return sink.getvalue()
+
+def encode(media_type: str, records: List[Dict], fields: Sequence[str]) -> bytes:
+    if media_type == MSGPACK:
+        return encode_msgpack(records)
+    return encode_arrow(records, fields)
@@ -0,0 +1,148 @@
+"""
+Liveness and readiness probes.
+
+Liveness (``/health``, ``/health/live``) only says the process is serving
+requests. Readiness (``/health/ready``) says whether this worker should get
+traffic:
+
+- database: ``SELECT 1`` latency on the primary and the read replica
+- pool: checked-out connections against pool capacity
+- cache: reachability of the Redis backend, when one is configured
+- event loop: how long a callback waits to be scheduled
+
+All checks run concurrently under ``readiness_budget_seconds``; a check
+that doesn't finish in time fails. Results are cached for
+``readiness_cache_seconds`` and concurrent probes share one refresh, and a
+database check still running from an earlier probe is never started again,
+so probing can't pile load onto a struggling database.
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+import database
+from config import settings
+
+def ping_database(engine) -> float:
+    """Milliseconds to check out a connection and run ``SELECT 1``"""
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    return (time.perf_counter() - started) * 1000
+
+def pool_usage(engine) -> Optional[Dict[str, float]]:
+    """Checked-out connections and capacity; None for pools that don't
+    hold connections (SQLite's NullPool/SingletonThreadPool)"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+        return None
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    checked_out = pool.checkedout()
+    if max_overflow < 0:
+        return {"checked_out": checked_out, "capacity": None, "saturation": 0.0}
+    capacity = pool.size() + max_overflow
+    return {"checked_out": checked_out, "capacity": capacity, "saturation": checked_out / max(capacity, 1)}
+
+class ReadinessProbe:
+    """Runs the readiness checks and caches the result"""
+
+    def __init__(self):
+        self._result: Optional[dict] = None
+        self._checked_at = 0.0
+        self._refresh: Optional[asyncio.Future] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._redis = None
+
+    def reset(self):
+        self._result = None
+        self._refresh = None
+        self._pending.clear()
+        self._redis = None
+
+    async def check(self) -> dict:
+        if self._result is not None and time.monotonic() - self._checked_at < settings.readiness_cache_seconds:
+            return self._result
+        loop = asyncio.get_running_loop()
+        refresh = self._refresh
+        if refresh is None or refresh.done() or refresh.get_loop() is not loop:
+            refresh = self._refresh = asyncio.ensure_future(self._run_checks())
+        return await asyncio.shield(refresh)
+
+    async def _run_checks(self) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.readiness_budget_seconds
+        engines = {"database": database.get_engine()}
+        if database.read_engine is not None and database.read_engine is not database.engine:
+            engines["read_database"] = database.read_engine
+
+        names = list(engines) + ["cache", "event_loop"]
+        results = await asyncio.gather(
+            *[self._check_database(name, engine, deadline) for name, engine in engines.items()],
+            self._within(self._check_cache(), deadline),
+            self._check_event_loop(),
+        )
+        checks = dict(zip(names, results))
+        checks["pool"] = self._check_pools(engines)
+
+        ready = all(check["status"] == "ok" for check in checks.values())
+        self._result = {"status": "ready" if ready else "not_ready", "checks": checks}
+        self._checked_at = time.monotonic()
+        return self._result
+
+    async def _within(self, awaitable, deadline: float) -> dict:
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            return await asyncio.wait_for(awaitable, max(remaining, 0))
+        except asyncio.TimeoutError:
+            return {"status": "fail", "error": f"no answer within {settings.readiness_budget_seconds}s"}
+        except Exception as exc:
+            return {"status": "fail", "error": str(exc)}
+
+    async def _check_database(self, name: str, engine, deadline: float) -> dict:
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(name)
+        if pending is not None and not pending.done() and pending.get_loop() is loop:
+            # The previous check is still stuck (e.g. waiting for a pooled
+            # connection); another one would only add to the queue
+            return {"status": "fail", "error": "previous check still running"}
+        pending = self._pending[name] = asyncio.ensure_future(run_in_threadpool(ping_database, engine))
+
+        async def latency():
+            latency_ms = await asyncio.shield(pending)
+            status = "ok" if latency_ms <= settings.readiness_max_db_latency_ms else "fail"
+            return {"status": status, "latency_ms": round(latency_ms, 2)}
+
+        return await self._within(latency(), deadline)
+
+    def _check_pools(self, engines) -> dict:
+        pools = {}
+        for name, engine in engines.items():
+            usage = pool_usage(engine)
+            if usage is not None:
+                pools[name] = usage
+        saturated = any(usage["saturation"] > settings.readiness_max_pool_saturation for usage in pools.values())
+        return {"status": "fail" if saturated else "ok", **pools}
+
+    async def _check_cache(self) -> dict:
+        if settings.rate_limit_backend != "redis":
+            return {"status": "ok", "backend": "memory"}
+        if self._redis is None:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(settings.rate_limit_redis_url)
+        started = time.perf_counter()
+        await self._redis.ping()
+        return {"status": "ok", "backend": "redis", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    async def _check_event_loop(self) -> dict:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.sleep(0)
+        lag_ms = (loop.time() - started) * 1000
+        status = "ok" if lag_ms <= settings.readiness_max_loop_lag_ms else "fail"
+        return {"status": status, "lag_ms": round(lag_ms, 2)}
+
+readiness_probe = ReadinessProbe()
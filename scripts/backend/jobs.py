@@ -0,0 +1,592 @@
+"""
+Background jobs for work too long for a request.
+
+A full re-import, a catalogue export or an analytics run is submitted as a
+job: the API records it in the ``jobs`` table and answers at once with its
+id. A ``JobRunner`` works through queued jobs on its own small pool of
+threads (``job_workers``), apart from the request threads and with its own
+database sessions. Clients poll ``GET /jobs/{id}`` for progress and fetch
+the finished result from ``GET /jobs/{id}/result``.
+
+Job state lives in the database, so any API process can report on or cancel
+any job, and queued work survives restarts:
+
+- Runners claim a queued job with a conditional UPDATE, so each attempt
+  runs once. ``JOB_KINDS`` caps how many jobs of a kind run at a time (one
+  re-import at a time); ``job_max_queued`` bounds the backlog.
+- A running job reports progress through its ``JobContext``, which is also
+  where cancellation and shutdown are noticed: work stops between batches.
+- Jobs interrupted by shutdown, or whose runner stopped heartbeating for
+  ``job_stale_seconds``, are queued again, up to ``MAX_ATTEMPTS`` runs.
+  Every kind is safe to re-run from the start.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, aliased
+
+from config import Settings
+from crud import VersionConflictError, create_drug, filter_drugs, get_drug_by_id, update_drug
+from database import SessionLocal
+from models import Drug as DrugModel, Job as JobModel
+from schemas import Drug, DrugCreate, DrugUpdate
+from similar import is_empty as similar_is_empty, similar_drugs
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Runs per job, counting restarts after a shutdown or a lost runner
+MAX_ATTEMPTS = 3
+
+# Seconds between progress writes, which bounds how late a cancel is seen
+PROGRESS_INTERVAL = 0.5
+
+# Rows read per query by exports and analytics
+BATCH_SIZE = 500
+
+# Per-line import errors kept in the result
+MAX_REPORTED_ERRORS = 100
+
+class JobCancelled(Exception):
+    """Raised inside a job once a client has cancelled it"""
+
+class JobInterrupted(Exception):
+    """Raised inside a job when its runner is shutting down, or when another
+    runner has taken the job over"""
+
+class JobQueueFull(Exception):
+    """Raised by ``submit_job`` when ``job_max_queued`` jobs are waiting"""
+
+class JobContext:
+    """What a running job gets: its parameters, database sessions, where to
+    write its result, and progress reporting"""
+
+    def __init__(self, runner: "JobRunner", job: JobModel):
+        self.runner = runner
+        self.job_id = job.id
+        self.attempt = job.attempts
+        self.params = job.params or {}
+        self.input_path = runner.input_path(job.id)
+        # Written in place; renamed to the final path once the job succeeds
+        self.result_path = runner.result_path(job) + ".part"
+        self.processed = 0
+        self.total: Optional[int] = None
+        self.message: Optional[str] = None
+        self._reported = 0.0
+
+    def session(self) -> Session:
+        return self.runner.session_factory()
+
+    def progress(self, processed: int, total: Optional[int] = None, message: Optional[str] = None,
+                 force: bool = False):
+        """Record progress, writing it out at most every ``PROGRESS_INTERVAL``.
+
+        Raises JobCancelled or JobInterrupted when the job should stop, so
+        call it between units of work.
+        """
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        if self.runner.stopping:
+            raise JobInterrupted("Runner is shutting down")
+        now = time.monotonic()
+        if force or now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            if self.runner.report(self):
+                raise JobCancelled()
+
+# Job kinds
+def _write_json(path: str, content):
+    with open(path, "w", encoding="utf-8") as out:
+        json.dump(content, out)
+
+def _end_read(db: Session):
+    """End the read transaction, keeping loaded objects usable. Writers
+    aren't held up on SQLite, and a read transaction can't be upgraded to a
+    write there once another writer got in first."""
+    db.expunge_all()
+    db.rollback()
+
+def _batches(db: Session, query):
+    """Yield the rows of ``query`` in batches, by keyset on the drug id"""
+    last = None
+    while True:
+        page = query if last is None else query.filter(DrugModel.id > last)
+        rows = page.order_by(DrugModel.id).limit(BATCH_SIZE).all()
+        _end_read(db)
+        if not rows:
+            return
+        yield rows
+        last = rows[-1].id
+
+def export_drugs(ctx: JobContext) -> dict:
+    """Every drug, optionally filtered by ``category``/``ingredient``, as
+    JSON lines in the API's drug format"""
+    db = ctx.session()
+    try:
+        query = filter_drugs(
+            db.query(DrugModel), category=ctx.params.get("category"), ingredient=ctx.params.get("ingredient")
+        )
+        ctx.progress(0, query.count(), "Exporting drugs", force=True)
+        written = 0
+        with open(ctx.result_path, "w", encoding="utf-8") as out:
+            for rows in _batches(db, query):
+                for row in rows:
+                    out.write(json.dumps(jsonable_encoder(Drug.from_orm(row))) + "\n")
+                written += len(rows)
+                ctx.progress(written)
+    finally:
+        db.close()
+    return {"drugs": written}
+
+_IMPORT_FIELDS = ("name", "category", "description", "active_ingredients", "dosage_forms",
+                  "side_effects", "contraindications")
+
+def _import_drug(db: Session, drug: DrugCreate) -> str:
+    existing = get_drug_by_id(db, drug.id) if drug.id else None
+    _end_read(db)
+    if existing is None:
+        create_drug(db, drug)
+        return "created"
+    values = drug.dict(include=set(_IMPORT_FIELDS))
+    if all(getattr(existing, field) == value for field, value in values.items()):
+        return "unchanged"
+    # Conditional on the version read above, so an edit made since then is
+    # never overwritten; a drug deleted meanwhile isn't brought back either
+    if update_drug(db, drug.id, DrugUpdate(**values), expected_version=existing.version) is None:
+        raise VersionConflictError(drug.id, existing.version)
+    return "updated"
+
+def import_drugs(ctx: JobContext) -> dict:
+    """Create or update drugs from uploaded JSON lines (the export format).
+
+    Drugs with an ``id`` that already exists are updated, unless nothing
+    changed. Lines that fail validation, or whose drug is edited or deleted
+    while the line is applied, are counted and reported rather than failing
+    the job.
+    """
+    with open(ctx.input_path, "rb") as lines:
+        total = sum(1 for _ in lines)
+    ctx.progress(0, total, "Importing drugs", force=True)
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0}
+    errors = []
+
+    def fail(number: int, error: str):
+        counts["failed"] += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": number, "error": error})
+
+    db = ctx.session()
+    try:
+        with open(ctx.input_path, encoding="utf-8") as lines:
+            for number, line in enumerate(lines, 1):
+                if line.strip():
+                    try:
+                        drug = DrugCreate.parse_raw(line)
+                    except ValueError as exc:
+                        fail(number, str(exc))
+                    else:
+                        for attempt in range(3):
+                            try:
+                                counts[_import_drug(db, drug)] += 1
+                                break
+                            except VersionConflictError as exc:
+                                fail(number, f"{exc}; changed during the import, not overwritten")
+                                break
+                            except OperationalError:
+                                # Busy database: back off and retry the line
+                                db.rollback()
+                                if attempt == 2:
+                                    raise
+                                time.sleep(0.1 * (attempt + 1))
+                ctx.progress(number)
+    finally:
+        db.close()
+    _write_json(ctx.result_path, {**counts, "errors": errors})
+    return counts
+
+def _load_processor():
+    # drug_data_processor lives in scripts/, next to this backend directory
+    scripts = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if scripts not in sys.path:
+        sys.path.append(scripts)
+    import drug_data_processor
+
+    return drug_data_processor
+
+def run_analytics(ctx: JobContext) -> dict:
+    """Catalogue statistics and validation from ``drug_data_processor``"""
+    processor = _load_processor()
+    db = ctx.session()
+    try:
+        query = db.query(
+            DrugModel.id, DrugModel.name, DrugModel.category, DrugModel.description, DrugModel.side_effects
+        )
+        ctx.progress(0, query.count(), "Loading drugs", force=True)
+        drugs = []
+        for rows in _batches(db, query):
+            drugs.extend(dict(row._mapping) for row in rows)
+            ctx.progress(len(drugs))
+    finally:
+        db.close()
+    ctx.progress(len(drugs), message="Analysing", force=True)
+    validation = processor.validate_drug_data(drugs)
+    _write_json(ctx.result_path, {
+        "timestamp": datetime.utcnow().isoformat(),
+        "analysis": processor.analyze_drug_data(drugs),
+        "validation": validation,
+    })
+    return {"drugs": len(drugs), "invalid": validation["invalid_count"]}
+
+def rebuild_similar(ctx: JobContext) -> dict:
+    """Recompute every drug's entries in ``drug_similar``"""
+    db = ctx.session()
+    try:
+        ctx.progress(0, message="Loading drugs", force=True)
+        drugs = similar_drugs.rebuild(db, lambda done, total: ctx.progress(done, total, "Scoring drugs"))
+    finally:
+        db.close()
+    return {"drugs": drugs}
+
+@dataclass(frozen=True)
+class JobKind:
+    run: Callable[[JobContext], Optional[dict]]
+    # Of the result file
+    media_type: str
+    extension: str
+    # Jobs of this kind running at once, across every runner
+    max_concurrent: int
+    params: Tuple[str, ...] = ()
+
+JOB_KINDS: Dict[str, JobKind] = {
+    "export": JobKind(export_drugs, "application/x-ndjson", "jsonl", 4, ("category", "ingredient")),
+    "import": JobKind(import_drugs, "application/json", "json", 1),
+    "analytics": JobKind(run_analytics, "application/json", "json", 1),
+    "similar": JobKind(rebuild_similar, "application/json", "json", 1),
+}
+
+# Job records
+def submit_job(db: Session, kind: str, params: Optional[dict] = None, max_queued: int = 100,
+               job_id: Optional[str] = None) -> JobModel:
+    """Queue a job; raises ValueError for an unknown kind or parameter and
+    JobQueueFull when the backlog is at ``max_queued``"""
+    job_kind = JOB_KINDS.get(kind)
+    if job_kind is None:
+        raise ValueError(f"Unknown job kind: {kind}")
+    params = {key: value for key, value in (params or {}).items() if value is not None}
+    unknown = set(params) - set(job_kind.params)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {kind} jobs: {', '.join(sorted(unknown))}")
+    queued = db.query(func.count(JobModel.id)).filter(JobModel.status == QUEUED).scalar()
+    db.rollback()
+    if queued >= max_queued:
+        raise JobQueueFull(f"{queued} jobs are already queued")
+    job = JobModel(id=job_id or str(uuid.uuid4()), kind=kind, status=QUEUED, params=params)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def queue_similar_rebuild(db: Session) -> Optional[JobModel]:
+    """Queue a ``similar`` job if the table was never built and none is
+    pending"""
+    if not similar_drugs.enabled or not similar_is_empty(db) or db.query(DrugModel.id).first() is None:
+        return None
+    pending = db.query(JobModel.id).filter(JobModel.kind == "similar", JobModel.status.in_((QUEUED, RUNNING)))
+    if pending.first() is not None:
+        return None
+    return submit_job(db, "similar")
+
+def get_job(db: Session, job_id: str) -> Optional[JobModel]:
+    return db.query(JobModel).filter(JobModel.id == job_id).first()
+
+def list_jobs(db: Session, status: Optional[str] = None, limit: int = 50) -> List[JobModel]:
+    query = db.query(JobModel)
+    if status:
+        query = query.filter(JobModel.status == status)
+    return query.order_by(JobModel.created_at.desc(), JobModel.id).limit(limit).all()
+
+def cancel_job(db: Session, job_id: str) -> Optional[JobModel]:
+    """Cancel a queued job outright, or ask a running one to stop at its
+    next progress report. Finished jobs are left alone."""
+    cancelled = db.execute(
+        update(JobModel)
+        .where(JobModel.id == job_id, JobModel.status == QUEUED)
+        .values(status=CANCELLED, cancel_requested=True, finished_at=datetime.utcnow(), message="Cancelled")
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not cancelled:
+        db.execute(
+            update(JobModel)
+            .where(JobModel.id == job_id, JobModel.status == RUNNING)
+            .values(cancel_requested=True)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    return get_job(db, job_id)
+
+class JobRunner:
+    """Claims queued jobs and runs them on a dedicated pool of threads"""
+
+    def __init__(self, session_factory: Callable[..., Session], workers: int = 2, directory: str = "./jobs",
+                 poll_interval: float = 1.0, stale_seconds: float = 60.0):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self._threads: List[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        # Job id -> attempt, for the jobs this runner is working on
+        self._active: Dict[str, int] = {}
+
+    def configure(self, app_settings: Settings):
+        self.workers = app_settings.job_workers
+        self.directory = app_settings.job_directory
+        self.poll_interval = app_settings.job_poll_interval
+        self.stale_seconds = app_settings.job_stale_seconds
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.input")
+
+    def result_path(self, job: JobModel) -> str:
+        return os.path.join(self.directory, f"{job.id}.{JOB_KINDS[job.kind].extension}")
+
+    def start(self):
+        if self.running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(self.workers)
+        ]
+        self._threads.append(threading.Thread(target=self._monitor, name="job-monitor", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the workers; running jobs go back to the queue"""
+        if not self.running:
+            return
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def wake(self):
+        """Look for queued work now rather than at the next poll"""
+        self._wake.set()
+
+    def _work(self):
+        while not self.stopping:
+            try:
+                job = self._claim()
+            except Exception as exc:
+                logger.error("Claiming a job failed: %s", exc)
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+            else:
+                self._run(job)
+
+    def _monitor(self):
+        while not self._stopping.wait(self.stale_seconds / 4):
+            try:
+                self._heartbeat()
+                self.requeue_stale()
+            except Exception as exc:
+                logger.error("Job heartbeat failed: %s", exc)
+
+    def _claim(self) -> Optional[JobModel]:
+        db = self.session_factory()
+        try:
+            running = dict(
+                db.query(JobModel.kind, func.count(JobModel.id))
+                .filter(JobModel.status == RUNNING)
+                .group_by(JobModel.kind)
+            )
+            candidates = (
+                db.query(JobModel.id, JobModel.kind)
+                .filter(JobModel.status == QUEUED)
+                .order_by(JobModel.created_at, JobModel.id)
+                .limit(10)
+                .all()
+            )
+            db.rollback()
+            for job_id, kind in candidates:
+                job_kind = JOB_KINDS.get(kind)
+                if job_kind is None or running.get(kind, 0) >= job_kind.max_concurrent:
+                    continue
+                # Re-checked in the UPDATE itself, so two runners can't both
+                # take the job or push its kind over the limit
+                other = aliased(JobModel)
+                running_of_kind = (
+                    select(func.count(other.id)).where(other.kind == kind, other.status == RUNNING).scalar_subquery()
+                )
+                now = datetime.utcnow()
+                claimed = db.execute(
+                    update(JobModel)
+                    .where(JobModel.id == job_id, JobModel.status == QUEUED, running_of_kind < job_kind.max_concurrent)
+                    .values(status=RUNNING, started_at=now, heartbeat_at=now, attempts=JobModel.attempts + 1)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                db.commit()
+                if claimed:
+                    return get_job(db, job_id)
+            return None
+        finally:
+            db.close()
+
+    def _run(self, job: JobModel):
+        ctx = JobContext(self, job)
+        with self._lock:
+            self._active[job.id] = job.attempts
+        logger.info("Job %s (%s) started, attempt %d", job.id, job.kind, job.attempts)
+        started = time.perf_counter()
+        try:
+            summary = JOB_KINDS[job.kind].run(ctx)
+            result_path = None
+            if os.path.exists(ctx.result_path):
+                result_path = self.result_path(job)
+                os.replace(ctx.result_path, result_path)
+            self._finish(ctx, SUCCEEDED, summary=summary, result_path=result_path, message="Done")
+            logger.info("Job %s (%s) succeeded in %.2fs", job.id, job.kind, time.perf_counter() - started)
+        except JobCancelled:
+            self._finish(ctx, CANCELLED, message="Cancelled")
+            logger.info("Job %s (%s) cancelled", job.id, job.kind)
+        except JobInterrupted:
+            if job.attempts >= MAX_ATTEMPTS:
+                self._finish(ctx, FAILED, error="Interrupted too many times")
+            else:
+                self._finish(ctx, QUEUED, message="Interrupted; queued again")
+        except Exception as exc:
+            logger.error(
+                "Job %s (%s) failed: %s", job.id, job.kind, exc, exc_info=(type(exc), exc, exc.__traceback__)
+            )
+            self._finish(ctx, FAILED, error=str(exc))
+        finally:
+            with self._lock:
+                self._active.pop(job.id, None)
+            if os.path.exists(ctx.result_path):
+                os.remove(ctx.result_path)
+
+    def _update(self, ctx: JobContext, **values) -> bool:
+        """Update the job if this runner still owns it (same attempt)"""
+        db = self.session_factory()
+        try:
+            owned = db.execute(
+                update(JobModel)
+                .where(JobModel.id == ctx.job_id, JobModel.attempts == ctx.attempt, JobModel.status == RUNNING)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            cancel_requested = owned and db.query(JobModel.cancel_requested).filter(JobModel.id == ctx.job_id).scalar()
+            db.commit()
+        finally:
+            db.close()
+        if not owned:
+            raise JobInterrupted("Job was taken over by another runner")
+        return bool(cancel_requested)
+
+    def report(self, ctx: JobContext) -> bool:
+        """Write progress; returns whether the job has been cancelled"""
+        return self._update(
+            ctx, processed=ctx.processed, total=ctx.total, message=ctx.message, heartbeat_at=datetime.utcnow()
+        )
+
+    def _finish(self, ctx: JobContext, status: str, **values):
+        now = datetime.utcnow()
+        if status == QUEUED:
+            values.update(started_at=None, heartbeat_at=None, processed=0, total=None)
+        else:
+            values.update(finished_at=now, processed=ctx.processed, total=ctx.total)
+        values.setdefault("message", ctx.message)
+        try:
+            self._update(ctx, status=status, **values)
+        except JobInterrupted:
+            logger.warning("Job %s was taken over before it finished; result discarded", ctx.job_id)
+            return
+        except Exception as exc:
+            logger.error("Recording job %s as %s failed: %s", ctx.job_id, status, exc)
+            return
+        if status != QUEUED and os.path.exists(ctx.input_path):
+            os.remove(ctx.input_path)
+
+    def _heartbeat(self):
+        with self._lock:
+            active = dict(self._active)
+        if not active:
+            return
+        db = self.session_factory()
+        try:
+            for job_id, attempt in active.items():
+                db.execute(
+                    update(JobModel)
+                    .where(JobModel.id == job_id, JobModel.attempts == attempt, JobModel.status == RUNNING)
+                    .values(heartbeat_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    def requeue_stale(self):
+        """Queue again jobs whose runner stopped heartbeating (or fail them
+        after ``MAX_ATTEMPTS``)"""
+        stale = (JobModel.status == RUNNING) & (
+            JobModel.heartbeat_at < datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        )
+        db = self.session_factory()
+        try:
+            if db.query(JobModel.id).filter(stale).first() is None:
+                return
+            db.rollback()
+            db.execute(
+                update(JobModel)
+                .where(stale, JobModel.attempts >= MAX_ATTEMPTS)
+                .values(status=FAILED, finished_at=datetime.utcnow(), error="Runner stopped responding")
+                .execution_options(synchronize_session=False)
+            )
+            requeued = db.execute(
+                update(JobModel)
+                .where(stale)
+                .values(status=QUEUED, started_at=None, heartbeat_at=None, processed=0, total=None,
+                        message="Runner stopped responding; queued again")
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        if requeued:
+            logger.warning("Queued %d stale jobs again", requeued)
+            self.wake()
+
+job_runner = JobRunner(SessionLocal)
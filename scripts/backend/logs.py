@@ -0,0 +1,126 @@
+"""
+Structured, non-blocking logging.
+
+Request threads only put records on an in-memory queue; a listener thread
+formats them (JSON by default) and writes them out, so a slow stdout never
+stalls a request and tracebacks are rendered off the request path. Use
+%-style arguments (``logger.info("built %s", n)``) so messages are only
+formatted for records that are actually emitted.
+
+Client errors (4xx) are routine under scanning traffic: they log at DEBUG,
+and only a sampled fraction at INFO. The fraction is
+``log_client_error_sample_rate``, overridable per route template with
+``log_route_sample_rates`` (e.g. ``{"/drugs/{drug_id}": 0.001}``).
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from starlette.requests import Request
+
+from config import Settings
+from tracing import current_span
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including ``extra`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Argument types safe to format later in the listener thread
+_IMMUTABLE_ARGS = (str, bytes, int, float, bool, type(None), datetime)
+
+class DeferredQueueHandler(QueueHandler):
+    """Enqueues records without formatting them in the calling thread.
+
+    The stock handler renders the whole message (traceback included) before
+    enqueueing; here the record goes on the queue as is and the listener
+    thread merges the arguments. Only records with other argument types
+    (lists, ORM objects, ...) are merged here, since those may change or
+    touch a session after the call returns.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and not (
+            isinstance(record.args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in record.args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        span = current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return record
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+_client_error_sample_rate = 0.0
+_route_sample_rates = {}
+
+def configure_logging(app_settings: Settings):
+    """Route the root logger through a queue to a stdout writer thread.
+
+    Safe to call again: the previous listener is drained and replaced.
+    """
+    global _listener, _handler, _client_error_sample_rate, _route_sample_rates
+    stop_logging()
+
+    output = logging.StreamHandler(sys.stdout)
+    if app_settings.log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    _handler = DeferredQueueHandler(log_queue)
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(getattr(logging, app_settings.log_level))
+    _listener.start()
+
+    _client_error_sample_rate = app_settings.log_client_error_sample_rate
+    _route_sample_rates = dict(app_settings.log_route_sample_rates)
+
+def stop_logging():
+    """Flush queued records and detach the queue handler"""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def route_template(request: Request) -> str:
+    """The matched route's path template, else the raw path"""
+    route = request.scope.get("route")
+    return getattr(route, "path", request.url.path)
+
+def client_error_level(request: Request) -> int:
+    """INFO for the sampled fraction of client errors on this route,
+    otherwise DEBUG"""
+    rate = _route_sample_rates.get(route_template(request), _client_error_sample_rate)
+    if rate > 0 and random.random() < rate:
+        return logging.INFO
+    return logging.DEBUG
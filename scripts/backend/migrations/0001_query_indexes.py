@@ -0,0 +1,36 @@
+"""Add indexes matching the drug list query shapes
+
+- ix_drugs_created_at / ix_drugs_updated_at: date range filters
+- ix_drugs_category_name: category filter in name order, and an index-only
+  scan for the distinct category list (replaces ix_drugs_category, which
+  it covers)
+
+Databases bootstrapped by the API after this change already have them, so
+every statement is IF [NOT] EXISTS. On PostgreSQL the indexes are built
+CONCURRENTLY so writers aren't blocked on a large drugs table.
+
+Revision ID: 0001_query_indexes
+Revises:
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+revision = "0001_query_indexes"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    create_index_concurrently(op, "ix_drugs_created_at", "drugs", ["created_at"])
+    create_index_concurrently(op, "ix_drugs_updated_at", "drugs", ["updated_at"])
+    create_index_concurrently(op, "ix_drugs_category_name", "drugs", ["category", "name"])
+    drop_index_concurrently(op, "ix_drugs_category")
+
+def downgrade():
+    create_index_concurrently(op, "ix_drugs_category", "drugs", ["category"])
+    drop_index_concurrently(op, "ix_drugs_category_name")
+    drop_index_concurrently(op, "ix_drugs_updated_at")
+    drop_index_concurrently(op, "ix_drugs_created_at")
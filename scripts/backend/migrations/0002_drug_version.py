@@ -0,0 +1,36 @@
+"""Add drugs.version for optimistic concurrency control
+
+Every update bumps the version and clients send it back in If-Match, so
+existing rows start at 1.
+
+Adding a NOT NULL column with a constant default rewrites no rows on either
+backend (PostgreSQL 11+ stores the default in the catalogue, SQLite's ADD
+COLUMN only edits the schema), so this is a short metadata change and needs
+no batched backfill even on a large drugs table. Databases bootstrapped by
+the API after this change already have the column and are left alone.
+
+Revision ID: 0002_drug_version
+Revises: 0001_query_indexes
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002_drug_version"
+down_revision = "0001_query_indexes"
+branch_labels = None
+depends_on = None
+
+def has_version_column() -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns("drugs")
+    return any(column["name"] == "version" for column in columns)
+
+def upgrade():
+    if not has_version_column():
+        op.add_column("drugs", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+def downgrade():
+    if has_version_column():
+        with op.batch_alter_table("drugs") as batch_op:
+            batch_op.drop_column("version")
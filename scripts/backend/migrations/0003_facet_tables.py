@@ -0,0 +1,52 @@
+"""Add the facet side tables and the row counter table
+
+- drug_ingredients / drug_dosage_forms: one row per (drug, value), so facet
+  counts and exact filters are indexed lookups instead of JSON scans
+- table_counts: row counts kept by the write paths for cheap totals on SQLite
+
+The tables start empty; on the next start the API fills the facet rows from
+drugs (backfill_facet_rows) and the drugs counter from an exact count
+(init_table_counts). Databases bootstrapped by the API after this change
+already have the tables, so existing ones are left alone.
+
+Revision ID: 0003_facet_tables
+Revises: 0002_drug_version
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+revision = "0003_facet_tables"
+down_revision = "0002_drug_version"
+branch_labels = None
+depends_on = None
+
+FACET_TABLES = ("drug_ingredients", "drug_dosage_forms")
+
+def has_table(name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(name)
+
+def upgrade():
+    for name in FACET_TABLES:
+        if not has_table(name):
+            op.create_table(
+                name,
+                sa.Column("drug_id", sa.String(), sa.ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True),
+                sa.Column("value", sa.String(), primary_key=True),
+            )
+        create_index_concurrently(op, f"ix_{name}_value", name, ["value", "drug_id"])
+    if not has_table("table_counts"):
+        op.create_table(
+            "table_counts",
+            sa.Column("table_name", sa.String(), primary_key=True),
+            sa.Column("row_count", sa.Integer(), nullable=False),
+        )
+
+def downgrade():
+    op.drop_table("table_counts")
+    for name in FACET_TABLES:
+        drop_index_concurrently(op, f"ix_{name}_value")
+        op.drop_table(name)
@@ -0,0 +1,38 @@
+"""Add the drug_changes log behind GET /changes
+
+Every drug write appends a row in the same transaction; ``seq`` orders the
+feed. On SQLite the table is AUTOINCREMENT so sequence numbers are never
+reused, even after the newest rows are pruned. Databases bootstrapped by
+the API after this change already have the table and are left alone.
+
+Revision ID: 0004_drug_changes
+Revises: 0003_facet_tables
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+revision = "0004_drug_changes"
+down_revision = "0003_facet_tables"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table("drug_changes"):
+        op.create_table(
+            "drug_changes",
+            sa.Column("seq", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("drug_id", sa.String(), nullable=False),
+            sa.Column("operation", sa.String(), nullable=False),
+            sa.Column("version", sa.Integer(), nullable=True),
+            sa.Column("changed_at", sa.DateTime(), nullable=False),
+            sqlite_autoincrement=True,
+        )
+    create_index_concurrently(op, "ix_drug_changes_drug_id", "drug_changes", ["drug_id"])
+
+def downgrade():
+    drop_index_concurrently(op, "ix_drug_changes_drug_id")
+    op.drop_table("drug_changes")
@@ -0,0 +1,47 @@
+"""Add the jobs table for background exports, re-imports and analytics
+
+Runners claim queued rows oldest first through ix_jobs_status_created_at.
+Databases bootstrapped by the API after this change already have the table
+and are left alone.
+
+Revision ID: 0005_jobs
+Revises: 0004_drug_changes
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+revision = "0005_jobs"
+down_revision = "0004_drug_changes"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table("jobs"):
+        op.create_table(
+            "jobs",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("kind", sa.String(), nullable=False),
+            sa.Column("status", sa.String(), nullable=False),
+            sa.Column("params", sa.JSON(), nullable=False),
+            sa.Column("processed", sa.Integer(), nullable=False),
+            sa.Column("total", sa.Integer(), nullable=True),
+            sa.Column("message", sa.String(), nullable=True),
+            sa.Column("summary", sa.JSON(), nullable=True),
+            sa.Column("error", sa.Text(), nullable=True),
+            sa.Column("result_path", sa.String(), nullable=True),
+            sa.Column("cancel_requested", sa.Boolean(), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("started_at", sa.DateTime(), nullable=True),
+            sa.Column("finished_at", sa.DateTime(), nullable=True),
+            sa.Column("heartbeat_at", sa.DateTime(), nullable=True),
+        )
+    create_index_concurrently(op, "ix_jobs_status_created_at", "jobs", ["status", "created_at"])
+
+def downgrade():
+    drop_index_concurrently(op, "ix_jobs_status_created_at")
+    op.drop_table("jobs")
@@ -0,0 +1,37 @@
+"""Add drug_similar, the precomputed neighbours behind /drugs/{id}/similar
+
+The table starts empty; the API queues a full rebuild at startup when it
+finds drugs without neighbours. Databases bootstrapped by the API after
+this change already have the table and are left alone.
+
+Revision ID: 0006_drug_similar
+Revises: 0005_jobs
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+revision = "0006_drug_similar"
+down_revision = "0005_jobs"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table("drug_similar"):
+        op.create_table(
+            "drug_similar",
+            sa.Column("drug_id", sa.String(), sa.ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("similar_id", sa.String(), sa.ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("score", sa.Float(), nullable=False),
+            sa.Column("rank", sa.Integer(), nullable=False),
+        )
+    create_index_concurrently(op, "ix_drug_similar_drug_id_rank", "drug_similar", ["drug_id", "rank"])
+    create_index_concurrently(op, "ix_drug_similar_similar_id", "drug_similar", ["similar_id"])
+
+def downgrade():
+    drop_index_concurrently(op, "ix_drug_similar_similar_id")
+    drop_index_concurrently(op, "ix_drug_similar_drug_id_rank")
+    op.drop_table("drug_similar")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, JSON
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer, String, DateTime, Text
 from sqlalchemy.dialects.sqlite import JSON as SQLiteJSON
 from database import Base
 from datetime import datetime
@@ -8,14 +8,101 @@ class Drug(Base):
 
     id = Column(String, primary_key=True, index=True)
     name = Column(String, nullable=False, index=True)
-    category = Column(String, nullable=False, index=True)
+    category = Column(String, nullable=False)
     description = Column(Text, nullable=False)
     active_ingredients = Column(SQLiteJSON, nullable=False)
     dosage_forms = Column(SQLiteJSON, nullable=False)
     side_effects = Column(SQLiteJSON, nullable=True, default=[])
     contraindications = Column(SQLiteJSON, nullable=True, default=[])
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Bumped on every update; clients send it back in If-Match
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    # Serves the exact category filter in name order, and SELECT DISTINCT
+    # category (GET /categories) as an index-only scan; its leading column
+    # makes ix_drugs_category redundant
+    __table_args__ = (Index("ix_drugs_category_name", "category", "name"),)
 
     def __repr__(self):
         return f"<Drug(id='{self.id}', name='{self.name}', category='{self.category}')>"
+
+# Facet side tables: one row per (drug, value) so facet counts and exact
+# filters are indexed GROUP BY / lookups instead of JSON scans
+class DrugIngredient(Base):
+    __tablename__ = "drug_ingredients"
+
+    drug_id = Column(String, ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True)
+    value = Column(String, primary_key=True)
+
+    __table_args__ = (Index("ix_drug_ingredients_value", "value", "drug_id"),)
+
+class DrugDosageForm(Base):
+    __tablename__ = "drug_dosage_forms"
+
+    drug_id = Column(String, ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True)
+    value = Column(String, primary_key=True)
+
+    __table_args__ = (Index("ix_drug_dosage_forms_value", "value", "drug_id"),)
+
+# Row counts maintained transactionally by the write paths, used for cheap
+# estimated totals where the database has no planner statistics to offer
+class TableCount(Base):
+    __tablename__ = "table_counts"
+
+    table_name = Column(String, primary_key=True)
+    row_count = Column(Integer, nullable=False)
+
+# Top-k neighbours of each drug by feature similarity, maintained by
+# similar.py; ``rank`` 1 is the closest
+class DrugSimilar(Base):
+    __tablename__ = "drug_similar"
+
+    drug_id = Column(String, ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True)
+    similar_id = Column(String, ForeignKey("drugs.id", ondelete="CASCADE"), primary_key=True)
+    score = Column(Float, nullable=False)
+    rank = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_drug_similar_drug_id_rank", "drug_id", "rank"),
+        Index("ix_drug_similar_similar_id", "similar_id"),
+    )
+
+# Append-only change log written in the same transaction as each drug
+# write; ``seq`` orders the feed served by GET /changes
+class DrugChange(Base):
+    __tablename__ = "drug_changes"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    drug_id = Column(String, nullable=False, index=True)
+    operation = Column(String, nullable=False)
+    version = Column(Integer, nullable=True)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Never reuse sequence numbers, even after the newest rows are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# Background jobs (exports, re-imports, analytics). Any API process can
+# report on or cancel a job; runners claim queued rows and keep
+# ``heartbeat_at`` fresh while they work on them
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    params = Column(SQLiteJSON, nullable=False, default={})
+    processed = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    message = Column(String, nullable=True)
+    summary = Column(SQLiteJSON, nullable=True)
+    error = Column(Text, nullable=True)
+    result_path = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_jobs_status_created_at", "status", "created_at"),)
@@ -0,0 +1,236 @@
+"""
+Helpers for schema changes on large tables without blocking writers.
+
+- ``create_index_concurrently`` / ``drop_index_concurrently``: on PostgreSQL
+  run ``CREATE/DROP INDEX CONCURRENTLY`` outside the migration transaction.
+- ``backfill``: update a table in primary-key ordered batches, each in its
+  own short transaction, with optional throttling and progress reporting.
+- ``rebuild_sqlite_table``: SQLite can't alter most of a table in place, so
+  copy it into a new table in chunks while triggers mirror concurrent
+  writes, then swap the two in one short transaction.
+
+The batched helpers take an Engine and commit every batch on their own.
+From an Alembic revision, call them with ``op.get_bind().engine`` inside
+``op.get_context().autocommit_block()`` so the migration's own transaction
+isn't holding locks meanwhile.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+
+logger = logging.getLogger(__name__)
+
+def create_index_concurrently(op, index_name: str, table_name: str, columns: Sequence[str], unique: bool = False):
+    """Create an index without locking writes (PostgreSQL); a plain
+    CREATE INDEX elsewhere"""
+    unique_sql = "UNIQUE " if unique else ""
+    column_sql = ", ".join(columns)
+    if op.get_bind().dialect.name == "postgresql":
+        # CONCURRENTLY is not allowed inside a transaction block
+        with op.get_context().autocommit_block():
+            op.execute(
+                f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+                f"ON {table_name} ({column_sql})"
+            )
+    else:
+        op.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_sql})")
+
+def drop_index_concurrently(op, index_name: str):
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+    else:
+        op.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+class Progress:
+    """Logs rows done, rate and ETA at most every ``interval`` seconds"""
+
+    def __init__(self, label: str, total: Optional[int] = None, interval: float = 5.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = time.monotonic()
+        self._last_report = 0.0
+
+    def update(self, rows: int):
+        self.done += rows
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    @property
+    def rate(self) -> float:
+        return self.done / max(time.monotonic() - self.started, 1e-9)
+
+    def report(self):
+        if self.total:
+            remaining = max(self.total - self.done, 0) / max(self.rate, 1e-9)
+            logger.info(
+                "%s: %d/%d rows (%.0f%%, %.0f rows/s, ~%.0fs left)",
+                self.label, self.done, self.total, 100 * self.done / self.total, self.rate, remaining
+            )
+        else:
+            logger.info("%s: %d rows (%.0f rows/s)", self.label, self.done, self.rate)
+
+def _throttle(rows: int, batch_started: float, pause: float, max_rows_per_second: Optional[float]):
+    delay = pause
+    if max_rows_per_second:
+        delay = max(delay, rows / max_rows_per_second - (time.monotonic() - batch_started))
+    if delay > 0:
+        time.sleep(delay)
+
+def _primary_key(engine: Engine, table_name: str) -> str:
+    columns = inspect(engine).get_pk_constraint(table_name)["constrained_columns"]
+    if len(columns) != 1:
+        raise ValueError(f"{table_name} needs a single-column primary key for batching")
+    return columns[0]
+
+def backfill(
+    engine: Engine,
+    table_name: str,
+    assignments: str,
+    where: Optional[str] = None,
+    batch_size: int = 1000,
+    pause: float = 0.0,
+    max_rows_per_second: Optional[float] = None,
+    progress: Optional[Callable[[Progress], None]] = None,
+) -> int:
+    """Run ``UPDATE table SET <assignments> [WHERE <where>]`` in batches.
+
+    Rows are walked in primary key order, ``batch_size`` at a time, so each
+    transaction holds its locks only briefly; ``pause`` and
+    ``max_rows_per_second`` leave room for foreground traffic. ``progress``
+    is called after every batch. Returns the number of rows updated.
+    """
+    key = _primary_key(engine, table_name)
+    condition = f" AND ({where})" if where else ""
+    with engine.begin() as connection:
+        total = connection.execute(text(f"SELECT COUNT(*) FROM {table_name} WHERE 1=1{condition}")).scalar()
+    tracker = Progress(f"backfill {table_name}", total)
+
+    last_key = None
+    while True:
+        batch_started = time.monotonic()
+        with engine.begin() as connection:
+            after = f" AND {key} > :last_key" if last_key is not None else ""
+            keys = connection.execute(
+                text(f"SELECT {key} FROM {table_name} WHERE 1=1{condition}{after} ORDER BY {key} LIMIT :limit"),
+                {"last_key": last_key, "limit": batch_size},
+            ).scalars().all()
+            if not keys:
+                break
+            connection.execute(
+                text(f"UPDATE {table_name} SET {assignments} WHERE {key} >= :first AND {key} <= :last{condition}"),
+                {"first": keys[0], "last": keys[-1]},
+            )
+        last_key = keys[-1]
+        tracker.update(len(keys))
+        if progress:
+            progress(tracker)
+        _throttle(len(keys), batch_started, pause, max_rows_per_second)
+
+    tracker.report()
+    return tracker.done
+
+def rebuild_sqlite_table(
+    engine: Engine,
+    new_table: Table,
+    column_expressions: Optional[Dict[str, str]] = None,
+    batch_size: int = 5000,
+    pause: float = 0.0,
+    max_rows_per_second: Optional[float] = None,
+    progress: Optional[Callable[[Progress], None]] = None,
+) -> int:
+    """Rebuild ``new_table.name`` with ``new_table``'s definition, in chunks.
+
+    Columns are copied by name; ``column_expressions`` maps new columns to
+    SQL over the old row (e.g. ``{"display_name": "upper(name)"}``). New
+    columns without one get their server default. While chunks are copied
+    in short transactions, triggers on the old table replay every insert,
+    update and delete into the new one, so nothing written in between is
+    lost. The final swap (drop old, rename new, recreate indexes) is one
+    short transaction. Returns the number of rows copied.
+    """
+    name = new_table.name
+    shadow = f"{name}__rebuild"
+    key = _primary_key(engine, name)
+    old_columns = {column["name"] for column in inspect(engine).get_columns(name)}
+    expressions = {
+        column.name: (column_expressions or {}).get(column.name, column.name)
+        for column in new_table.columns
+        if column.name in (column_expressions or {}) or column.name in old_columns
+    }
+    target_sql = ", ".join(expressions)
+    select_sql = ", ".join(expressions.values())
+
+    shadow_table = new_table.to_metadata(MetaData(), name=shadow)
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {shadow}"))
+        connection.execute(CreateTable(shadow_table))
+        copy_row = f"INSERT OR REPLACE INTO {shadow} ({target_sql}) SELECT {select_sql} FROM {name} WHERE {key} = NEW.{key};"
+        connection.execute(text(
+            f"CREATE TRIGGER {shadow}_insert AFTER INSERT ON {name} BEGIN {copy_row} END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER {shadow}_update AFTER UPDATE ON {name} BEGIN "
+            f"DELETE FROM {shadow} WHERE {key} = OLD.{key}; {copy_row} END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER {shadow}_delete AFTER DELETE ON {name} BEGIN "
+            f"DELETE FROM {shadow} WHERE {key} = OLD.{key}; END"
+        ))
+        total = connection.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar()
+    tracker = Progress(f"rebuild {name}", total)
+
+    last_key = None
+    while True:
+        batch_started = time.monotonic()
+        with engine.begin() as connection:
+            after = f"WHERE {key} > :last_key " if last_key is not None else ""
+            keys = connection.execute(
+                text(f"SELECT {key} FROM {name} {after}ORDER BY {key} LIMIT :limit"),
+                {"last_key": last_key, "limit": batch_size},
+            ).scalars().all()
+            if not keys:
+                break
+            # Rows the triggers already mirrored are newer than this copy
+            connection.execute(
+                text(
+                    f"INSERT OR IGNORE INTO {shadow} ({target_sql}) SELECT {select_sql} FROM {name} "
+                    f"WHERE {key} >= :first AND {key} <= :last"
+                ),
+                {"first": keys[0], "last": keys[-1]},
+            )
+        last_key = keys[-1]
+        tracker.update(len(keys))
+        if progress:
+            progress(tracker)
+        _throttle(len(keys), batch_started, pause, max_rows_per_second)
+
+    with engine.connect() as connection:
+        # Dropping the old table would otherwise cascade into child tables.
+        # The pragma is per connection and can't change inside a transaction
+        foreign_keys = connection.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        if foreign_keys:
+            connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        try:
+            with connection.begin():
+                for suffix in ("insert", "update", "delete"):
+                    connection.execute(text(f"DROP TRIGGER {shadow}_{suffix}"))
+                connection.execute(text(f"DROP TABLE {name}"))
+                connection.execute(text(f"ALTER TABLE {shadow} RENAME TO {name}"))
+                for index in new_table.indexes:
+                    index.create(connection)
+        finally:
+            if foreign_keys:
+                connection.exec_driver_sql("PRAGMA foreign_keys = ON")
+
+    tracker.report()
+    return tracker.done
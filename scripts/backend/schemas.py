@@ -1,6 +1,7 @@
-from pydantic import BaseModel, validator
-from typing import List, Optional
+from pydantic import BaseModel, validator, create_model
+from typing import Any, Dict, List, Literal, Optional, Tuple
 from datetime import datetime
+from functools import lru_cache
 
 class DrugBase(BaseModel):
     name: str
@@ -47,10 +48,133 @@ class DrugUpdate(BaseModel):
             raise ValueError('Category cannot be empty')
         return v.strip() if v else v
 
+# Fields holding JSON arrays of strings, editable through PATCH operations
+ARRAY_FIELDS = ("active_ingredients", "dosage_forms", "side_effects", "contraindications")
+
+class ArrayPatchOperation(BaseModel):
+    """JSON Patch-style edit of one array field.
+
+    ``add`` appends ``value`` unless it is already present (path ``/field``
+    or ``/field/-``); ``remove`` drops every element equal to ``value``.
+    """
+    op: Literal["add", "remove"]
+    path: str
+    value: str
+
+    @validator('path')
+    def path_must_name_array_field(cls, v):
+        parts = v.split("/")
+        if len(parts) not in (2, 3) or parts[0] != "" or parts[1] not in ARRAY_FIELDS:
+            raise ValueError(f'Path must be one of: {["/" + field for field in ARRAY_FIELDS]}')
+        if len(parts) == 3 and parts[2] != "-":
+            raise ValueError('Only "/-" may follow the field name')
+        return v
+
+    @validator('value')
+    def value_must_not_be_empty(cls, v):
+        if not v.strip():
+            raise ValueError('Value cannot be empty')
+        return v.strip()
+
+    @property
+    def field(self) -> str:
+        return self.path.split("/")[1]
+
 class Drug(DrugBase):
     id: str
     created_at: datetime
     updated_at: datetime
+    version: int = 1
 
     class Config:
         orm_mode = True
+
+class ErrorResponse(BaseModel):
+    detail: str
+
+class DrugSuggestion(BaseModel):
+    id: str
+    name: str
+
+class ScreenedDrug(BaseModel):
+    id: str
+    name: str
+    # The requested conditions this drug is contraindicated in
+    matched_conditions: List[str]
+
+class ScreeningResult(BaseModel):
+    total: int
+    # Requested conditions no drug is contraindicated in
+    unmatched_conditions: List[str]
+    results: List[ScreenedDrug]
+
+class SimilarDrug(BaseModel):
+    id: str
+    name: str
+    category: str
+    # Cosine similarity of the two drugs' features, 0 to 1
+    score: float
+    shared_ingredients: List[str]
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class DrugSearchResult(BaseModel):
+    results: List[Drug]
+    facets: Dict[str, List[FacetCount]]
+
+class DrugChange(BaseModel):
+    seq: int
+    drug_id: str
+    operation: Literal["create", "update", "delete"]
+    version: Optional[int] = None
+    changed_at: datetime
+
+    class Config:
+        orm_mode = True
+
+class JobCreate(BaseModel):
+    kind: Literal["export", "analytics", "similar"]
+    params: Dict[str, Any] = {}
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed", "cancelled"]
+    params: Dict[str, Any] = {}
+    processed: int = 0
+    total: Optional[int] = None
+    # Fraction done, when the total is known
+    progress: Optional[float] = None
+    message: Optional[str] = None
+    summary: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    attempts: int = 0
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @validator('progress', always=True)
+    def compute_progress(cls, v, values):
+        total = values.get('total')
+        if v is None and total is not None:
+            return min(values.get('processed', 0) / total, 1.0) if total else 1.0
+        return v
+
+    class Config:
+        orm_mode = True
+
+# Sparse fieldsets
+DRUG_FIELDS = tuple(Drug.__fields__)
+
+@lru_cache(maxsize=128)
+def get_projection_model(fields: Tuple[str, ...]):
+    """Build (once per projection) a response model with only the given fields"""
+    definitions = {}
+    for field in fields:
+        model_field = Drug.__fields__[field]
+        default = ... if model_field.required else model_field.default
+        definitions[field] = (model_field.outer_type_, default)
+    return create_model(f"Drug[{','.join(fields)}]", **definitions)
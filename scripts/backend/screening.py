@@ -0,0 +1,221 @@
+"""
+In-memory inverted index behind contraindication screening.
+
+``GET /drugs/screen`` takes a patient's conditions and returns every drug
+contraindicated in any (or all) of them. Conditions and contraindications
+match on normalized terms: case, punctuation and spacing are ignored, and a
+contraindication is also indexed under each of its word suffixes, so
+"kidney disease" finds drugs contraindicated in "Severe kidney disease".
+
+Each drug gets a dense ordinal, in name order when the index is built and
+appended for drugs created later. A term's posting list is a sorted
+``array`` of ordinals while it is short, and a bitmap (a Python int with
+bit n set for ordinal n) once it covers more than 1 in ``DENSE_RATIO``
+drugs, where the bitmap is the smaller of the two. A query turns each
+posting into a bitmap and combines them with ``|`` or ``&``, which run in C
+a machine word at a time (125KB per bitmap at 1M drugs), and only the
+requested page of set bits is turned back into drugs.
+
+Like the suggest index it is built at startup and kept current by the
+write paths of this process.
+"""
+
+import re
+from array import array
+from bisect import bisect_left, insort
+from itertools import islice
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# A posting becomes a bitmap once it holds more than 1 in this many drugs
+DENSE_RATIO = 32
+
+# Conditions accepted in one screening request
+MAX_CONDITIONS = 50
+
+# Bitmap bytes counted at a time when seeking to the requested page
+_CHUNK = 512
+
+Posting = Union[array, int]
+
+def normalize(condition: str) -> str:
+    """Normalize a condition for matching: case-folded words, single spaced"""
+    return " ".join(_WORD_RE.findall(condition.casefold()))
+
+def condition_terms(contraindications: Optional[Sequence[str]]) -> Tuple[str, ...]:
+    """Every term a drug's contraindications are found under: each one
+    normalized, and the text from each later word on"""
+    terms = set()
+    for contraindication in contraindications or ():
+        words = normalize(contraindication).split(" ")
+        terms.update(" ".join(words[start:]) for start in range(len(words)) if words[start])
+    return tuple(sorted(terms))
+
+def _popcount(value: int) -> int:
+    # int.bit_count needs Python 3.10
+    return bin(value).count("1")
+
+def _bitmap(ordinals: Iterable[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for ordinal in ordinals:
+        bits[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(bits, "little")
+
+def _set_bits(bitmap: int, skip: int = 0) -> Iterator[int]:
+    """Ordinals set in ``bitmap``, ascending, after the first ``skip``"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for start in range(0, len(data), _CHUNK):
+        value = int.from_bytes(data[start:start + _CHUNK], "little")
+        if not value:
+            continue
+        count = _popcount(value)
+        if skip >= count:
+            skip -= count
+            continue
+        while value:
+            low = value & -value
+            value ^= low
+            if skip:
+                skip -= 1
+            else:
+                yield start * 8 + low.bit_length() - 1
+
+class ContraindicationIndex:
+    """Inverted index from normalized condition term to the drugs
+    contraindicated in it"""
+
+    def __init__(self):
+        # Ordinal -> drug id and name; None once the drug is deleted
+        self._ids: List[Optional[str]] = []
+        self._names: List[Optional[str]] = []
+        self._ordinals: Dict[str, int] = {}
+        self._terms: Dict[str, Tuple[str, ...]] = {}
+        self._postings: Dict[str, Posting] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._ordinals)
+
+    def build(self, drugs: Iterable[Tuple[str, str, Sequence[str]]]):
+        """Replace the index contents with ``(id, name, contraindications)``
+        rows, numbered in the order given"""
+        ids, names, ordinals, terms = [], [], {}, {}
+        lists: Dict[str, array] = {}
+        for drug_id, name, contraindications in drugs:
+            ordinals[drug_id] = len(ids)
+            terms[drug_id] = condition_terms(contraindications)
+            for term in terms[drug_id]:
+                lists.setdefault(term, array("l")).append(len(ids))
+            ids.append(drug_id)
+            names.append(name)
+        postings = {
+            term: _bitmap(posting, len(ids)) if len(posting) * DENSE_RATIO > len(ids) else posting
+            for term, posting in lists.items()
+        }
+        with self._lock:
+            self._ids = ids
+            self._names = names
+            self._ordinals = ordinals
+            self._terms = terms
+            self._postings = postings
+
+    def add(self, drug_id: str, name: str, contraindications: Optional[Sequence[str]]):
+        """Insert or replace a single drug"""
+        terms = condition_terms(contraindications)
+        with self._lock:
+            ordinal = self._ordinals.get(drug_id)
+            if ordinal is None:
+                ordinal = self._ordinals[drug_id] = len(self._ids)
+                self._ids.append(drug_id)
+                self._names.append(name)
+            else:
+                self._names[ordinal] = name
+            old = set(self._terms.get(drug_id, ()))
+            for term in old.difference(terms):
+                self._unset(term, ordinal)
+            for term in set(terms).difference(old):
+                self._set(term, ordinal)
+            self._terms[drug_id] = terms
+
+    def remove(self, drug_id: str):
+        """Drop a drug from the index if present"""
+        with self._lock:
+            ordinal = self._ordinals.pop(drug_id, None)
+            if ordinal is None:
+                return
+            for term in self._terms.pop(drug_id, ()):
+                self._unset(term, ordinal)
+            self._ids[ordinal] = None
+            self._names[ordinal] = None
+
+    def _set(self, term: str, ordinal: int):
+        posting = self._postings.get(term)
+        if isinstance(posting, int):
+            self._postings[term] = posting | (1 << ordinal)
+            return
+        if posting is None:
+            posting = self._postings[term] = array("l")
+        insort(posting, ordinal)
+        if len(posting) * DENSE_RATIO > len(self._ids):
+            self._postings[term] = _bitmap(posting, len(self._ids))
+
+    def _unset(self, term: str, ordinal: int):
+        posting = self._postings.get(term)
+        if isinstance(posting, int):
+            posting &= ~(1 << ordinal)
+        elif posting is not None:
+            position = bisect_left(posting, ordinal)
+            if position < len(posting) and posting[position] == ordinal:
+                del posting[position]
+        if posting:
+            self._postings[term] = posting
+        else:
+            self._postings.pop(term, None)
+
+    def screen(self, conditions: Sequence[str], match_all: bool = False, skip: int = 0, limit: int = 100) -> dict:
+        """Drugs contraindicated in any of ``conditions`` (all of them with
+        ``match_all``), in ordinal order.
+
+        Returns the total, the conditions no drug matched, and one page of
+        ``{"id", "name", "matched_conditions"}`` results.
+        """
+        # Normalized term -> the condition as the caller wrote it
+        requested: Dict[str, str] = {}
+        for condition in conditions:
+            requested.setdefault(normalize(condition), condition)
+        requested.pop("", None)
+
+        with self._lock:
+            size = len(self._ids)
+            bitmaps = {}
+            for term in requested:
+                posting = self._postings.get(term, 0)
+                bitmaps[term] = posting if isinstance(posting, int) else _bitmap(posting, size)
+
+            result = 0
+            if bitmaps:
+                values = iter(bitmaps.values())
+                result = next(values)
+                for bitmap in values:
+                    result = result & bitmap if match_all else result | bitmap
+
+            results = []
+            for ordinal in islice(_set_bits(result, skip), limit):
+                drug_terms = self._terms[self._ids[ordinal]]
+                results.append({
+                    "id": self._ids[ordinal],
+                    "name": self._names[ordinal],
+                    "matched_conditions": [
+                        condition for term, condition in requested.items() if term in drug_terms
+                    ],
+                })
+
+        return {
+            "total": _popcount(result),
+            "unmatched_conditions": [condition for term, condition in requested.items() if not bitmaps[term]],
+            "results": results,
+        }
+
+contraindication_index = ContraindicationIndex()
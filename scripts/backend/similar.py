@@ -0,0 +1,339 @@
+"""
+Precomputed "similar drugs" for the detail page.
+
+Each drug is a sparse feature vector: its active ingredients, side effects,
+contraindications and category, each weighted by field and by inverse
+document frequency, so sharing a rare ingredient counts for far more than
+sharing "Nausea". Similarity is the cosine of two vectors. The top
+``similar_top_k`` neighbours of every drug are stored in ``drug_similar``
+and served by ``GET /drugs/{id}/similar``.
+
+Neighbours are found through an inverted index from feature to drugs, so
+scoring a drug only touches the drugs it shares a feature with (one row of
+a sparse matrix times its transpose). Features held by more than
+``COMMON_FRACTION`` of the drugs don't find candidates: their weight is
+close to zero and their postings span most of the catalogue. They still
+count towards the score of drugs found through rarer features, so scores
+stay exact cosines. Below ``MIN_COMMON_POSTING`` drugs every posting is
+cheap to walk and no feature is treated as common.
+
+The ``similar`` background job rebuilds the whole table; startup queues
+one when the table is empty. After that, writes refresh it incrementally:
+a changed drug gets new neighbours, and so does every drug it enters or
+drops out of the top k of. Document frequencies drift as the catalogue
+changes, so scores of untouched drugs go slightly stale until the next
+rebuild. Like the search indexes, the in-memory index only sees writes made
+by its own process.
+"""
+
+import heapq
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import Settings
+from models import Drug as DrugModel, DrugSimilar as DrugSimilarModel
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of a shared value, by field
+FIELD_WEIGHTS = {"i": 3.0, "k": 1.5, "s": 1.0, "c": 1.0}
+
+# Features on more than this share of the drugs don't find candidates...
+COMMON_FRACTION = 0.5
+# ...unless their posting is this short anyway
+MIN_COMMON_POSTING = 1000
+
+# Drugs written per transaction
+BATCH_SIZE = 500
+
+def features(
+    category: str,
+    active_ingredients: Optional[Sequence[str]],
+    side_effects: Optional[Sequence[str]],
+    contraindications: Optional[Sequence[str]],
+) -> Set[str]:
+    """Field-prefixed, case-folded feature tokens of a drug"""
+    tokens = {f"k:{category.strip().casefold()}"} if category else set()
+    for prefix, values in (("i", active_ingredients), ("s", side_effects), ("c", contraindications)):
+        tokens.update(f"{prefix}:{value.strip().casefold()}" for value in values or () if value.strip())
+    return tokens
+
+class SimilarityIndex:
+    """Inverted index from feature token to the drugs that have it"""
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._features: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def __contains__(self, drug_id: str) -> bool:
+        return drug_id in self._features
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return sorted(self._features)
+
+    def build(self, drugs: Iterable[Tuple[str, str, list, list, list]]):
+        """Replace the index contents with ``(id, category, active_ingredients,
+        side_effects, contraindications)`` rows"""
+        postings: Dict[str, Set[str]] = {}
+        drug_features: Dict[str, Set[str]] = {}
+        for drug_id, *values in drugs:
+            drug_features[drug_id] = features(*values)
+            for token in drug_features[drug_id]:
+                postings.setdefault(token, set()).add(drug_id)
+        with self._lock:
+            self._postings = postings
+            self._features = drug_features
+
+    def add(self, drug_id: str, tokens: Set[str]):
+        """Insert or replace a single drug"""
+        with self._lock:
+            self._discard(drug_id)
+            self._features[drug_id] = tokens
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(drug_id)
+
+    def remove(self, drug_id: str):
+        with self._lock:
+            self._discard(drug_id)
+
+    def _discard(self, drug_id: str):
+        for token in self._features.pop(drug_id, ()):
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.discard(drug_id)
+                if not posting:
+                    del self._postings[token]
+
+    def _weight(self, token: str, total: int) -> float:
+        # Squared weight of a feature; every drug holding it shares the value
+        return (FIELD_WEIGHTS[token[0]] * math.log(total / len(self._postings[token]))) ** 2
+
+    def scores(self, drug_id: str) -> Dict[str, float]:
+        """Cosine similarity of ``drug_id`` to every drug sharing a feature
+        with it"""
+        with self._lock:
+            tokens = self._features.get(drug_id)
+            if not tokens:
+                return {}
+            total = len(self._features)
+            weights: Dict[str, float] = {}
+
+            def norm(tokens: Set[str]) -> float:
+                squared = 0.0
+                for token in tokens:
+                    if token not in weights:
+                        weights[token] = self._weight(token, total)
+                    squared += weights[token]
+                return math.sqrt(squared)
+
+            own_norm = norm(tokens)
+            if not own_norm:
+                return {}
+            cutoff = max(MIN_COMMON_POSTING, total * COMMON_FRACTION)
+            common = [token for token in tokens if weights[token] and len(self._postings[token]) > cutoff]
+            dots: Dict[str, float] = {}
+            for token in tokens:
+                if not weights[token] or token in common:
+                    continue
+                for other in self._postings[token]:
+                    if other != drug_id:
+                        dots[other] = dots.get(other, 0.0) + weights[token]
+            # Common features add to the drugs found above
+            for other in dots:
+                other_features = self._features[other]
+                dots[other] += sum(weights[token] for token in common if token in other_features)
+            return {other: dot / (own_norm * norm(self._features[other])) for other, dot in dots.items()}
+
+    def neighbours(self, drug_id: str, k: int) -> List[Tuple[str, float]]:
+        """The ``k`` most similar drugs as ``(id, score)``, best first"""
+        scores = self.scores(drug_id)
+        return heapq.nsmallest(k, ((other, score) for other, score in scores.items()),
+                               key=lambda match: (-match[1], match[0]))
+
+def _chunks(values: Sequence, size: int = BATCH_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+class SimilarDrugs:
+    """Keeps ``drug_similar`` in step with the catalogue.
+
+    Writes mark drugs dirty; a background thread folds each burst of
+    changes into one refresh.
+    """
+
+    def __init__(self):
+        self.index = SimilarityIndex()
+        self.top_k = 10
+        self.refresh_delay = 0.25
+        self.refreshes = 0
+        self._loaded = False
+        self._dirty: Set[str] = set()
+        self._session_factory = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.top_k > 0
+
+    def configure(self, app_settings: Settings):
+        self.stop()
+        self.top_k = app_settings.similar_top_k
+        self.refresh_delay = app_settings.similar_refresh_delay
+
+    def load(self, db: Session):
+        """Build the in-memory index from the database"""
+        if not self.enabled:
+            return
+        self.index.build(db.query(
+            DrugModel.id, DrugModel.category, DrugModel.active_ingredients,
+            DrugModel.side_effects, DrugModel.contraindications,
+        ))
+        self._loaded = True
+        logger.info("Similarity index built with %d drugs", len(self.index))
+
+    def start(self, session_factory):
+        if not self.enabled:
+            return
+        self._session_factory = session_factory
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="similar-drugs", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def changed(self, db_drug: DrugModel):
+        """Called after a create or update commits"""
+        if not self._loaded:
+            return
+        self.index.add(db_drug.id, features(
+            db_drug.category, db_drug.active_ingredients, db_drug.side_effects, db_drug.contraindications
+        ))
+        self._mark(db_drug.id)
+
+    def removed(self, drug_id: str):
+        """Called after a delete commits"""
+        if not self._loaded:
+            return
+        self.index.remove(drug_id)
+        self._mark(drug_id)
+
+    def _mark(self, drug_id: str):
+        with self._lock:
+            self._dirty.add(drug_id)
+        self._wake.set()
+
+    def rebuild(self, db: Session, progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """Reload the index and recompute every drug's neighbours, one
+        batch per transaction; returns the number of drugs"""
+        self.load(db)
+        db.rollback()
+        ids = self.index.ids()
+        done = 0
+        for chunk in _chunks(ids):
+            self._write(db, chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, len(ids))
+        # Rows of drugs deleted before the index was reloaded
+        db.query(DrugSimilarModel).filter(
+            ~DrugSimilarModel.drug_id.in_(db.query(DrugModel.id))
+        ).delete(synchronize_session=False)
+        db.commit()
+        return len(ids)
+
+    def refresh(self) -> int:
+        """Recompute the neighbours of drugs changed since the last refresh
+        and of the drugs whose lists they affect; returns how many lists
+        were rewritten"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        db = self._session_factory()
+        try:
+            stale = set(dirty) | self._affected(db, sorted(dirty))
+            db.rollback()
+            for chunk in _chunks(sorted(stale)):
+                self._write(db, chunk)
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        finally:
+            db.close()
+        self.refreshes += 1
+        return len(stale)
+
+    def _affected(self, db: Session, dirty: List[str]) -> Set[str]:
+        affected: Set[str] = set()
+        # Lists holding a changed drug, which may reorder or drop it
+        for chunk in _chunks(dirty):
+            affected.update(drug_id for drug_id, in db.query(DrugSimilarModel.drug_id).filter(
+                DrugSimilarModel.similar_id.in_(chunk)
+            ))
+        # Lists a changed drug may now enter: it beats their k-th entry
+        best: Dict[str, float] = {}
+        for drug_id in dirty:
+            for other, score in self.index.scores(drug_id).items():
+                if score > best.get(other, 0.0):
+                    best[other] = score
+        candidates = sorted(set(best) - affected - set(dirty))
+        for chunk in _chunks(candidates):
+            lists = dict.fromkeys(chunk, (0, 0.0))
+            lists.update((drug_id, (count, lowest)) for drug_id, count, lowest in db.query(
+                DrugSimilarModel.drug_id, func.count(), func.min(DrugSimilarModel.score)
+            ).filter(DrugSimilarModel.drug_id.in_(chunk)).group_by(DrugSimilarModel.drug_id))
+            affected.update(
+                drug_id for drug_id, (count, lowest) in lists.items()
+                if count < self.top_k or best[drug_id] > lowest
+            )
+        return affected
+
+    def _write(self, db: Session, drug_ids: Sequence[str]):
+        rows = []
+        for drug_id in drug_ids:
+            rows.extend(
+                {"drug_id": drug_id, "similar_id": other, "score": round(score, 6), "rank": rank}
+                for rank, (other, score) in enumerate(self.index.neighbours(drug_id, self.top_k), 1)
+            )
+        db.query(DrugSimilarModel).filter(
+            DrugSimilarModel.drug_id.in_(drug_ids)
+        ).delete(synchronize_session=False)
+        db.bulk_insert_mappings(DrugSimilarModel, rows)
+        db.commit()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            # Let a burst of writes settle into one refresh
+            self._stopping.wait(self.refresh_delay)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Similar drugs refresh failed")
+
+def is_empty(db: Session) -> bool:
+    return db.query(DrugSimilarModel.drug_id).first() is None
+
+similar_drugs = SimilarDrugs()
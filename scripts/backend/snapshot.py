@@ -0,0 +1,568 @@
+"""
+Immutable, versioned catalogue snapshot for read-mostly serving.
+
+With ``snapshot_mode`` set, ``GET /drugs``, ``GET /drugs/{id}`` and
+``GET /categories`` are answered from an in-process snapshot of the
+``drugs`` table instead of the database:
+
+- Every drug is rendered to its JSON response bytes once, at build time,
+  and stored back to back in one buffer with an offsets array. Serving a
+  page is slicing and joining bytes. In ``mmap`` mode the buffer is a file
+  in ``snapshot_directory`` named after the snapshot version; workers at
+  the same version map the same file, so the page cache holds one copy.
+- Filters run over columnar arrays: names, categories and ingredient lists
+  are stored as codes into tables of interned distinct values, so e.g. an
+  ingredient filter is matched once per distinct ingredient list, not per
+  drug.
+
+A snapshot's version is the latest change log sequence it includes. A
+background thread refreshes it when this process writes (reads fall back to
+the database until the new snapshot is swapped in, so a client always
+reads its own writes) and when the change log moves past it, which picks
+up other workers' writes within ``snapshot_refresh_interval`` seconds.
+Refreshes wait ``snapshot_rebuild_delay`` seconds after a write so a burst
+of writes costs one refresh.
+
+A refresh applies the change log delta: only the drugs changed since the
+snapshot's version are read and rendered, every other drug's columns and
+document are reused, and the new documents live in memory on top of the
+shared file. Once deltas add up to a sizeable part of the catalogue, the
+next refresh builds a fresh snapshot instead.
+The swap is a single reference assignment; readers holding the old
+snapshot finish with it undisturbed.
+
+Snapshot files carry a digest of every row they were rendered from, so a
+worker only maps an existing file when the table still holds exactly that
+content, not merely the same change log version.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import threading
+from array import array
+from datetime import date, datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import Settings, settings
+from models import Drug as DrugModel, DrugChange as DrugChangeModel
+from schemas import Drug
+from trigram import trigram_index
+
+logger = logging.getLogger(__name__)
+
+# Trailer of a snapshot file: content digest, drug count, then this marker
+_MAGIC = b"DRUGSNAP2"
+_DIGEST_SIZE = 16
+_EPOCH = datetime(1970, 1, 1)
+
+# A delta may change at most this share of the drugs (and the documents
+# rendered by deltas may reach it) before a full build is cheaper
+_MAX_DELTA_FRACTION = 0.1
+_MIN_DELTA_LIMIT = 1000
+
+# Changed drugs read per query
+_DELTA_CHUNK = 500
+
+def render_json(content) -> bytes:
+    """The same bytes JSONResponse renders for ``content``"""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+def like_matcher(value: str) -> Callable[[str], bool]:
+    """Predicate over lower-cased text matching SQL ``ILIKE '%value%'``,
+    including ``%`` and ``_`` wildcards inside ``value``"""
+    if "%" not in value and "_" not in value:
+        needle = value.lower()
+        return lambda text: needle in text
+    pattern = "".join(".*" if char == "%" else "." if char == "_" else re.escape(char) for char in value)
+    regex = re.compile(f".*{pattern}.*", re.IGNORECASE | re.DOTALL)
+    return lambda text: regex.fullmatch(text) is not None
+
+def _timestamp(value: Optional[datetime]) -> float:
+    return (value - _EPOCH).total_seconds() if value is not None else math.nan
+
+def _fingerprint(row: DrugModel) -> bytes:
+    """Every column of a drug row, for the snapshot file digest"""
+    return json.dumps(
+        [getattr(row, column.key) for column in DrugModel.__table__.columns], default=str
+    ).encode("utf-8")
+
+class _Interner:
+    """Assigns consecutive codes to distinct values"""
+
+    def __init__(self, values: Sequence[str] = ()):
+        self.values: List[str] = list(values)
+        self.codes: Dict[str, int] = {}
+        for code, value in enumerate(self.values):
+            self.codes.setdefault(value, code)
+
+    def __call__(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class _Columns:
+    """Collects the per-drug columns of a snapshot in response order"""
+
+    def __init__(self, categories: Sequence[str] = (), ingredient_texts: Sequence[str] = ()):
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.categories = _Interner(categories)
+        # Keyed by the lower-cased JSON text, the only form filters use
+        self.ingredients = _Interner(ingredient_texts)
+        self.forms: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self.category_codes = array("I")
+        self.ingredient_codes = array("I")
+        self.dosage_forms: List[Tuple[str, ...]] = []
+        self.created_at = array("d")
+        self.versions = array("Q")
+        self.slots = array("Q")
+
+    def add_row(self, row: DrugModel, slot: int):
+        self.ids.append(row.id)
+        self.names.append(row.name.lower())
+        self.category_codes.append(self.categories(row.category))
+        self.ingredient_codes.append(self.ingredients(json.dumps(row.active_ingredients or []).lower()))
+        row_forms = tuple(row.dosage_forms or [])
+        self.dosage_forms.append(self.forms.setdefault(row_forms, row_forms))
+        self.created_at.append(_timestamp(row.created_at))
+        self.versions.append(row.version)
+        self.slots.append(slot)
+
+    def copy(self, snapshot: "CatalogueSnapshot", position: int):
+        """Reuse a drug unchanged from ``snapshot``; codes carry over because
+        the interners were seeded with its values"""
+        self.ids.append(snapshot._ids[position])
+        self.names.append(snapshot._names[position])
+        self.category_codes.append(snapshot._category_codes[position])
+        self.ingredient_codes.append(snapshot._ingredient_codes[position])
+        self.dosage_forms.append(snapshot._dosage_forms[position])
+        self.created_at.append(snapshot._created_at[position])
+        self.versions.append(snapshot._versions[position])
+        self.slots.append(snapshot._slots[position])
+
+    def snapshot(self, version: int, buffer, offsets: array, extra: List[bytes],
+                 path: Optional[str], file_version: Optional[int]) -> "CatalogueSnapshot":
+        return CatalogueSnapshot(
+            version, self.ids, self.names, self.category_codes, self.categories.values,
+            self.ingredient_codes, self.ingredients.values, self.dosage_forms, self.created_at,
+            self.versions, buffer, offsets, path, slots=self.slots, extra=extra, file_version=file_version,
+        )
+
+class CatalogueSnapshot:
+    """Read-only view of every drug at one change log version.
+
+    Documents live in ``buffer`` (slot ``i`` between ``offsets[i]`` and
+    ``offsets[i + 1]``), or past its last slot in ``extra`` for drugs
+    rendered by deltas; ``slots`` maps each position to its document.
+    """
+
+    def __init__(self, version: int, ids: List[str], names: List[str], category_codes: array,
+                 categories: List[str], ingredient_codes: array, ingredient_texts: List[str],
+                 dosage_forms: List[Tuple[str, ...]], created_at: array, versions: array,
+                 buffer, offsets: array, path: Optional[str] = None, slots: Optional[array] = None,
+                 extra: Optional[List[bytes]] = None, file_version: Optional[int] = None):
+        self.version = version
+        self.path = path
+        # Version of the drugs rendered into ``path``
+        self.file_version = version if file_version is None else file_version
+        self._ids = ids
+        self._positions = {drug_id: position for position, drug_id in enumerate(ids)}
+        self._names = names
+        self._category_codes = category_codes
+        self._categories = categories
+        self._ingredient_codes = ingredient_codes
+        self._ingredient_texts = ingredient_texts
+        self._dosage_forms = dosage_forms
+        self._created_at = created_at
+        self._versions = versions
+        self._buffer = buffer
+        self._offsets = offsets
+        self._base_count = len(offsets) - 1
+        self._slots = slots if slots is not None else array("Q", range(len(ids)))
+        self._extra = extra or []
+        # Categories of drugs a delta removed stay interned; list only those in use
+        self._category_list = sorted(categories[code] for code in set(category_codes))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def size(self) -> int:
+        """Bytes of rendered documents"""
+        return (self._offsets[-1] if len(self._offsets) else 0) + sum(len(document) for document in self._extra)
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self._category_list)
+
+    @classmethod
+    def build(cls, db: Session, directory: Optional[str] = None) -> "CatalogueSnapshot":
+        """Read every drug in one transaction; with ``directory``, keep the
+        rendered documents in a shared, memory-mapped file"""
+        version = db.query(func.max(DrugChangeModel.seq)).scalar() or 0
+        # Another worker may already have rendered this version; it is only
+        # reused if it was rendered from exactly the rows read here
+        path = os.path.join(directory, f"catalogue-{version}.snap") if directory else None
+        existing = _map_file(path) if path and os.path.exists(path) else None
+        snapshot = cls._read(db, version, path, existing)
+        if snapshot is None:
+            logger.warning("Snapshot file %s doesn't match the drugs table; rendering it again", path)
+            snapshot = cls._read(db, version, path, None)
+        return snapshot
+
+    @classmethod
+    def _read(cls, db: Session, version: int, path: Optional[str],
+              existing: Optional[Tuple[object, array, bytes]]) -> Optional["CatalogueSnapshot"]:
+        """One pass over the drugs, rendering them unless ``existing`` holds
+        their documents; None if it turns out not to"""
+        rows = db.query(DrugModel).order_by(DrugModel.name, DrugModel.id).yield_per(1000)
+        digest = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+        buffer = bytearray()
+        offsets = array("Q", [0])
+
+        columns = _Columns()
+        for position, row in enumerate(rows):
+            columns.add_row(row, position)
+            digest.update(_fingerprint(row))
+            if existing is None:
+                buffer += render_json(jsonable_encoder(Drug.from_orm(row)))
+                offsets.append(len(buffer))
+            # Only the columns above are kept
+            db.expunge(row)
+
+        if existing is not None:
+            buffer, offsets, file_digest = existing
+            if file_digest != digest.digest() or len(offsets) != len(columns.ids) + 1:
+                return None
+        elif path:
+            _write_file(path, buffer, offsets, digest.digest())
+            buffer, offsets, _ = _map_file(path)
+        else:
+            buffer = bytes(buffer)
+        return columns.snapshot(version, buffer, offsets, [], path, version)
+
+    def can_apply(self, changes: int) -> bool:
+        """Whether a delta of ``changes`` drugs beats a full build"""
+        limit = max(_MIN_DELTA_LIMIT, int(len(self._ids) * _MAX_DELTA_FRACTION))
+        return changes <= limit and len(self._extra) + changes <= limit
+
+    def apply(self, db: Session, version: int, drug_ids: Sequence[str]) -> "CatalogueSnapshot":
+        """A new snapshot at ``version`` in which ``drug_ids`` are read again
+        (or dropped, if deleted). Other drugs keep their columns and rendered
+        documents; the order comes from the database, so it matches its
+        collation."""
+        changed: Dict[str, DrugModel] = {}
+        for start in range(0, len(drug_ids), _DELTA_CHUNK):
+            for row in db.query(DrugModel).filter(DrugModel.id.in_(drug_ids[start:start + _DELTA_CHUNK])):
+                changed[row.id] = row
+                db.expunge(row)
+
+        columns = _Columns(self._categories, self._ingredient_texts)
+        extra = list(self._extra)
+        order = db.execute(select(DrugModel.id).order_by(DrugModel.name, DrugModel.id)).scalars()
+        for drug_id in order:
+            row = changed.get(drug_id)
+            if row is not None:
+                columns.add_row(row, self._base_count + len(extra))
+                extra.append(render_json(jsonable_encoder(Drug.from_orm(row))))
+                continue
+            position = self._positions.get(drug_id)
+            # A drug missing from both was created after the change log was
+            # read; the next refresh adds it
+            if position is not None:
+                columns.copy(self, position)
+        return columns.snapshot(version, self._buffer, self._offsets, extra, self.path, self.file_version)
+
+    def _document(self, position: int) -> bytes:
+        slot = self._slots[position]
+        if slot < self._base_count:
+            return self._buffer[self._offsets[slot]:self._offsets[slot + 1]]
+        return self._extra[slot - self._base_count]
+
+    def drug_version(self, drug_id: str) -> Optional[int]:
+        position = self._positions.get(drug_id)
+        return self._versions[position] if position is not None else None
+
+    def render_drug(self, drug_id: str, fields: Optional[Tuple[str, ...]] = None) -> Optional[bytes]:
+        """Response body for one drug, or None if it doesn't exist"""
+        position = self._positions.get(drug_id)
+        if position is None:
+            return None
+        document = self._document(position)
+        if fields is None:
+            return document
+        return render_json(_project(document, fields))
+
+    def matches(
+        self,
+        name: Optional[str] = None,
+        category: Optional[str] = None,
+        ingredient: Optional[str] = None,
+        created_after: Optional[date] = None,
+        created_before: Optional[date] = None,
+        fuzzy: bool = False,
+        dosage_form: Optional[str] = None,
+    ) -> Iterable[int]:
+        """Positions of the matching drugs, in response order: by name, or
+        by similarity for fuzzy name matches (same rules as crud.get_drugs)"""
+        if name and fuzzy:
+            ranked = trigram_index.search(name, settings.fuzzy_similarity_threshold, settings.fuzzy_max_candidates)
+            candidates: Iterable[int] = [
+                self._positions[drug_id] for drug_id, _ in ranked if drug_id in self._positions
+            ]
+        else:
+            candidates = range(len(self._ids))
+
+        checks = []
+        if name and not fuzzy:
+            name_matches, names = like_matcher(name), self._names
+            checks.append(lambda position: name_matches(names[position]))
+        if category:
+            allowed = {code for code, value in enumerate(self._categories) if value == category}
+            codes = self._category_codes
+            checks.append(lambda position: codes[position] in allowed)
+        if ingredient:
+            # The database matches against the JSON text of the list
+            ingredient_matches = like_matcher(ingredient)
+            allowed_ingredients = {
+                code for code, text in enumerate(self._ingredient_texts) if ingredient_matches(text)
+            }
+            ingredient_codes = self._ingredient_codes
+            checks.append(lambda position: ingredient_codes[position] in allowed_ingredients)
+        if dosage_form:
+            dosage_forms = self._dosage_forms
+            checks.append(lambda position: dosage_form in dosage_forms[position])
+        if created_after:
+            after, created = _timestamp(datetime.combine(created_after, datetime.min.time())), self._created_at
+            checks.append(lambda position: created[position] >= after)
+        if created_before:
+            before, created = _timestamp(datetime.combine(created_before, datetime.min.time())), self._created_at
+            checks.append(lambda position: created[position] <= before)
+
+        if not checks:
+            return candidates
+        return (position for position in candidates if all(check(position) for check in checks))
+
+    def count(self, positions: Iterable[int]) -> int:
+        if isinstance(positions, (range, list)):
+            return len(positions)
+        return sum(1 for _ in positions)
+
+    def render_drugs(self, positions: Iterable[int], skip: int, limit: int,
+                     fields: Optional[Tuple[str, ...]] = None) -> bytes:
+        """Response body for one page of ``positions``"""
+        if fields is not None:
+            return render_json(self.records(positions, skip, limit, fields))
+        return b"[" + b",".join(self._document(position) for position in _page(positions, skip, limit)) + b"]"
+
+    def records(self, positions: Iterable[int], skip: int, limit: int,
+                fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+        """One page of ``positions`` as JSON-ready dicts"""
+        page = _page(positions, skip, limit)
+        if fields is None:
+            return [json.loads(self._document(position)) for position in page]
+        return [_project(self._document(position), fields) for position in page]
+
+def _page(positions: Iterable[int], skip: int, limit: int) -> Sequence[int]:
+    if isinstance(positions, (range, list)):
+        return positions[skip:skip + limit]
+    return list(islice(positions, skip, skip + limit))
+
+def _project(document: bytes, fields: Tuple[str, ...]) -> dict:
+    drug = json.loads(document)
+    return {field: drug[field] for field in fields}
+
+def _write_file(path: str, buffer: bytearray, offsets: array, digest: bytes):
+    """Documents, then offsets, then the digest, count and marker; written
+    under a temporary name and renamed so other workers never map a partial
+    file"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as snapshot_file:
+        snapshot_file.write(buffer)
+        snapshot_file.write(offsets.tobytes())
+        snapshot_file.write(digest)
+        snapshot_file.write(array("Q", [len(offsets) - 1]).tobytes())
+        snapshot_file.write(_MAGIC)
+    os.replace(temporary, path)
+
+def _map_file(path: str) -> Optional[Tuple[mmap.mmap, array, bytes]]:
+    with open(path, "rb") as snapshot_file:
+        mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    trailer = len(mapped) - len(_MAGIC)
+    if trailer < 8 + _DIGEST_SIZE or mapped[trailer:] != _MAGIC:
+        return None
+    count = array("Q", mapped[trailer - 8:trailer])[0]
+    digest_start = trailer - 8 - _DIGEST_SIZE
+    start = digest_start - (count + 1) * 8
+    if start < 0:
+        return None
+    offsets = array("Q", mapped[start:digest_start])
+    return mapped, offsets, mapped[digest_start:trailer - 8]
+
+class SnapshotManager:
+    """Holds the current snapshot and refreshes it in the background"""
+
+    def __init__(self):
+        self.mode = "off"
+        self.directory: Optional[str] = None
+        self.refresh_interval = 5.0
+        self.rebuild_delay = 0.25
+        self.builds = 0
+        self.deltas = 0
+        self._snapshot: Optional[CatalogueSnapshot] = None
+        self._generation = 0
+        self._built_generation = 0
+        self._session_factory = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def configure(self, app_settings: Settings):
+        self.stop()
+        self._snapshot = None
+        self.mode = app_settings.snapshot_mode
+        self.directory = app_settings.snapshot_directory if self.mode == "mmap" else None
+        self.refresh_interval = app_settings.snapshot_refresh_interval
+        self.rebuild_delay = app_settings.snapshot_rebuild_delay
+
+    def start(self, session_factory):
+        """Build the first snapshot now, then keep it fresh in the background"""
+        if not self.enabled:
+            return
+        self._session_factory = session_factory
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.refresh()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="catalogue-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def get(self) -> Optional[CatalogueSnapshot]:
+        """The current snapshot, or None while it is missing or behind a
+        write made by this process"""
+        snapshot = self._snapshot
+        if snapshot is None or self._built_generation != self._generation:
+            return None
+        return snapshot
+
+    def invalidate(self):
+        """Called after a local write commits"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+        self._wake.set()
+
+    def refresh(self) -> bool:
+        """Catch up if a local write or the change log moved past the
+        current snapshot, applying the delta when it is small; returns
+        whether a new snapshot was swapped in"""
+        generation = self._generation
+        db = self._session_factory()
+        try:
+            current = self._snapshot
+            snapshot = None
+            if current is not None:
+                latest = db.query(func.max(DrugChangeModel.seq)).scalar() or 0
+                if latest <= current.version:
+                    # Local writes are logged, so this one is already included
+                    with self._lock:
+                        self._built_generation = generation
+                    return False
+                drug_ids = [
+                    drug_id for (drug_id,) in db.query(DrugChangeModel.drug_id)
+                    .filter(DrugChangeModel.seq > current.version, DrugChangeModel.seq <= latest)
+                    .distinct()
+                ]
+                if current.can_apply(len(drug_ids)):
+                    # Drugs changed after ``latest`` are read too; the next
+                    # refresh reads them again
+                    snapshot = current.apply(db, latest, drug_ids)
+                else:
+                    # End this read so the build sees everything up to now
+                    db.rollback()
+            if snapshot is None:
+                snapshot = CatalogueSnapshot.build(db, self.directory)
+        finally:
+            db.close()
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._built_generation = generation
+        if snapshot.file_version == snapshot.version:
+            self.builds += 1
+            logger.info(
+                "Catalogue snapshot %d built with %d drugs (%d bytes)", snapshot.version, len(snapshot), snapshot.size
+            )
+        else:
+            self.deltas += 1
+            logger.debug("Catalogue snapshot %d applied on top of %d", snapshot.version, snapshot.file_version)
+        self._remove_old_files(snapshot)
+        return True
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "mode": self.mode,
+            "version": snapshot.version if snapshot else None,
+            "drugs": len(snapshot) if snapshot else 0,
+            "bytes": snapshot.size if snapshot else 0,
+            "stale": self.enabled and self.get() is None,
+            "builds": self.builds,
+            "deltas": self.deltas,
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self._wake.wait(self.refresh_interval):
+                # Let a burst of writes settle into one refresh
+                self._stopping.wait(self.rebuild_delay)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Catalogue snapshot refresh failed")
+
+    def _remove_old_files(self, current: CatalogueSnapshot):
+        # Unlinking a file other workers still map is safe; their mapping
+        # stays valid until they swap
+        if not current.path:
+            return
+        for path in glob.glob(os.path.join(self.directory, "catalogue-*.snap")):
+            version = os.path.basename(path)[len("catalogue-"):-len(".snap")]
+            if version.isdigit() and int(version) < current.file_version:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+catalogue = SnapshotManager()
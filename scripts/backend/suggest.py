@@ -0,0 +1,185 @@
+"""
+In-memory prefix index backing the autocomplete endpoint.
+
+Drug names and active ingredients are kept in a sorted array of
+``(term, drug_id)`` pairs so a prefix lookup is two bisections plus a slice.
+Fuzzy lookups draw candidates from postings of the terms' leading-padded
+character bigrams: a term prefix within ``k`` edits of the query keeps all
+but ``2k`` of the query's bigrams, so only entries in the rarest postings
+need an edit distance check. Bigrams rather than trigrams keep that bound
+useful for the short queries autocomplete sees (each edit breaks at most
+two bigrams but three trigrams).
+The index is built once at startup and kept current by the write paths.
+"""
+
+from bisect import bisect_left, insort
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+def normalize(text: str) -> str:
+    """Normalize a term for case-insensitive matching"""
+    return " ".join(text.casefold().split())
+
+def index_terms(name: str, ingredients: Sequence[str]) -> Tuple[str, ...]:
+    """Every searchable term for a drug.
+
+    Besides the full name and each ingredient, the text starting at every
+    later word is indexed too, so "hydro" finds "Metformin Hydrochloride".
+    """
+    terms = set()
+    for text in [name, *(ingredients or [])]:
+        words = normalize(text).split(" ")
+        for start in range(len(words)):
+            term = " ".join(words[start:])
+            if term:
+                terms.add(term)
+    return tuple(sorted(terms))
+
+def bigrams(text: str) -> Set[str]:
+    """Character bigrams of ``text`` padded with one leading space; a
+    prefix's bigrams are a subset of the whole term's"""
+    padded = f" {text}"
+    return {padded[i:i + 2] for i in range(len(text))}
+
+def prefix_distance(query: str, term: str, max_distance: int) -> Optional[int]:
+    """Edit distance between ``query`` and the closest prefix of ``term``.
+
+    Returns None as soon as every alignment exceeds ``max_distance``.
+    """
+    term = term[:len(query) + max_distance]
+    previous = list(range(len(term) + 1))
+    for i, query_char in enumerate(query, start=1):
+        current = [i]
+        for j, term_char in enumerate(term, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (query_char != term_char),
+            ))
+        if min(current) > max_distance:
+            return None
+        previous = current
+    distance = min(previous)
+    return distance if distance <= max_distance else None
+
+class SuggestIndex:
+    """Sorted-array prefix index over drug names and ingredients"""
+
+    def __init__(self):
+        self._entries: List[Tuple[str, str]] = []
+        self._names: Dict[str, str] = {}
+        self._terms: Dict[str, Tuple[str, ...]] = {}
+        self._postings: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def build(self, drugs: Iterable[Tuple[str, str, Sequence[str]]]):
+        """Replace the index contents with ``(id, name, ingredients)`` rows"""
+        entries = []
+        names = {}
+        terms = {}
+        for drug_id, name, ingredients in drugs:
+            names[drug_id] = name
+            terms[drug_id] = index_terms(name, ingredients)
+            entries.extend((term, drug_id) for term in terms[drug_id])
+        entries.sort()
+        postings: Dict[str, Set[Tuple[str, str]]] = {}
+        for entry in entries:
+            for gram in bigrams(entry[0]):
+                postings.setdefault(gram, set()).add(entry)
+        with self._lock:
+            self._entries = entries
+            self._names = names
+            self._terms = terms
+            self._postings = postings
+
+    def add(self, drug_id: str, name: str, ingredients: Sequence[str]):
+        """Insert or replace a single drug"""
+        with self._lock:
+            self._discard(drug_id)
+            self._names[drug_id] = name
+            self._terms[drug_id] = index_terms(name, ingredients)
+            for term in self._terms[drug_id]:
+                insort(self._entries, (term, drug_id))
+                for gram in bigrams(term):
+                    self._postings.setdefault(gram, set()).add((term, drug_id))
+
+    def remove(self, drug_id: str):
+        """Drop a drug from the index if present"""
+        with self._lock:
+            self._discard(drug_id)
+
+    def _discard(self, drug_id: str):
+        for term in self._terms.pop(drug_id, ()):
+            position = bisect_left(self._entries, (term, drug_id))
+            if position < len(self._entries) and self._entries[position] == (term, drug_id):
+                del self._entries[position]
+            for gram in bigrams(term):
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard((term, drug_id))
+                    if not posting:
+                        del self._postings[gram]
+        self._names.pop(drug_id, None)
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect_left(self._entries, (prefix,))
+        end = bisect_left(self._entries, (prefix + "\uffff",))
+        return start, end
+
+    def _fuzzy_candidates(self, prefix: str, max_distance: int) -> Iterable[Tuple[str, str]]:
+        """Entries that may hold a prefix within ``max_distance`` edits of
+        ``prefix`` and share its first character"""
+        query_grams = bigrams(prefix)
+        required = len(query_grams) - 2 * max_distance
+        if required < 1:
+            # Too short for the bigram bound to rule anything out
+            start, end = self._prefix_range(prefix[0])
+            return self._entries[start:end]
+        postings = sorted((self._postings.get(gram, set()) for gram in query_grams), key=len)
+        candidates: Set[Tuple[str, str]] = set()
+        for posting in postings[:len(postings) - required + 1]:
+            candidates.update(posting)
+        return [entry for entry in candidates if entry[0][0] == prefix[0]]
+
+    def suggest(self, query: str, limit: int = 10, fuzzy: bool = False) -> List[dict]:
+        """Return up to ``limit`` ``{"id", "name"}`` pairs matching ``query``.
+
+        Exact prefix matches come first. With ``fuzzy`` the remaining slots
+        are filled with terms sharing the query's first character within a
+        small edit distance of it.
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        results: Dict[str, str] = {}
+        with self._lock:
+            start, end = self._prefix_range(prefix)
+            for position in range(start, end):
+                drug_id = self._entries[position][1]
+                if drug_id not in results:
+                    results[drug_id] = self._names[drug_id]
+                    if len(results) >= limit:
+                        break
+
+            if fuzzy and len(results) < limit:
+                max_distance = 1 if len(prefix) <= 4 else 2
+                candidates = []
+                for term, drug_id in self._fuzzy_candidates(prefix, max_distance):
+                    if drug_id in results:
+                        continue
+                    distance = prefix_distance(prefix, term, max_distance)
+                    if distance is not None:
+                        candidates.append((distance, term, drug_id))
+                for _, _, drug_id in sorted(candidates):
+                    if drug_id not in results:
+                        results[drug_id] = self._names[drug_id]
+                        if len(results) >= limit:
+                            break
+
+        return [{"id": drug_id, "name": name} for drug_id, name in results.items()]
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,97 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from admission import AdmissionController, AdmissionMiddleware, MemoryRateLimiter
+from config import Settings
+
+def build_app(**overrides):
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, app_settings=Settings(**overrides))
+
+    @app.get("/drugs")
+    def list_drugs():
+        return []
+
+    @app.get("/categories")
+    def list_categories():
+        return []
+
+    @app.get("/health")
+    def health():
+        return {"status": "healthy"}
+
+    return app
+
+def test_rate_limit_per_client():
+    client = TestClient(build_app(
+        rate_limit_enabled=True, rate_limit_per_second=0.5, rate_limit_burst=6, rate_limit_expensive_cost=5
+    ))
+
+    assert client.get("/categories").status_code == 200
+    # An expensive request takes 5 of the remaining 5 tokens...
+    assert client.get("/drugs").status_code == 200
+    # ...leaving none
+    response = client.get("/categories")
+    assert response.status_code == 429
+    assert response.json()["error"]["code"] == "rate_limited"
+    assert int(response.headers["Retry-After"]) >= 1
+
+    # Other API keys have their own bucket, and probes are never limited
+    assert client.get("/categories", headers={"X-API-Key": "other"}).status_code == 200
+    assert client.get("/health").status_code == 200
+
+def test_memory_rate_limiter_refills():
+    limiter = MemoryRateLimiter(rate=1000, burst=1)
+
+    async def take_twice():
+        first = await limiter.acquire("client")
+        second = await limiter.acquire("client")
+        await asyncio.sleep(0.01)
+        third = await limiter.acquire("client")
+        return first, second, third
+
+    first, second, third = asyncio.run(take_twice())
+    assert first == 0
+    assert 0 < second <= 0.001
+    assert third == 0
+
+def test_admission_controller_sheds_when_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=0.05)
+        assert await controller.acquire()
+        # One request may queue, but it times out while the slot stays taken
+        assert not await controller.acquire()
+
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        # The queue is full: shed immediately
+        assert not await controller.acquire()
+        controller.release()
+        assert await waiter
+        assert controller.inflight == 1
+        controller.release()
+        assert controller.inflight == 0
+
+    asyncio.run(scenario())
+
+def test_admission_control_returns_503():
+    app = build_app(admission_control=True, admission_max_inflight_expensive=1, admission_max_queue=0)
+    client = TestClient(app)
+
+    async def occupy_slot():
+        middleware = app.middleware_stack
+        while not isinstance(middleware, AdmissionMiddleware):
+            middleware = middleware.app
+        await middleware.controllers[True].acquire()
+
+    client.get("/categories")
+    asyncio.run(occupy_slot())
+
+    response = client.get("/drugs")
+    assert response.status_code == 503
+    assert response.json()["error"]["code"] == "overloaded"
+    assert response.headers["Retry-After"] == "1"
+    # Cheap endpoints have their own budget
+    assert client.get("/categories").status_code == 200
@@ -3,8 +3,13 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
 from app import app, get_db
+from database import get_read_db
 from models import Drug as DrugModel
 from database import Base
+from client import WIRE_FORMATS, AsyncDrugClient, DrugAPIError, DrugClient
+import asyncio
+import httpx
+import json
 import tempfile
 import os
 
@@ -23,6 +28,7 @@ def override_get_db():
         db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 client = TestClient(app)
 
@@ -124,6 +130,563 @@ def test_get_categories():
     data = response.json()
     assert isinstance(data, list)
 
+def test_get_drugs_with_fields():
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-fields",
+            "name": "Fields Drug",
+            "category": "Test Category",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Test Form"]
+        }
+    )
+
+    response = client.get("/drugs?fields=name,category")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) > 0
+    for drug in data:
+        assert set(drug) == {"id", "name", "category"}
+
+    response = client.get("/drugs/test-drug-fields?fields=active_ingredients")
+    assert response.status_code == 200
+    assert response.json() == {"id": "test-drug-fields", "active_ingredients": ["Test Ingredient"]}
+
+def test_get_drugs_with_unknown_field():
+    response = client.get("/drugs?fields=name,secret")
+    assert response.status_code == 400
+
+def test_suggest_drugs():
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-suggest",
+            "name": "Amoxicillin Suggest",
+            "category": "Antibiotics",
+            "description": "Test Description",
+            "active_ingredients": ["Amoxicillin Trihydrate"],
+            "dosage_forms": ["Capsule"]
+        }
+    )
+
+    response = client.get("/drugs/suggest?q=amox")
+    assert response.status_code == 200
+    assert {"id": "test-drug-suggest", "name": "Amoxicillin Suggest"} in response.json()
+
+    # Matches the second word of an ingredient
+    response = client.get("/drugs/suggest?q=trihydr")
+    assert "test-drug-suggest" in [s["id"] for s in response.json()]
+
+    # Misspelled names only match when fuzzy matching is requested
+    response = client.get("/drugs/suggest?q=amoxicilin")
+    assert response.json() == []
+    response = client.get("/drugs/suggest?q=amoxicilin&fuzzy=true")
+    assert "test-drug-suggest" in [s["id"] for s in response.json()]
+
+    client.delete("/drugs/test-drug-suggest")
+    response = client.get("/drugs/suggest?q=amox")
+    assert "test-drug-suggest" not in [s["id"] for s in response.json()]
+
+def test_fuzzy_suggest_checks_only_bigram_candidates(monkeypatch):
+    import suggest
+
+    words = ["amoxicillin", "ampicillin", "ibuprofen", "metformin", "atorvastatin", "aspirin", "acyclovir"]
+    drugs = [
+        (f"drug-{i}", f"{words[i % len(words)]} {i}", [f"{words[(i * 3) % len(words)]} hydrochloride"])
+        for i in range(300)
+    ]
+    index = suggest.SuggestIndex()
+    index.build(drugs)
+    index.add("drug-new", "Amoxycillin Extra", ["Clavulanate"])
+    index.remove("drug-5")
+
+    def scan(query, limit):
+        # Every term sharing the first character, as before the postings
+        prefix = suggest.normalize(query)
+        results = {}
+        start, end = index._prefix_range(prefix)
+        for term, drug_id in index._entries[start:end]:
+            results.setdefault(drug_id, index._names[drug_id])
+        results = dict(list(results.items())[:limit])
+        max_distance = 1 if len(prefix) <= 4 else 2
+        start, end = index._prefix_range(prefix[0])
+        candidates = sorted(
+            (distance, term, drug_id) for term, drug_id in index._entries[start:end]
+            if drug_id not in results
+            for distance in [suggest.prefix_distance(prefix, term, max_distance)] if distance is not None
+        )
+        for _, _, drug_id in candidates:
+            if len(results) >= limit:
+                break
+            results.setdefault(drug_id, index._names[drug_id])
+        return [{"id": drug_id, "name": name} for drug_id, name in results.items()]
+
+    queries = ["amoxicilin", "amoxy", "metfromin", "ibuprofne", "hydrochlorid", "atorvastatn", "acyc", "aspr", "xyz"]
+    for query in queries:
+        assert index.suggest(query, 10, fuzzy=True) == scan(query, 10), query
+        assert index.suggest(query, 500, fuzzy=True) == scan(query, 500), query
+
+    checked = []
+    distance = suggest.prefix_distance
+    monkeypatch.setattr(suggest, "prefix_distance", lambda *args: checked.append(args) or distance(*args))
+    index.suggest("atorvastatn", 10, fuzzy=True)
+    # Five of the words start with "a"; only atorvastatin terms are checked
+    start, end = index._prefix_range("a")
+    assert 0 < len(checked) < (end - start) / 3
+
+def test_fuzzy_search_drugs():
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-fuzzy",
+            "name": "Ibuprofen Fuzzy",
+            "category": "Analgesics",
+            "description": "Test Description",
+            "active_ingredients": ["Ibuprofen"],
+            "dosage_forms": ["Tablet"]
+        }
+    )
+
+    response = client.get("/drugs?name=ibuprofin")
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get("/drugs?name=ibuprofin&fuzzy=true")
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == "test-drug-fuzzy"
+
+    response = client.get("/drugs?name=xylometazoline&fuzzy=true")
+    assert response.json() == []
+
+def test_search_drugs_with_facets():
+    for drug_id, category, forms in (
+        ("test-facet-1", "Facet Category", ["Tablet", "Capsule"]),
+        ("test-facet-2", "Facet Category", ["Tablet"]),
+        ("test-facet-3", "Other Facet Category", ["Tablet"]),
+    ):
+        client.post(
+            "/drugs",
+            json={
+                "id": drug_id,
+                "name": f"Facet Drug {drug_id}",
+                "category": category,
+                "description": "Test Description",
+                "active_ingredients": ["Facetamine"],
+                "dosage_forms": forms
+            }
+        )
+
+    response = client.get("/drugs/search?name=Facet Drug")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["results"]) == 3
+    assert {"value": "Facet Category", "count": 2} in data["facets"]["category"]
+    assert {"value": "Tablet", "count": 3} in data["facets"]["dosage_forms"]
+    assert {"value": "Capsule", "count": 1} in data["facets"]["dosage_forms"]
+    assert data["facets"]["ingredient"] == [{"value": "Facetamine", "count": 3}]
+
+    response = client.get("/drugs/search?name=Facet Drug&dosage_form=Capsule")
+    data = response.json()
+    assert [drug["id"] for drug in data["results"]] == ["test-facet-1"]
+    assert data["facets"]["category"] == [{"value": "Facet Category", "count": 1}]
+
+    client.put("/drugs/test-facet-1", json={"dosage_forms": ["Tablet"]})
+    response = client.get("/drugs/search?name=Facet Drug")
+    assert response.json()["facets"]["dosage_forms"] == [{"value": "Tablet", "count": 3}]
+
+def test_get_drugs_with_total():
+    response = client.get("/drugs")
+    assert "X-Total-Count" not in response.headers
+
+    response = client.get("/drugs?include_total=exact&limit=1")
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    total = int(response.headers["X-Total-Count"])
+    assert total > 1
+    assert response.headers["X-Total-Count-Mode"] == "exact"
+
+    response = client.get("/drugs?include_total=estimated&limit=1")
+    assert int(response.headers["X-Total-Count"]) == total
+
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-total",
+            "name": "Total Drug",
+            "category": "Test Category",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Test Form"]
+        }
+    )
+    response = client.get("/drugs?include_total=estimated&limit=1")
+    assert int(response.headers["X-Total-Count"]) == total + 1
+
+    response = client.get("/drugs?include_total=capped&name=Total Drug&fields=name")
+    assert response.headers["X-Total-Count"] == "1"
+    assert response.headers["X-Total-Count-Mode"] == "capped"
+
+def test_drug_client():
+    drug_client = DrugClient(str(client.base_url), session=client)
+    drugs = [
+        {
+            "name": f"Client Drug {i}",
+            "category": "Client Category",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Test Form"]
+        }
+        for i in range(5)
+    ]
+    created = drug_client.create_drugs(drugs)
+    assert [drug["name"] for drug in created] == [drug["name"] for drug in drugs]
+
+    listed = list(drug_client.iter_drugs(page_size=2, category="Client Category"))
+    assert sorted(drug["id"] for drug in listed) == sorted(drug["id"] for drug in created)
+
+    assert drug_client.get_drug("nonexistent") is None
+    assert drug_client.delete_drug(created[0]["id"]) is True
+    assert drug_client.delete_drug(created[0]["id"]) is False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.jsonl")
+        assert drug_client.export_drugs(path, category="Client Category") == 4
+        with open(path) as f:
+            assert all(json.loads(line)["category"] == "Client Category" for line in f)
+
+def test_async_drug_client():
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with AsyncDrugClient("http://testserver", transport=transport) as drug_client:
+            created = await drug_client.create_drugs(
+                {
+                    "name": f"Async Drug {i}",
+                    "category": "Async Category",
+                    "description": "Test Description",
+                    "active_ingredients": ["Test Ingredient"],
+                    "dosage_forms": ["Test Form"]
+                }
+                for i in range(3)
+            )
+            ids = [drug["id"] for drug in created]
+            fetched = await drug_client.get_drugs(ids + ["nonexistent"])
+            assert [drug["id"] for drug in fetched[:3]] == ids
+            assert fetched[3] is None
+            listed = [drug async for drug in drug_client.iter_drugs(page_size=2, category="Async Category")]
+            assert len(listed) == 3
+
+    asyncio.run(run())
+
+def test_drug_client_retries_only_idempotent_requests():
+    drug_client = DrugClient("http://api.example")
+    try:
+        def allowed(url):
+            return drug_client.session.get_adapter(url).max_retries.allowed_methods
+        assert "POST" in allowed("http://api.example/drugs")
+        assert "POST" not in allowed("http://api.example/jobs")
+        assert "POST" not in allowed("http://api.example/jobs/import")
+        assert {"GET", "PUT", "DELETE"} <= allowed("http://api.example/jobs")
+    finally:
+        drug_client.close()
+
+    calls = []
+
+    def unavailable(request):
+        calls.append((request.method, request.url.path))
+        return httpx.Response(503, json={"detail": "Overloaded"})
+
+    async def run():
+        transport = httpx.MockTransport(unavailable)
+        async with AsyncDrugClient(
+            "http://testserver", retries=2, backoff_factor=0, transport=transport
+        ) as drug_client:
+            for request in (
+                drug_client.start_job("analytics"),
+                drug_client.create_drug({"name": "Retried"}),
+                drug_client.get_drug("some-drug"),
+            ):
+                with pytest.raises(DrugAPIError):
+                    await request
+
+    asyncio.run(run())
+    assert calls == [("POST", "/jobs")] + [("POST", "/drugs")] * 3 + [("GET", "/drugs/some-drug")] * 3
+
+@pytest.mark.parametrize("wire_format", ["msgpack", "arrow"])
+def test_drug_client_wire_formats(wire_format):
+    pytest.importorskip({"msgpack": "msgpack", "arrow": "pyarrow"}[wire_format])
+    json_client = DrugClient(str(client.base_url), session=client)
+    binary_client = DrugClient(str(client.base_url), session=client, wire_format=wire_format)
+    json_client.create_drugs(
+        {
+            "id": f"wire-{wire_format}-{i}",
+            "name": f"Wire Drug {i}",
+            "category": f"Wire {wire_format}",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Tablet", "Capsule"][: 1 + i % 2],
+            "side_effects": ["Nausea"] if i % 2 else [],
+        }
+        for i in range(4)
+    )
+
+    for params in ({}, {"fields": "id,category,dosage_forms"}):
+        expected = json_client.list_drugs(category=f"Wire {wire_format}", **params)
+        assert len(expected) == 4
+        assert binary_client.list_drugs(category=f"Wire {wire_format}", **params) == expected
+
+    response = client.get("/drugs", headers={"Accept": WIRE_FORMATS[wire_format]})
+    assert response.headers["content-type"] == WIRE_FORMATS[wire_format]
+    assert response.headers["vary"] == "Accept"
+
+def test_update_drug_with_if_match():
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-version",
+            "name": "Versioned Drug",
+            "category": "Test Category",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Test Form"]
+        }
+    )
+    response = client.get("/drugs/test-drug-version")
+    assert response.json()["version"] == 1
+    etag = response.headers["ETag"]
+
+    response = client.put(
+        "/drugs/test-drug-version",
+        json={"description": "First edit"},
+        headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert response.json()["description"] == "First edit"
+    assert response.headers["ETag"] == '"2"'
+
+    # A second writer still holding the old ETag is rejected
+    response = client.put(
+        "/drugs/test-drug-version",
+        json={"description": "Lost update"},
+        headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    assert client.get("/drugs/test-drug-version").json()["description"] == "First edit"
+
+    response = client.put(
+        "/drugs/nonexistent",
+        json={"description": "Missing"},
+        headers={"If-Match": etag}
+    )
+    assert response.status_code == 404
+
+    response = client.delete("/drugs/test-drug-version", headers={"If-Match": etag})
+    assert response.status_code == 412
+    response = client.delete("/drugs/test-drug-version", headers={"If-Match": '"2"'})
+    assert response.status_code == 204
+
+def test_patch_drug_array_operations():
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-patch",
+            "name": "Patched Drug",
+            "category": "Test Category",
+            "description": "Test Description",
+            "active_ingredients": ["Ingredient A"],
+            "dosage_forms": ["Tablet"],
+            "side_effects": ["Nausea", "Headache"]
+        }
+    )
+
+    response = client.patch(
+        "/drugs/test-drug-patch",
+        json=[
+            {"op": "add", "path": "/dosage_forms/-", "value": "Patch Capsule"},
+            {"op": "add", "path": "/dosage_forms", "value": "Tablet"},
+            {"op": "remove", "path": "/side_effects", "value": "Nausea"},
+            {"op": "add", "path": "/contraindications", "value": "Pregnancy"}
+        ],
+        headers={"If-Match": '"1"'}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["dosage_forms"] == ["Tablet", "Patch Capsule"]
+    assert data["side_effects"] == ["Headache"]
+    assert data["contraindications"] == ["Pregnancy"]
+    assert data["version"] == 2
+    assert response.headers["ETag"] == '"2"'
+
+    # Facet side rows follow the patched values
+    response = client.get("/drugs/search", params={"dosage_form": "Patch Capsule"})
+    assert [drug["id"] for drug in response.json()["results"]] == ["test-drug-patch"]
+
+    response = client.patch(
+        "/drugs/test-drug-patch",
+        json=[{"op": "remove", "path": "/dosage_forms", "value": "Patch Capsule"}],
+        headers={"If-Match": '"1"'}
+    )
+    assert response.status_code == 412
+
+    response = client.patch(
+        "/drugs/test-drug-patch",
+        json=[{"op": "replace", "path": "/name", "value": "Renamed"}]
+    )
+    assert response.status_code == 422
+
+    response = client.patch(
+        "/drugs/nonexistent",
+        json=[{"op": "add", "path": "/side_effects", "value": "Rash"}]
+    )
+    assert response.status_code == 404
+
+def test_group_commit_writer():
+    from concurrent.futures import ThreadPoolExecutor
+    from crud import create_drug
+    from database import enable_sqlite_savepoints
+    from schemas import DrugCreate
+    from writer import GroupCommitWriter
+
+    batch_engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    enable_sqlite_savepoints(batch_engine)
+    writer = GroupCommitWriter(sessionmaker(autoflush=False, bind=batch_engine), max_batch=8, window=0.05)
+    writer.start()
+    fields = {
+        "category": "Batch", "description": "Batched write",
+        "active_ingredients": ["Batch Ingredient"], "dosage_forms": ["Tablet"],
+    }
+
+    def write(i):
+        if i == 3:
+            def failing(db):
+                db.add(DrugModel(id="test-batch-failed", name="Failed", **fields))
+                db.flush()
+                raise ValueError("rejected")
+            return writer.submit(failing)
+        drug = DrugCreate(id=f"test-batch-{i}", name=f"Batch Drug {i}", **fields)
+        return writer.submit(lambda db: create_drug(db, drug))
+
+    try:
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            futures = [pool.submit(write, i) for i in range(10)]
+        with pytest.raises(ValueError):
+            futures[3].result()
+        created = [futures[i].result().id for i in range(10) if i != 3]
+    finally:
+        writer.stop()
+        batch_engine.dispose()
+
+    assert created == [f"test-batch-{i}" for i in range(10) if i != 3]
+    assert client.get("/drugs/test-batch-0").status_code == 200
+    # The failed write's savepoint was rolled back without affecting the others
+    assert client.get("/drugs/test-batch-failed").status_code == 404
+    assert client.get("/drugs/suggest", params={"q": "batch drug"}).json()
+
+def test_change_feed():
+    import threading
+    import time
+
+    since = max([change["seq"] for change in client.get("/changes", params={"limit": 1000}).json()] or [0])
+
+    client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-changes",
+            "name": "Changing Drug",
+            "category": "Test Category",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Test Form"]
+        }
+    )
+    client.put("/drugs/test-drug-changes", json={"description": "Edited"})
+    client.delete("/drugs/test-drug-changes")
+
+    changes = client.get("/changes", params={"since": since}).json()
+    assert [(c["drug_id"], c["operation"], c["version"]) for c in changes] == [
+        ("test-drug-changes", "create", 1),
+        ("test-drug-changes", "update", 2),
+        ("test-drug-changes", "delete", None),
+    ]
+    assert [c["seq"] for c in changes] == sorted(c["seq"] for c in changes)
+    latest = changes[-1]["seq"]
+
+    # Long-poll with nothing new times out empty
+    started = time.monotonic()
+    assert client.get("/changes", params={"since": latest, "wait": 0.2}).json() == []
+    assert time.monotonic() - started >= 0.2
+
+    # ...and returns as soon as a write commits
+    writer = threading.Timer(0.1, lambda: client.post(
+        "/drugs",
+        json={
+            "id": "test-drug-changes-2",
+            "name": "Changing Drug 2",
+            "category": "Test Category",
+            "description": "Test Description",
+            "active_ingredients": ["Test Ingredient"],
+            "dosage_forms": ["Test Form"]
+        }
+    ))
+    writer.start()
+    started = time.monotonic()
+    changes = client.get("/changes", params={"since": latest, "wait": 10}).json()
+    writer.join()
+    assert [c["drug_id"] for c in changes] == ["test-drug-changes-2"]
+    assert time.monotonic() - started < 5
+
+def test_single_flight_coalesces_reads():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from cache import SingleFlight
+
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_read():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ["shared"]
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        leader = pool.submit(flights.do, ("drugs", "a"), slow_read)
+        started.wait(5)
+        followers = [pool.submit(flights.do, ("drugs", "a"), slow_read) for _ in range(3)]
+        other = pool.submit(flights.do, ("drug", "b"), lambda: "other")
+        assert other.result() == "other"
+        while flights.stats()["drugs"]["coalesced"] < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [future.result() for future in followers]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats() == {
+        "drugs": {"executions": 1, "coalesced": 3},
+        "drug": {"executions": 1, "coalesced": 0},
+    }
+
+    # Once the flight lands the next call runs again
+    assert flights.do(("drugs", "a"), lambda: ["fresh"]) == ["fresh"]
+
+    def failing_read():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.do(("drugs", "a"), failing_read)
+
+def test_coalescing_metrics():
+    before = client.get("/metrics").json()["coalescing"].get("categories", {"executions": 0})
+    assert client.get("/categories").status_code == 200
+    after = client.get("/metrics").json()["coalescing"]["categories"]
+    assert after["executions"] == before["executions"] + 1
+
 # Cleanup
 def teardown_module():
     if os.path.exists("./test.db"):
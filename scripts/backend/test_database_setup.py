@@ -0,0 +1,157 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, event, func, inspect, select
+
+import models  # noqa: F401 - registers the API tables on Base
+from database import Base
+
+# database_setup lives in scripts/, next to this backend directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database_setup  # noqa: E402
+
+# Set to a throwaway PostgreSQL database to exercise the COPY path too
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+DRUGS = [
+    {
+        "id": "st-johns-wort",
+        "name": "St. John's Wort",
+        "category_id": "antidepressants",
+        "description": "Don't combine with other serotonergic drugs",
+        "uses": ["Mild depression", "Seasonal affective disorder"],
+        "dosages": [{"condition": "Depression", "recommendation": "300 mg three times daily"}],
+        "side_effects": ["Dry mouth", {"description": "Serotonin syndrome", "is_serious": True}],
+        "drug_interactions": [{"interacting_drug": "Warfarin", "effect": "Lowers warfarin's effect", "severity": "major"}],
+        "food_interactions": ["Tyramine-rich food"],
+    },
+    {
+        "id": "ibuprofen",
+        "name": "Ibuprofen",
+        "category_id": "analgesics",
+        "uses": ["Pain", "Fever", "Inflammation"],
+        "side_effects": ["Heartburn"],
+    },
+    {"id": "placebo", "name": "Placebo", "category_id": "analgesics"},
+]
+
+CATEGORIES = [
+    {"id": "analgesics", "name": "Analgesics", "description": "Pain relievers"},
+    {"id": "antidepressants", "name": "Antidepressants", "description": None},
+]
+
+EXPECTED_ROWS = {
+    "categories": 2,
+    "drugs": 3,
+    "drug_uses": 5,
+    "drug_dosages": 1,
+    "side_effects": 3,
+    "drug_interactions": 1,
+    "food_interactions": 1,
+}
+
+def table_rows(engine):
+    with engine.connect() as connection:
+        return {
+            table.name: connection.execute(select(func.count()).select_from(table)).scalar()
+            for table in database_setup.metadata.sorted_tables
+        }
+
+@pytest.fixture
+def tmp_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+def catalog_engines():
+    # sqlite3 is positional (qmark); the named paramstyle covers the other
+    # executemany_rows branch
+    yield pytest.param({}, id="sqlite-positional")
+    yield pytest.param({"paramstyle": "named"}, id="sqlite-named")
+    yield pytest.param(
+        {"url": POSTGRES_URL}, id="postgres-copy",
+        marks=pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL not set"),
+    )
+
+@pytest.mark.parametrize("options", list(catalog_engines()))
+def test_load_drugs(tmp_dir, options):
+    options = dict(options)
+    url = options.pop("url", f"sqlite:///{os.path.join(tmp_dir, 'catalog.db')}")
+    engine = create_engine(url, **options)
+    if engine.dialect.name == "sqlite":
+        # Enforce the category foreign key as PostgreSQL does
+        event.listen(engine, "connect", lambda connection, record: connection.execute("PRAGMA foreign_keys=ON"))
+    try:
+        database_setup.create_database_schema(engine, rebuild=True)
+        stats = database_setup.LoadStats()
+        # The loader creates the category the records reference but this lacks
+        database_setup.load_categories(engine, CATEGORIES[:1], stats)
+        database_setup.load_drugs(engine, DRUGS, batch_size=2, stats=stats)
+        database_setup.create_indexes(engine)
+
+        assert table_rows(engine) == EXPECTED_ROWS
+        assert stats.rows == EXPECTED_ROWS
+        with engine.connect() as connection:
+            name, description = connection.execute(
+                select(database_setup.drugs.c.name, database_setup.drugs.c.description)
+                .where(database_setup.drugs.c.id == "st-johns-wort")
+            ).one()
+            category = connection.execute(
+                select(database_setup.categories.c.name).where(database_setup.categories.c.id == "antidepressants")
+            ).scalar()
+            serious = connection.execute(
+                select(database_setup.side_effects.c.description)
+                .where(database_setup.side_effects.c.is_serious)
+            ).scalars().all()
+        assert name == "St. John's Wort"
+        assert description == "Don't combine with other serotonergic drugs"
+        assert serious == ["Serotonin syndrome"]
+        assert category == "Antidepressants"
+    finally:
+        engine.dispose()
+
+def test_flatten_drug():
+    rows = database_setup.flatten_drug(DRUGS[0])
+    assert rows["drugs"][0]["name"] == "St. John's Wort"
+    assert rows["side_effects"] == [
+        {"drug_id": "st-johns-wort", "description": "Dry mouth", "is_serious": False},
+        {"drug_id": "st-johns-wort", "description": "Serotonin syndrome", "is_serious": True},
+    ]
+    assert {table: len(table_rows) for table, table_rows in database_setup.flatten_drug(DRUGS[2]).items()} == {
+        "drugs": 1, "drug_uses": 0, "drug_dosages": 0, "side_effects": 0,
+        "drug_interactions": 0, "food_interactions": 0,
+    }
+
+def test_main_reload_requires_rebuild(tmp_dir):
+    url = f"sqlite:///{os.path.join(tmp_dir, 'catalog.db')}"
+    input_path = os.path.join(tmp_dir, "drugs.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        for drug in DRUGS:
+            f.write(json.dumps(drug) + "\n")
+    args = ["--database-url", url, "--input", input_path, "--batch-size", "2"]
+
+    assert database_setup.main(args) == 0
+    with pytest.raises(SystemExit, match="--rebuild"):
+        database_setup.main(args)
+    assert database_setup.main(args + ["--rebuild"]) == 0
+
+    engine = create_engine(url)
+    try:
+        # Categories come from the input records, not the sample list
+        assert table_rows(engine) == EXPECTED_ROWS
+    finally:
+        engine.dispose()
+
+def test_refuses_api_database(tmp_dir):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'api.db')}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        with pytest.raises(SystemExit, match="API's drugs table"):
+            database_setup.create_database_schema(engine, rebuild=True)
+        # Nothing was dropped or created
+        assert "categories" not in inspect(engine).get_table_names()
+        assert "version" in {column["name"] for column in inspect(engine).get_columns("drugs")}
+    finally:
+        engine.dispose()
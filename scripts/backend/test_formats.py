@@ -0,0 +1,63 @@
+import pytest
+
+import formats
+from formats import ARROW, JSON, MSGPACK, encode, negotiate
+
+RECORDS = [
+    {
+        "id": f"drug-{i}",
+        "name": f"Drug {i}",
+        "category": ["Antibiotics", "Analgesics"][i % 2],
+        "active_ingredients": ["Shared Base", f"Ingredient {i}"],
+        "side_effects": [],
+        "created_at": "2024-01-01T12:00:00.123456",
+        "version": i,
+    }
+    for i in range(6)
+]
+FIELDS = ("id", "name", "category", "active_ingredients", "side_effects", "created_at", "version")
+
+def test_negotiate(monkeypatch):
+    monkeypatch.setattr(formats, "_available", lambda media_type: True)
+    assert negotiate(None) == JSON
+    assert negotiate("*/*") == JSON
+    assert negotiate("application/msgpack") == MSGPACK
+    assert negotiate("application/x-msgpack") == MSGPACK
+    assert negotiate("application/json;q=0.9, application/vnd.apache.arrow.stream") == ARROW
+    assert negotiate("application/msgpack;q=0.5, application/json") == JSON
+    assert negotiate("application/msgpack;q=0, text/html") == JSON
+
+    # A format whose package is missing is skipped, not an error
+    monkeypatch.setattr(formats, "_available", lambda media_type: media_type != MSGPACK)
+    assert negotiate("application/msgpack, application/vnd.apache.arrow.stream;q=0.5") == ARROW
+    assert negotiate("application/msgpack") == JSON
+
+def test_encode_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    assert msgpack.unpackb(encode(MSGPACK, RECORDS, FIELDS), raw=False) == RECORDS
+
+def test_encode_arrow_dictionary_encodes_strings():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.ipc.open_stream(encode(ARROW, RECORDS, FIELDS)).read_all()
+    assert table.num_rows == 6
+    assert pa.types.is_dictionary(table.schema.field("category").type)
+    assert pa.types.is_dictionary(table.schema.field("active_ingredients").type.value_type)
+    assert pa.types.is_timestamp(table.schema.field("created_at").type)
+
+    # Each distinct string is sent once
+    category = table.column("category").chunk(0)
+    assert category.dictionary.to_pylist() == ["Antibiotics", "Analgesics"]
+    ingredients = table.column("active_ingredients").chunk(0).flatten()
+    assert len(ingredients.dictionary) == 7
+
+    rows = table.to_pylist()
+    assert rows[1]["active_ingredients"] == ["Shared Base", "Ingredient 1"]
+    assert rows[1]["side_effects"] == []
+    assert rows[1]["created_at"].isoformat() == "2024-01-01T12:00:00.123456"
+    assert table.select(["id"]).to_pylist() == [{"id": record["id"]} for record in RECORDS]
+
+def test_encode_arrow_empty_page():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.ipc.open_stream(encode(ARROW, [], ("id", "category"))).read_all()
+    assert table.num_rows == 0
+    assert table.column_names == ["id", "category"]
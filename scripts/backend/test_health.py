@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import health
+from app import app
+from config import settings
+from health import ReadinessProbe
+
+@pytest.fixture
+def probe_settings(monkeypatch):
+    monkeypatch.setattr(settings, "readiness_budget_seconds", 1.0)
+    monkeypatch.setattr(settings, "readiness_cache_seconds", 0.0)
+    monkeypatch.setattr(settings, "readiness_max_db_latency_ms", 250.0)
+    return settings
+
+def test_liveness_and_readiness_endpoints():
+    client = TestClient(app)
+    for path in ("/health", "/health/live"):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.json()["status"] == "healthy"
+
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert body["checks"]["database"]["status"] == "ok"
+    assert body["checks"]["database"]["latency_ms"] >= 0
+    assert set(body["checks"]) >= {"database", "pool", "cache", "event_loop"}
+
+def test_readiness_is_cached(probe_settings, monkeypatch):
+    pings = []
+    monkeypatch.setattr(health, "ping_database", lambda engine: pings.append(engine) or 1.0)
+    monkeypatch.setattr(probe_settings, "readiness_cache_seconds", 60.0)
+    probe = ReadinessProbe()
+
+    async def probe_concurrently():
+        return await asyncio.gather(*[probe.check() for _ in range(5)])
+
+    results = asyncio.run(probe_concurrently())
+    assert all(result is results[0] for result in results)
+    assert asyncio.run(probe.check()) is results[0]
+    assert len(pings) == 1
+
+def test_slow_database_fails_within_budget(probe_settings, monkeypatch):
+    def slow_ping(engine):
+        time.sleep(0.3)
+        return 300.0
+
+    monkeypatch.setattr(health, "ping_database", slow_ping)
+    monkeypatch.setattr(probe_settings, "readiness_budget_seconds", 0.05)
+    probe = ReadinessProbe()
+
+    async def probe_twice():
+        started = time.monotonic()
+        first = await probe.check()
+        elapsed = time.monotonic() - started
+        # The first ping is still running: don't queue another one behind it
+        second = await probe.check()
+        await asyncio.sleep(0.4)
+        return first, elapsed, second
+
+    first, elapsed, second = asyncio.run(probe_twice())
+    assert elapsed < 0.25
+    assert first["status"] == "not_ready"
+    assert "no answer" in first["checks"]["database"]["error"]
+    assert second["checks"]["database"]["error"] == "previous check still running"
+
+def test_pool_saturation():
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import QueuePool
+
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=2, max_overflow=2)
+    connection = engine.connect()
+    try:
+        assert health.pool_usage(engine) == {"checked_out": 1, "capacity": 4, "saturation": 0.25}
+    finally:
+        connection.close()
+        engine.dispose()
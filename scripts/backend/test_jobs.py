@@ -0,0 +1,266 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app as app_module
+import jobs
+from client import DrugClient
+from crud import create_drug, delete_drug, update_drug
+from database import Base, get_db
+from jobs import JobKind, JobQueueFull, JobRunner, cancel_job, get_job, submit_job
+from models import Drug as DrugModel, Job as JobModel
+from schemas import DrugCreate, DrugUpdate
+
+@pytest.fixture
+def job_env():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'jobs.db')}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        for i in range(12):
+            create_drug(db, DrugCreate(
+                id=f"job-drug-{i:02d}",
+                name=f"Job Drug {i}",
+                category="Antibiotics" if i % 3 else "Analgesics",
+                description=f"Description {i}",
+                active_ingredients=[f"Ingredient {i % 4}"],
+                dosage_forms=["Tablet"],
+                side_effects=["Nausea"] if i % 2 else [],
+            ))
+        runner = JobRunner(Session, workers=2, directory=os.path.join(tmp, "jobs"), poll_interval=0.05)
+        yield runner, Session, db
+        runner.stop()
+        db.close()
+        engine.dispose()
+
+def wait_for(db, job_id, statuses=jobs.FINISHED, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.rollback()
+        job = get_job(db, job_id)
+        if job.status in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {job.status}")
+
+def test_export_and_analytics_jobs(job_env):
+    runner, _, db = job_env
+    export = submit_job(db, "export", {"category": "Antibiotics"})
+    analytics = submit_job(db, "analytics")
+    runner.start()
+
+    export = wait_for(db, export.id)
+    assert export.status == "succeeded"
+    assert (export.processed, export.total, export.summary) == (8, 8, {"drugs": 8})
+    with open(export.result_path) as result:
+        drugs = [json.loads(line) for line in result]
+    assert [drug["id"] for drug in drugs] == sorted(f"job-drug-{i:02d}" for i in range(12) if i % 3)
+    assert drugs[0]["category"] == "Antibiotics" and drugs[0]["version"] == 1
+
+    analytics = wait_for(db, analytics.id)
+    assert analytics.status == "succeeded", analytics.error
+    with open(analytics.result_path) as result:
+        report = json.load(result)
+    assert report["analysis"]["categories"] == {"Analgesics": 4, "Antibiotics": 8}
+    assert report["validation"]["valid_count"] == 12
+
+    with pytest.raises(ValueError):
+        submit_job(db, "export", {"bogus": 1})
+    with pytest.raises(ValueError):
+        submit_job(db, "reindex")
+
+def test_import_job(job_env):
+    runner, _, db = job_env
+    job = submit_job(db, "import")
+    os.makedirs(runner.directory)
+    with open(runner.input_path(job.id), "w") as upload:
+        upload.write(json.dumps({
+            "id": "job-drug-00", "name": "Renamed Drug", "category": "Analgesics", "description": "Description 0",
+            "active_ingredients": ["Ingredient 0"], "dosage_forms": ["Tablet"],
+        }) + "\n")
+        upload.write(json.dumps({
+            "id": "job-drug-01", "name": "Job Drug 1", "category": "Antibiotics", "description": "Description 1",
+            "active_ingredients": ["Ingredient 1"], "dosage_forms": ["Tablet"], "side_effects": ["Nausea"],
+        }) + "\n")
+        upload.write(json.dumps({
+            "id": "imported-1", "name": "Imported", "category": "Antivirals", "description": "New",
+            "active_ingredients": ["X"], "dosage_forms": ["Tablet"],
+        }) + "\n\n")
+        upload.write('{"name": ""}\n')
+    runner.start()
+
+    job = wait_for(db, job.id)
+    assert job.status == "succeeded", job.error
+    assert job.summary == {"created": 1, "updated": 1, "unchanged": 1, "failed": 1}
+    assert not os.path.exists(runner.input_path(job.id))
+    with open(job.result_path) as result:
+        assert [error["line"] for error in json.load(result)["errors"]] == [5]
+    db.rollback()
+    renamed = db.query(DrugModel).filter(DrugModel.id == "job-drug-00").one()
+    assert (renamed.name, renamed.version) == ("Renamed Drug", 2)
+    assert db.query(DrugModel).filter(DrugModel.id == "job-drug-01").one().version == 1
+    assert db.query(DrugModel).filter(DrugModel.id == "imported-1").one().category == "Antivirals"
+
+def test_import_job_keeps_concurrent_edits(job_env, monkeypatch):
+    runner, Session, db = job_env
+    end_read = jobs._end_read
+
+    def edit_after_read(session):
+        # Runs between the import reading a drug and writing it back
+        end_read(session)
+        with Session() as other:
+            if other.get(DrugModel, "job-drug-00").version == 1:
+                update_drug(other, "job-drug-00", DrugUpdate(description="Edited meanwhile"))
+            elif other.get(DrugModel, "job-drug-01") is not None:
+                delete_drug(other, "job-drug-01")
+
+    monkeypatch.setattr(jobs, "_end_read", edit_after_read)
+    job = submit_job(db, "import")
+    os.makedirs(runner.directory)
+    with open(runner.input_path(job.id), "w") as upload:
+        for i in range(2):
+            upload.write(json.dumps({
+                "id": f"job-drug-{i:02d}", "name": "Imported name", "category": "Analgesics",
+                "description": "Imported", "active_ingredients": ["Ingredient 0"], "dosage_forms": ["Tablet"],
+            }) + "\n")
+    runner.start()
+
+    job = wait_for(db, job.id)
+    assert job.status == "succeeded", job.error
+    assert job.summary == {"created": 0, "updated": 0, "unchanged": 0, "failed": 2}
+    with open(job.result_path) as result:
+        assert [error["line"] for error in json.load(result)["errors"]] == [1, 2]
+    db.rollback()
+    edited = db.get(DrugModel, "job-drug-00")
+    assert (edited.name, edited.description, edited.version) == ("Job Drug 0", "Edited meanwhile", 2)
+    assert db.get(DrugModel, "job-drug-01") is None
+
+@pytest.fixture
+def slow_kind(monkeypatch):
+    """A job kind that runs until cancelled or interrupted, recording how
+    many run at once"""
+    state = {"running": 0, "peak": 0, "started": threading.Event()}
+    lock = threading.Lock()
+
+    def run(ctx):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        state["started"].set()
+        try:
+            for step in range(int(ctx.params.get("steps", 10_000))):
+                ctx.progress(step, force=True)
+                time.sleep(0.01)
+        finally:
+            with lock:
+                state["running"] -= 1
+        return {"steps": step + 1}
+
+    monkeypatch.setitem(jobs.JOB_KINDS, "slow", JobKind(run, "application/json", "json", 1, ("steps",)))
+    return state
+
+def test_cancel_and_concurrency_limit(job_env, slow_kind):
+    runner, _, db = job_env
+    first = submit_job(db, "slow")
+    second = submit_job(db, "slow", {"steps": 3})
+    queued = submit_job(db, "slow")
+    assert cancel_job(db, queued.id).status == "cancelled"
+    runner.start()
+
+    assert slow_kind["started"].wait(5)
+    time.sleep(0.2)
+    # Two workers, but only one job of this kind may run at a time
+    db.rollback()
+    assert [get_job(db, job.id).status for job in (first, second)] == ["running", "queued"]
+    assert get_job(db, first.id).processed > 0
+
+    assert cancel_job(db, first.id).cancel_requested
+    assert wait_for(db, first.id).status == "cancelled"
+    second = wait_for(db, second.id)
+    assert (second.status, second.summary) == ("succeeded", {"steps": 3})
+    assert slow_kind["peak"] == 1
+    assert wait_for(db, queued.id).status == "cancelled"
+
+def test_interrupted_and_stale_jobs_are_requeued(job_env, slow_kind):
+    runner, Session, db = job_env
+    job = submit_job(db, "slow")
+    runner.start()
+    assert slow_kind["started"].wait(5)
+    runner.stop()
+    db.rollback()
+    job = get_job(db, job.id)
+    assert (job.status, job.attempts, job.started_at) == ("queued", 1, None)
+
+    # A runner that died mid-job leaves it running with an old heartbeat
+    db.query(JobModel).filter(JobModel.id == job.id).update({
+        "status": "running", "attempts": 2, "heartbeat_at": datetime.utcnow() - timedelta(minutes=5),
+    })
+    db.commit()
+    runner.requeue_stale()
+    db.rollback()
+    assert get_job(db, job.id).status == "queued"
+
+    db.query(JobModel).filter(JobModel.id == job.id).update({
+        "status": "running", "attempts": jobs.MAX_ATTEMPTS, "heartbeat_at": datetime.utcnow() - timedelta(minutes=5),
+    })
+    db.commit()
+    runner.requeue_stale()
+    db.rollback()
+    assert get_job(db, job.id).status == "failed"
+
+def test_queue_limit(job_env):
+    _, _, db = job_env
+    submit_job(db, "export", max_queued=2)
+    submit_job(db, "export", max_queued=2)
+    with pytest.raises(JobQueueFull):
+        submit_job(db, "export", max_queued=2)
+
+def test_job_endpoints(job_env, monkeypatch):
+    runner, Session, _ = job_env
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    monkeypatch.setattr(app_module, "job_runner", runner)
+    monkeypatch.setitem(app_module.app.dependency_overrides, get_db, override_get_db)
+    client = TestClient(app_module.app)
+    runner.start()
+
+    response = client.post("/jobs", json={"kind": "export", "params": {"category": "Analgesics"}})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.headers["location"] == f"/jobs/{job_id}"
+    assert client.post("/jobs", json={"kind": "export", "params": {"bogus": 1}}).status_code == 400
+    assert client.post("/jobs", json={"kind": "import"}).status_code == 422
+
+    job = DrugClient(str(client.base_url), session=client).wait_for_job(job_id, poll_interval=0.02, timeout=10)
+    assert (job["status"], job["progress"], job["total"]) == ("succeeded", 1.0, 4)
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.headers["content-type"] == "application/x-ndjson"
+    exported = result.text
+
+    response = client.post("/jobs/import", content=exported.replace("Analgesics", "Pain Relief"))
+    assert response.status_code == 202
+    import_id = response.json()["id"]
+    job = DrugClient(str(client.base_url), session=client).wait_for_job(import_id, poll_interval=0.02, timeout=10)
+    assert job["summary"]["updated"] == 4
+
+    assert [job["id"] for job in client.get("/jobs?status=succeeded").json()] == [import_id, job_id]
+    assert client.get("/jobs/missing").status_code == 404
+    assert client.delete(f"/jobs/{job_id}").json()["status"] == "succeeded"
+    assert client.get(f"/jobs/{job_id}/result").status_code == 200
@@ -0,0 +1,79 @@
+import json
+import logging
+import queue
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import logs
+from app import app
+from config import Settings
+from logs import DeferredQueueHandler, JsonFormatter
+
+@pytest.fixture
+def sampling():
+    def configure(**overrides):
+        logs.configure_logging(Settings(log_format="text", **overrides))
+    yield configure
+    logs.configure_logging(Settings())
+
+def test_json_formatter_includes_extra_and_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("drug-api").makeRecord(
+            "drug-api", logging.ERROR, __file__, 1, "Failed %s", ("drug-1",), sys.exc_info(),
+            extra={"path": "/drugs/drug-1"},
+        )
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "Failed drug-1"
+    assert entry["path"] == "/drugs/drug-1"
+    assert "ValueError: boom" in entry["exception"]
+
+def test_queue_handler_defers_formatting():
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.makeLogRecord({
+            "msg": "Failed %s", "args": ("drug-1",), "exc_info": sys.exc_info(), "levelno": logging.ERROR,
+        })
+    handler.handle(record)
+    queued = log_queue.get_nowait()
+    # Message and traceback are both left for the listener thread
+    assert (queued.msg, queued.args) == ("Failed %s", ("drug-1",))
+    assert queued.getMessage() == "Failed drug-1"
+    assert queued.exc_info is not None and queued.exc_text is None
+
+    # Mutable arguments are merged before the caller can change them
+    ids = ["drug-1"]
+    handler.handle(logging.makeLogRecord({"msg": "Deleted %s", "args": (ids,), "levelno": logging.INFO}))
+    ids.append("drug-2")
+    queued = log_queue.get_nowait()
+    assert (queued.msg, queued.args) == ("Deleted ['drug-1']", None)
+
+def test_client_errors_are_sampled_per_route(sampling, caplog):
+    client = TestClient(app)
+    sampling(log_client_error_sample_rate=0.0)
+    with caplog.at_level(logging.DEBUG, logger="app"):
+        assert client.get("/drugs/drug-1", params={"fields": "bogus"}).status_code == 400
+    assert [record.levelno for record in caplog.records if record.name == "app"] == [logging.DEBUG]
+
+    caplog.clear()
+    sampling(log_client_error_sample_rate=0.0, log_route_sample_rates={"/drugs/{drug_id}": 1.0})
+    with caplog.at_level(logging.INFO, logger="app"):
+        assert client.get("/drugs/drug-1", params={"fields": "bogus"}).status_code == 400
+    records = [record for record in caplog.records if record.name == "app"]
+    assert [record.levelno for record in records] == [logging.INFO]
+    assert records[0].status_code == 400
+
+def test_sample_rate_validation():
+    with pytest.raises(ValueError):
+        Settings(log_client_error_sample_rate=1.5)
+    with pytest.raises(ValueError):
+        Settings(log_route_sample_rates={"/drugs": -1})
+    with pytest.raises(ValueError):
+        Settings(log_format="xml")
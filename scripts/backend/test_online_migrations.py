@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import Column, MetaData, String, create_engine, inspect, text
+
+import models
+from database import Base
+from online_migrations import backfill, rebuild_sqlite_table
+
+@pytest.fixture
+def engine():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'migrate.db')}")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            connection.execute(
+                models.Drug.__table__.insert(),
+                [
+                    {
+                        "id": f"drug-{i:04d}",
+                        "name": f"Drug {i}",
+                        "category": "Test",
+                        "description": "",
+                        "active_ingredients": [],
+                        "dosage_forms": [],
+                    }
+                    for i in range(250)
+                ],
+            )
+        yield engine
+        engine.dispose()
+
+def test_backfill_in_batches(engine):
+    batches = []
+    updated = backfill(
+        engine,
+        "drugs",
+        "description = 'Backfilled ' || name",
+        where="description = ''",
+        batch_size=100,
+        progress=lambda progress: batches.append(progress.done),
+    )
+    assert updated == 250
+    assert batches == [100, 200, 250]
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM drugs WHERE description = ''")).scalar() == 0
+        assert connection.execute(
+            text("SELECT description FROM drugs WHERE id = 'drug-0007'")
+        ).scalar() == "Backfilled Drug 7"
+
+def test_rebuild_sqlite_table_keeps_concurrent_writes(engine):
+    new_drugs = models.Drug.__table__.to_metadata(MetaData())
+    new_drugs.append_column(Column("display_name", String))
+    new_drugs.append_column(Column("review_status", String, nullable=False, server_default="pending"))
+
+    def write_between_chunks(progress):
+        # Simulate foreground traffic while the copy is in progress
+        if progress.done != 100:
+            return
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE drugs SET name = 'Renamed' WHERE id = 'drug-0001'"))
+            connection.execute(text("UPDATE drugs SET name = 'Late rename' WHERE id = 'drug-0200'"))
+            connection.execute(text("DELETE FROM drugs WHERE id IN ('drug-0002', 'drug-0201')"))
+            connection.execute(text(
+                "INSERT INTO drugs (id, name, category, description, active_ingredients, dosage_forms, version) "
+                "VALUES ('drug-0000a', 'Inserted', 'Test', '', '[]', '[]', 1)"
+            ))
+
+    copied = rebuild_sqlite_table(
+        engine,
+        new_drugs,
+        column_expressions={"display_name": "upper(name)"},
+        batch_size=100,
+        progress=write_between_chunks,
+    )
+    assert copied >= 248
+
+    with engine.connect() as connection:
+        rows = dict(connection.execute(text("SELECT id, display_name FROM drugs")).all())
+        statuses = set(connection.execute(text("SELECT review_status FROM drugs")).scalars())
+        triggers = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).all()
+
+    assert len(rows) == 249
+    assert rows["drug-0001"] == "RENAMED"
+    assert rows["drug-0200"] == "LATE RENAME"
+    assert rows["drug-0000a"] == "INSERTED"
+    assert "drug-0002" not in rows and "drug-0201" not in rows
+    assert statuses == {"pending"}
+    assert triggers == []
+    assert {index["name"] for index in inspect(engine).get_indexes("drugs")} >= {
+        "ix_drugs_name", "ix_drugs_created_at", "ix_drugs_category_name",
+    }
@@ -0,0 +1,111 @@
+import itertools
+import json
+import os
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import models  # noqa: F401 - registers the tables on Base
+from crud import build_drugs_query
+from database import Base
+
+# Set to a throwaway PostgreSQL database to check its plans too
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+FILTERS = {
+    "name": "amox",
+    "category": "Antibiotics",
+    "ingredient": "Ibuprofen",
+    "dosage_form": "Tablet",
+    "created_after": date(2024, 1, 1),
+    "created_before": date(2025, 1, 1),
+}
+
+COMBINATIONS = [
+    combo
+    for size in range(len(FILTERS) + 1)
+    for combo in itertools.combinations(FILTERS, size)
+]
+
+def list_query_sql(db, combo):
+    """The SQL GET /drugs runs for a filter combination"""
+    query, ordering, _ = build_drugs_query(db, **{key: FILTERS[key] for key in combo})
+    query = query.order_by(*ordering).offset(0).limit(100)
+    return str(query.statement.compile(db.get_bind(), compile_kwargs={"literal_binds": True}))
+
+@pytest.fixture(scope="module")
+def sqlite_db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = Session(engine)
+    yield db
+    db.close()
+    engine.dispose()
+
+def sqlite_plan(db, sql):
+    return [row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+@pytest.mark.parametrize("combo", COMBINATIONS, ids=lambda combo: "+".join(combo) or "none")
+def test_sqlite_list_queries_use_indexes(sqlite_db, combo):
+    plan = sqlite_plan(sqlite_db, list_query_sql(sqlite_db, combo))
+    table_steps = [step for step in plan if step.startswith(("SCAN drugs", "SEARCH drugs"))]
+    assert table_steps, plan
+    if "dosage_form" in combo:
+        assert any(
+            step.startswith("SEARCH drug_dosage_forms USING COVERING INDEX ix_drug_dosage_forms_value")
+            for step in plan
+        ), plan
+    if "category" in combo:
+        # An exact category seeks the (category, name) index, which also
+        # returns that category's drugs in name order
+        assert table_steps == ["SEARCH drugs USING INDEX ix_drugs_category_name (category=?)"], plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+    elif "dosage_form" in combo:
+        # The facet side table finds the drug ids, which are then fetched by key
+        assert all(step.startswith("SEARCH drugs USING") for step in table_steps), plan
+    elif {"created_after", "created_before"} <= set(combo):
+        assert table_steps == [
+            "SEARCH drugs USING INDEX ix_drugs_created_at (created_at>? AND created_at<?)"
+        ], plan
+    else:
+        # Nothing left to seek on: no B-tree index can serve the ILIKE
+        # '%...%' name/ingredient filters, and without statistics
+        # SQLite expects an open-ended date range to match most rows. The
+        # best plan is a full scan in name order, which needs no sort and
+        # stops as soon as a page of matches is found
+        assert table_steps == ["SCAN drugs USING INDEX ix_drugs_name"], plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+
+def test_sqlite_categories_use_covering_index(sqlite_db):
+    sql = str(sqlite_db.query(models.Drug.category).distinct().statement)
+    plan = sqlite_plan(sqlite_db, sql)
+    assert any("COVERING INDEX ix_drugs_category_name" in step for step in plan), plan
+
+def postgres_plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from postgres_plan_nodes(child)
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL not set")
+@pytest.mark.parametrize("combo", COMBINATIONS, ids=lambda combo: "+".join(combo) or "none")
+def test_postgres_list_queries_use_indexes(combo):
+    engine = create_engine(POSTGRES_URL)
+    Base.metadata.create_all(bind=engine)
+    try:
+        with Session(engine) as db:
+            # An empty table is always cheapest to scan; ask whether an index
+            # plan exists at all
+            db.execute(text("SET enable_seqscan = off"))
+            sql = list_query_sql(db, combo)
+            plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes = list(postgres_plan_nodes(plan[0]["Plan"]))
+            assert not any(
+                node["Node Type"] == "Seq Scan" and node.get("Relation Name") == "drugs"
+                for node in nodes
+            ), nodes
+    finally:
+        engine.dispose()
@@ -0,0 +1,91 @@
+import random
+
+from fastapi.testclient import TestClient
+
+import app as app_module
+from client import DrugClient
+from screening import ContraindicationIndex, condition_terms, normalize
+
+def test_condition_terms():
+    assert normalize("  Kidney   Disease. ") == "kidney disease"
+    assert condition_terms(["Severe kidney disease", "Pregnancy"]) == (
+        "disease", "kidney disease", "pregnancy", "severe kidney disease"
+    )
+    assert condition_terms(None) == ()
+
+def test_screen_any_and_all():
+    index = ContraindicationIndex()
+    index.build([
+        ("a", "Alpha", ["Severe kidney disease", "Pregnancy"]),
+        ("b", "Beta", ["Pregnancy"]),
+        ("c", "Gamma", ["Liver disease"]),
+        ("d", "Delta", []),
+    ])
+    result = index.screen(["kidney disease", "PREGNANCY", "Gout"])
+    assert result["total"] == 2
+    assert result["unmatched_conditions"] == ["Gout"]
+    assert result["results"] == [
+        {"id": "a", "name": "Alpha", "matched_conditions": ["kidney disease", "PREGNANCY"]},
+        {"id": "b", "name": "Beta", "matched_conditions": ["PREGNANCY"]},
+    ]
+    assert [drug["id"] for drug in index.screen(["Kidney disease", "Pregnancy"], match_all=True)["results"]] == ["a"]
+    assert index.screen(["Pregnancy", "Gout"], match_all=True)["total"] == 0
+    assert [drug["id"] for drug in index.screen(["pregnancy"], skip=1)["results"]] == ["b"]
+    assert index.screen([" ", "!!"]) == {"total": 0, "unmatched_conditions": [], "results": []}
+
+    index.add("d", "Delta", ["Pregnancy"])
+    index.add("a", "Alpha", ["Liver disease"])
+    index.remove("b")
+    assert [drug["id"] for drug in index.screen(["Pregnancy"])["results"]] == ["d"]
+    assert [drug["id"] for drug in index.screen(["disease"])["results"]] == ["a", "c"]
+
+def test_screen_matches_brute_force():
+    # Enough drugs that common conditions are held as bitmaps and rare ones
+    # as arrays, including postings that cross over through writes
+    rng = random.Random(7)
+    conditions = [f"Condition {i}" for i in range(40)]
+    weights = [1 / (i + 1) for i in range(len(conditions))]
+
+    def pick():
+        return list({rng.choices(conditions, weights)[0] for _ in range(rng.randrange(4))})
+
+    drugs = {f"drug-{i:04d}": pick() for i in range(2000)}
+    index = ContraindicationIndex()
+    index.build((drug_id, drug_id, values) for drug_id, values in sorted(drugs.items()))
+    for step in range(600):
+        drug_id = f"drug-{rng.randrange(2300):04d}"
+        if step % 5 == 0:
+            drugs.pop(drug_id, None)
+            index.remove(drug_id)
+        else:
+            drugs[drug_id] = pick()
+            index.add(drug_id, drug_id, drugs[drug_id])
+
+    order = {drug_id: position for position, drug_id in enumerate(index._ids)}
+    for _ in range(50):
+        query = rng.sample(conditions, rng.randrange(1, 4))
+        for match_all in (False, True):
+            expected = sorted(
+                (drug_id for drug_id, values in drugs.items()
+                 if (all if match_all else any)(condition in values for condition in query)),
+                key=order.get,
+            )
+            result = index.screen(query, match_all, skip=3, limit=50)
+            assert result["total"] == len(expected)
+            assert [drug["id"] for drug in result["results"]] == expected[3:53]
+
+def test_screen_endpoint(monkeypatch):
+    index = ContraindicationIndex()
+    index.build([("drug-1", "Lisinopril", ["Pregnancy", "Angioedema"]), ("drug-2", "Metformin", ["Kidney disease"])])
+    monkeypatch.setattr(app_module, "contraindication_index", index)
+    client = TestClient(app_module.app)
+
+    response = client.get("/drugs/screen", params={"condition": ["Kidney disease", "Pregnancy"]})
+    assert response.status_code == 200
+    assert [drug["id"] for drug in response.json()["results"]] == ["drug-1", "drug-2"]
+    result = DrugClient(str(client.base_url), session=client).screen(["pregnancy", "angioedema"], match="all")
+    assert result["results"][0]["matched_conditions"] == ["pregnancy", "angioedema"]
+    assert client.get("/drugs/screen").status_code == 422
+    assert client.get("/drugs/screen", params={"condition": "x", "match": "some"}).status_code == 422
+    too_many = {"condition": [f"Condition {i}" for i in range(51)]}
+    assert client.get("/drugs/screen", params=too_many).status_code == 400
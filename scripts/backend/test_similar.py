@@ -0,0 +1,158 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app as app_module
+import crud
+import jobs
+import similar
+from config import Settings
+from crud import create_drug, delete_drug, update_drug
+from database import Base, get_db, get_read_db
+from jobs import JobRunner, queue_similar_rebuild
+from models import DrugSimilar as DrugSimilarModel
+from schemas import DrugCreate, DrugUpdate
+from similar import SimilarDrugs, SimilarityIndex, features
+from test_jobs import wait_for
+
+def drug(i, **overrides):
+    values = dict(
+        id=f"sim-{i:02d}",
+        name=f"Similar Drug {i}",
+        category=["Antibiotics", "Analgesics", "Antivirals"][i % 3],
+        description=f"Description {i}",
+        active_ingredients=[f"Ingredient {i % 6}"],
+        dosage_forms=["Tablet"],
+        side_effects=["Nausea"] + (["Rash"] if i % 4 == 0 else []),
+        contraindications=["Pregnancy"] if i % 5 == 0 else [],
+    )
+    values.update(overrides)
+    return values
+
+@pytest.fixture
+def similar_env(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'similar.db')}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        manager = SimilarDrugs()
+        manager.configure(Settings(similar_top_k=3))
+        manager._session_factory = Session
+        monkeypatch.setattr(crud, "similar_drugs", manager)
+        monkeypatch.setattr(jobs, "similar_drugs", manager)
+        db = Session()
+        for i in range(30):
+            create_drug(db, DrugCreate(**drug(i)))
+        yield manager, Session, db, tmp
+        db.close()
+        engine.dispose()
+
+def stored(db, drug_id):
+    db.rollback()
+    return [
+        row.similar_id for row in
+        db.query(DrugSimilarModel).filter(DrugSimilarModel.drug_id == drug_id).order_by(DrugSimilarModel.rank)
+    ]
+
+def test_similarity_index_scores():
+    index = SimilarityIndex()
+    index.build([
+        ("a", "Analgesics", ["Ibuprofen"], ["Nausea"], []),
+        ("b", "Analgesics", ["Ibuprofen", "Caffeine"], ["Nausea"], []),
+        ("c", "Analgesics", ["Paracetamol"], ["Nausea"], []),
+        ("d", "Antibiotics", ["Amoxicillin"], ["Nausea"], ["Penicillin allergy"]),
+    ])
+    # Nausea is on every drug, so it carries no weight and links nothing
+    assert index.scores("d") == {}
+    scores = index.scores("a")
+    assert set(scores) == {"b", "c"} and scores["b"] > scores["c"] > 0
+    assert index.scores("b")["a"] == pytest.approx(scores["b"])
+    assert index.neighbours("a", 1) == [("b", scores["b"])]
+
+    index.add("c", features("Analgesics", ["Ibuprofen"], ["Nausea"], []))
+    assert index.neighbours("a", 2)[0] == ("c", pytest.approx(1.0))
+    index.remove("c")
+    assert "c" not in index and set(index.scores("a")) == {"b"}
+
+def test_common_features_score_but_find_no_candidates(monkeypatch):
+    drugs = [("a", "Analgesics", ["Ibuprofen"], [], []), ("b", "Analgesics", ["Ibuprofen"], ["Rash"], [])]
+    drugs += [(f"x{i}", "Analgesics", [f"Other {i}"], [], []) for i in range(4)]
+    drugs += [(f"y{i}", "Antibiotics", [f"Other {i}"], [], []) for i in range(4)]
+    index = SimilarityIndex()
+    index.build(drugs)
+    exact = index.scores("a")
+    assert set(exact) == {"b", "x0", "x1", "x2", "x3"}
+
+    # Analgesics is on 6 of 10 drugs: past the cutoff it no longer links
+    # drugs on its own, but still counts towards b's score
+    monkeypatch.setattr(similar, "MIN_COMMON_POSTING", 0)
+    scores = index.scores("a")
+    assert scores == {"b": pytest.approx(exact["b"])}
+
+def test_rebuild_and_incremental_refresh(similar_env):
+    manager, _, db, _ = similar_env
+    manager.load(db)
+    assert manager.rebuild(db) == 30
+    # Same ingredient and category; the two that also share Rash come first
+    assert stored(db, "sim-00") == ["sim-12", "sim-24", "sim-06"]
+    assert manager.refresh() == 0
+
+    # sim-01 takes on all of sim-00's features
+    update_drug(db, "sim-01", DrugUpdate(
+        category="Antibiotics", active_ingredients=["Ingredient 0"], side_effects=["Nausea", "Rash"],
+        contraindications=["Pregnancy"],
+    ))
+    assert manager.refresh() > 1
+    assert stored(db, "sim-01")[0] == "sim-00"
+    assert stored(db, "sim-00")[0] == "sim-01"
+    # Lists that held sim-01 for its old ingredient were recomputed
+    assert "sim-01" not in stored(db, "sim-07")
+
+    delete_drug(db, "sim-00")
+    create_drug(db, DrugCreate(**drug(30, id="sim-new", active_ingredients=["Ingredient 0"])))
+    manager.refresh()
+    db.rollback()
+    assert not db.query(DrugSimilarModel).filter(
+        (DrugSimilarModel.drug_id == "sim-00") | (DrugSimilarModel.similar_id == "sim-00")
+    ).count()
+    assert stored(db, "sim-new")
+    for drug_id in manager.index.ids():
+        assert stored(db, drug_id) == [other for other, _ in manager.index.neighbours(drug_id, 3)]
+
+def test_rebuild_job_and_endpoint(similar_env, monkeypatch):
+    manager, Session, db, tmp = similar_env
+    job = queue_similar_rebuild(db)
+    assert job.kind == "similar"
+    assert queue_similar_rebuild(db) is None
+
+    runner = JobRunner(Session, workers=1, directory=os.path.join(tmp, "jobs"), poll_interval=0.05)
+    runner.start()
+    try:
+        job = wait_for(db, job.id)
+    finally:
+        runner.stop()
+    assert (job.status, job.summary) == ("succeeded", {"drugs": 30})
+    assert queue_similar_rebuild(db) is None
+
+    def override_get_db():
+        session = Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    monkeypatch.setitem(app_module.app.dependency_overrides, get_read_db, override_get_db)
+    monkeypatch.setitem(app_module.app.dependency_overrides, get_db, override_get_db)
+    client = TestClient(app_module.app)
+    similar = client.get("/drugs/sim-00/similar").json()
+    assert [entry["id"] for entry in similar] == stored(db, "sim-00")
+    assert similar[0]["shared_ingredients"] == ["Ingredient 0"]
+    assert similar[0]["score"] >= similar[-1]["score"] > 0
+    assert len(client.get("/drugs/sim-00/similar?limit=1").json()) == 1
+    assert client.get("/drugs/missing/similar").status_code == 404
@@ -0,0 +1,195 @@
+import itertools
+import json
+import os
+import tempfile
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import snapshot as snapshot_module
+from app import encode_drugs
+from config import Settings
+from database import Base
+from models import Drug as DrugModel, DrugChange as DrugChangeModel
+from snapshot import CatalogueSnapshot, SnapshotManager, render_json
+from trigram import TrigramIndex
+
+CATEGORIES = ["Antibiotics", "Analgesics", "Antivirals"]
+FORMS = [["Tablet"], ["Capsule", "Syrup"], ["Injection"]]
+
+@pytest.fixture
+def catalogue_db(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'catalogue.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        for i in range(60):
+            db.add(DrugModel(
+                id=f"drug-{i:03d}",
+                # Duplicate names check the tie-break; one name has non-ASCII
+                name="Ampicillin" if i % 20 == 0 else f"Drug {i % 17} Ølix" if i == 7 else f"Drug {i % 17}",
+                category=CATEGORIES[i % 3],
+                description=f"Description {i}",
+                active_ingredients=[f"Ingredient {i % 5}", "Shared_Base"],
+                dosage_forms=FORMS[i % 3],
+                side_effects=["Nausea"] if i % 2 else [],
+                contraindications=[],
+                created_at=datetime(2024, 1, 1 + i % 28, 12),
+                updated_at=datetime(2024, 2, 1),
+                version=1 + i % 4,
+            ))
+        db.add(DrugChangeModel(drug_id="drug-000", operation="create", version=1))
+        db.commit()
+
+        index = TrigramIndex()
+        index.build(db.query(DrugModel.id, DrugModel.name))
+        monkeypatch.setattr(crud, "trigram_index", index)
+        monkeypatch.setattr(snapshot_module, "trigram_index", index)
+        yield tmp, Session, db
+        db.close()
+        engine.dispose()
+
+def database_body(db, *filters, skip=0, limit=100, fields=None, fuzzy=False):
+    name, category, ingredient, created_after, created_before = filters
+    rows = crud.get_drugs(db, name, category, ingredient, created_after, created_before, skip, limit, fields, fuzzy)
+    return render_json(encode_drugs(rows, fields))
+
+def test_snapshot_matches_database(catalogue_db):
+    _, _, db = catalogue_db
+    snapshot = CatalogueSnapshot.build(db)
+    db.rollback()
+    assert snapshot.version == 1
+    assert len(snapshot) == 60
+
+    combinations = itertools.product(
+        # SQLite folds case for ASCII only, so non-ASCII is queried as stored
+        [None, "drug 1", "AMP", "%1_", "Ølix"],
+        [None, "Antivirals", "Analgesics"],
+        [None, "ingredient 3", "shared_base"],
+        [None, date(2024, 1, 10)],
+        [None, date(2024, 1, 20)],
+    )
+    for filters in combinations:
+        for skip, limit, fields in [(0, 100, None), (3, 5, None), (0, 10, ("id", "name", "version"))]:
+            expected = database_body(db, *filters, skip=skip, limit=limit, fields=fields)
+            matches = snapshot.matches(*filters)
+            assert snapshot.render_drugs(matches, skip, limit, fields) == expected, (filters, skip, fields)
+            assert snapshot.records(snapshot.matches(*filters), skip, limit, fields) == json.loads(expected)
+        total = len(json.loads(database_body(db, *filters, limit=1000)))
+        assert snapshot.count(list(snapshot.matches(*filters))) == total
+
+    fuzzy = snapshot.render_drugs(snapshot.matches("drugg 1", fuzzy=True), 0, 100)
+    assert fuzzy == database_body(db, "drugg 1", None, None, None, None, fuzzy=True)
+
+    drug = crud.get_drug_by_id(db, "drug-007")
+    assert snapshot.render_drug("drug-007") == render_json(encode_drugs(drug, None))
+    assert json.loads(snapshot.render_drug("drug-007", ("id", "side_effects"))) == {
+        "id": "drug-007", "side_effects": ["Nausea"],
+    }
+    assert snapshot.drug_version("drug-007") == drug.version
+    assert snapshot.render_drug("missing") is None
+    assert snapshot.categories == sorted(crud.get_categories(db))
+
+def test_snapshot_manager_swaps_after_writes(catalogue_db, monkeypatch):
+    tmp, Session, db = catalogue_db
+    manager = SnapshotManager()
+    manager.configure(Settings(snapshot_mode="mmap", snapshot_directory=os.path.join(tmp, "snapshots")))
+    manager._session_factory = Session
+    os.makedirs(manager.directory)
+    assert manager.refresh()
+    first = manager.get()
+    assert first.path.endswith("catalogue-1.snap")
+    # Nothing changed: no rebuild
+    assert not manager.refresh()
+
+    # A second worker at the same version maps the same file instead of rendering
+    other = CatalogueSnapshot.build(Session(), manager.directory)
+    assert other.path == first.path
+    assert other.render_drug("drug-001") == first.render_drug("drug-001")
+
+    db.query(DrugModel).filter(DrugModel.id == "drug-001").update({"name": "Renamed", "version": 9})
+    db.add(DrugChangeModel(drug_id="drug-001", operation="update", version=9))
+    db.commit()
+    manager.invalidate()
+    # Until the refresh, reads go to the database
+    assert manager.get() is None
+    assert manager.refresh()
+    second = manager.get()
+    assert second.version == 2
+    assert json.loads(second.render_drug("drug-001"))["name"] == "Renamed"
+    assert second.drug_version("drug-001") == 9
+    # Readers still holding the old snapshot are unaffected
+    assert json.loads(first.render_drug("drug-001"))["name"] == "Drug 1"
+    # One changed drug is applied on top of the shared file, not rebuilt
+    assert second.path == first.path
+    assert os.listdir(manager.directory) == ["catalogue-1.snap"]
+    assert (manager.stats()["builds"], manager.stats()["deltas"]) == (1, 1)
+
+    # A delta past the limit compacts into a new file
+    monkeypatch.setattr(snapshot_module, "_MIN_DELTA_LIMIT", 1)
+    for i in range(10):
+        db.add(DrugChangeModel(drug_id=f"drug-{i:03d}", operation="update", version=1))
+    db.commit()
+    assert manager.refresh()
+    third = manager.get()
+    assert third.path.endswith("catalogue-12.snap")
+    assert os.listdir(manager.directory) == ["catalogue-12.snap"]
+    assert (manager.stats()["builds"], manager.stats()["deltas"]) == (2, 1)
+
+def test_snapshot_delta_matches_database(catalogue_db):
+    _, _, db = catalogue_db
+    base = CatalogueSnapshot.build(db)
+    db.rollback()
+
+    # A rename that moves the drug, a category change, a delete and an insert
+    db.query(DrugModel).filter(DrugModel.id == "drug-005").update({"name": "Aaa First", "version": 7})
+    db.query(DrugModel).filter(DrugModel.id == "drug-010").update({"category": "Antifungals", "version": 8})
+    db.query(DrugModel).filter(DrugModel.id == "drug-020").delete()
+    db.add(DrugModel(
+        id="drug-new", name="Drug 3", category="Vaccines", description="New",
+        active_ingredients=["Ingredient 9"], dosage_forms=["Spray"], side_effects=[], contraindications=[],
+        created_at=datetime(2024, 1, 15), updated_at=datetime(2024, 2, 1), version=1,
+    ))
+    for drug_id in ["drug-005", "drug-010", "drug-020", "drug-new"]:
+        db.add(DrugChangeModel(drug_id=drug_id, operation="update", version=1))
+    db.commit()
+
+    assert base.can_apply(4)
+    delta = base.apply(db, 5, ["drug-005", "drug-010", "drug-020", "drug-new"])
+    db.rollback()
+    assert delta.version == 5
+    assert len(delta) == 60
+    assert delta.render_drug("drug-020") is None
+    assert delta.drug_version("drug-005") == 7
+    for filters in itertools.product(
+        [None, "drug 3", "aaa"], [None, "Antifungals", "Vaccines"], [None, "ingredient 9"], [None], [None],
+    ):
+        for skip, limit, fields in [(0, 100, None), (2, 5, ("id", "name"))]:
+            expected = database_body(db, *filters, skip=skip, limit=limit, fields=fields)
+            assert delta.render_drugs(delta.matches(*filters), skip, limit, fields) == expected, filters
+    assert [delta._ids[position] for position in delta.matches(dosage_form="Spray")] == ["drug-new"]
+    assert delta.categories == sorted(crud.get_categories(db))
+    # The base snapshot is unchanged
+    assert base.render_drug("drug-020") is not None
+
+def test_snapshot_file_reused_only_for_same_content(catalogue_db):
+    tmp, Session, db = catalogue_db
+    directory = os.path.join(tmp, "snapshots")
+    os.makedirs(directory)
+    first = CatalogueSnapshot.build(Session(), directory)
+
+    # Rewritten without a change log entry: same version, different rows
+    db.query(DrugModel).filter(DrugModel.id == "drug-001").update({"description": "Rewritten"})
+    db.commit()
+    second = CatalogueSnapshot.build(Session(), directory)
+    assert second.version == first.version
+    assert json.loads(second.render_drug("drug-001"))["description"] == "Rewritten"
+    # The old mapping still reads the old bytes
+    assert json.loads(first.render_drug("drug-001"))["description"] == "Description 1"
+
+    third = CatalogueSnapshot.build(Session(), directory)
+    assert third.render_drug("drug-001") == second.render_drug("drug-001")
@@ -0,0 +1,205 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cold-start budget for importing the API module in a fresh interpreter
+IMPORT_BUDGET_SECONDS = 3.0
+
+def run_python(code, cwd):
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": BACKEND_DIR},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
+
+def test_import_is_side_effect_free():
+    with tempfile.TemporaryDirectory() as tmp:
+        stdout = run_python(
+            "import json, time\n"
+            "started = time.perf_counter()\n"
+            "import app, database\n"
+            "print(json.dumps({'elapsed': time.perf_counter() - started, 'engine': database.engine is None}))",
+            cwd=tmp,
+        )
+        result = json.loads(stdout)
+        assert result["engine"] is True
+        assert result["elapsed"] < IMPORT_BUDGET_SECONDS
+        assert os.listdir(tmp) == []
+
+def test_create_app_without_schema_bootstrap():
+    with tempfile.TemporaryDirectory() as tmp:
+        run_python(
+            "from app import create_app\n"
+            "from config import Settings\n"
+            "create_app(Settings(database_url='sqlite:///./factory.db', bootstrap_schema=False))",
+            cwd=tmp,
+        )
+        assert not os.path.exists(os.path.join(tmp, "factory.db"))
+
+        run_python(
+            "from app import create_app\n"
+            "from config import Settings\n"
+            "create_app(Settings(database_url='sqlite:///./factory.db'))",
+            cwd=tmp,
+        )
+        assert os.path.exists(os.path.join(tmp, "factory.db"))
+
+def test_sqlite_savepoints_only_with_group_commit():
+    with tempfile.TemporaryDirectory() as tmp:
+        stdout = run_python(
+            "import json, database\n"
+            "from config import Settings\n"
+            "levels = {}\n"
+            "for group_commit in (False, True):\n"
+            "    database.configure(Settings(database_url='sqlite:///./group.db', group_commit=group_commit))\n"
+            "    with database.engine.connect() as connection:\n"
+            "        levels[str(group_commit)] = connection.connection.isolation_level\n"
+            "print(json.dumps(levels))",
+            cwd=tmp,
+        )
+        # pysqlite manages transactions itself ('') unless the writer needs
+        # SQLAlchemy to emit BEGIN (None)
+        assert json.loads(stdout.strip().splitlines()[-1]) == {"False": "", "True": None}
+
+# The drugs table as the baseline API created it, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE drugs (
+    id VARCHAR NOT NULL,
+    name VARCHAR NOT NULL,
+    category VARCHAR NOT NULL,
+    description TEXT NOT NULL,
+    active_ingredients JSON NOT NULL,
+    dosage_forms JSON NOT NULL,
+    side_effects JSON,
+    contraindications JSON,
+    created_at DATETIME,
+    updated_at DATETIME,
+    PRIMARY KEY (id)
+);
+CREATE INDEX ix_drugs_name ON drugs (name);
+CREATE INDEX ix_drugs_id ON drugs (id);
+CREATE INDEX ix_drugs_category ON drugs (category);
+INSERT INTO drugs VALUES (
+    'aspirin-1', 'Aspirin', 'Analgesics', 'Pain relief', '["Aspirin"]', '["Tablet"]', '[]', '[]',
+    '2024-01-01 00:00:00.000000', '2024-01-01 00:00:00.000000'
+);
+"""
+
+def run_migrations(database_url):
+    """Apply every revision in migrations/ in order, as ``alembic upgrade head`` would"""
+    import importlib.util
+
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+    from sqlalchemy import create_engine
+
+    directory = os.path.join(BACKEND_DIR, "migrations")
+    revisions = {}
+    for filename in os.listdir(directory):
+        if filename.endswith(".py"):
+            spec = importlib.util.spec_from_file_location(filename[:-3], os.path.join(directory, filename))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            revisions[module.down_revision] = module
+
+    engine = create_engine(database_url)
+    try:
+        revision = None
+        while revision in revisions:
+            module = revisions[revision]
+            with engine.begin() as connection:
+                with Operations.context(MigrationContext.configure(connection)):
+                    module.upgrade()
+            revision = module.revision
+    finally:
+        engine.dispose()
+
+# Tables the migrations create or alter; each must end up as create_all
+# would build it
+MIGRATED_TABLES = [
+    "drugs", "drug_ingredients", "drug_dosage_forms", "table_counts", "drug_changes", "jobs", "drug_similar",
+]
+
+def table_schema(engine, name):
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    columns = {column["name"]: column["nullable"] for column in inspector.get_columns(name)}
+    indexes = {index["name"]: index["column_names"] for index in inspector.get_indexes(name)}
+    foreign_keys = sorted(
+        (fk["constrained_columns"], fk["referred_table"], fk["options"]) for fk in inspector.get_foreign_keys(name)
+    )
+    return columns, inspector.get_pk_constraint(name)["constrained_columns"], indexes, foreign_keys
+
+def uses_autoincrement(engine, name):
+    with engine.connect() as connection:
+        sql = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).scalar()
+    return "AUTOINCREMENT" in sql
+
+def test_migrations_match_models():
+    from sqlalchemy import create_engine
+
+    import models  # noqa: F401 - registers every table on Base
+    from database import Base
+
+    with tempfile.TemporaryDirectory() as tmp:
+        migrated_path = os.path.join(tmp, "migrated.db")
+        connection = sqlite3.connect(migrated_path)
+        connection.executescript(BASELINE_SCHEMA)
+        connection.close()
+        run_migrations(f"sqlite:///{migrated_path}")
+
+        migrated = create_engine(f"sqlite:///{migrated_path}")
+        bootstrapped = create_engine(f"sqlite:///{os.path.join(tmp, 'bootstrapped.db')}")
+        Base.metadata.create_all(bind=bootstrapped)
+        try:
+            # A model without a revision breaks databases managed by migrations
+            assert set(MIGRATED_TABLES) == set(Base.metadata.tables)
+            for name in MIGRATED_TABLES:
+                assert table_schema(migrated, name) == table_schema(bootstrapped, name), name
+                assert uses_autoincrement(migrated, name) == uses_autoincrement(bootstrapped, name), name
+        finally:
+            migrated.dispose()
+            bootstrapped.dispose()
+
+def test_startup_after_migrating_baseline_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "baseline.db")
+        connection = sqlite3.connect(path)
+        connection.executescript(BASELINE_SCHEMA)
+        connection.close()
+
+        run_migrations(f"sqlite:///{path}")
+
+        # Only the migrations create the schema; TestClient runs the startup
+        # and shutdown handlers
+        run_python(
+            "import json\n"
+            "from fastapi.testclient import TestClient\n"
+            "from app import create_app\n"
+            "from config import Settings\n"
+            f"app = create_app(Settings(database_url='sqlite:///{path}', bootstrap_schema=False))\n"
+            "with TestClient(app) as client:\n"
+            "    response = client.get('/drugs/aspirin-1')\n"
+            "    created = client.post('/drugs', json={'name': 'Naproxen', 'category': 'Analgesics', "
+            "'description': 'NSAID', 'active_ingredients': ['Naproxen'], 'dosage_forms': ['Tablet']})\n"
+            "    result = {'status': response.status_code, 'etag': response.headers.get('etag'), "
+            "'created': created.status_code}\n"
+            "with open('result.json', 'w') as f:\n"
+            "    json.dump(result, f)",
+            cwd=tmp,
+        )
+        with open(os.path.join(tmp, "result.json")) as f:
+            result = json.load(f)
+        assert result == {"status": 200, "etag": '"1"', "created": 201}
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from config import Settings
+from tracing import (
+    TracedJSONResponse, TracedRoute, TracingMiddleware, instrument_engine, parse_traceparent, start_span, tracer,
+)
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+@pytest.fixture
+def traced_app():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        router = APIRouter(route_class=TracedRoute)
+
+        @router.get("/drugs/{drug_id}")
+        def get_drug(drug_id: str):
+            with engine.connect() as connection:
+                name = connection.execute(text("SELECT upper(:id)"), {"id": drug_id}).scalar()
+            with start_span("response.encode"):
+                return {"id": drug_id, "name": name}
+
+        app = FastAPI(default_response_class=TracedJSONResponse)
+        app.add_middleware(TracingMiddleware)
+        app.include_router(router)
+        trace_file = os.path.join(tmp, "traces.jsonl")
+
+        def run(sample_rate=1.0, **headers):
+            tracer.configure(Settings(tracing_exporter="file", tracing_file=trace_file, tracing_sample_rate=sample_rate))
+            response = TestClient(app).get("/drugs/drug-1", headers=headers)
+            tracer.shutdown()
+            with open(trace_file) as spans:
+                lines = [json.loads(line) for line in spans]
+            os.remove(trace_file)
+            return response, lines
+
+        yield run
+        tracer.configure(Settings())
+        engine.dispose()
+
+def test_parse_traceparent():
+    assert parse_traceparent(PARENT) == ("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", True)
+    assert parse_traceparent(PARENT[:-2] + "00")[2] is False
+    assert parse_traceparent("00-" + "0" * 32 + "-b7ad6b7169203331-01") is None
+    assert parse_traceparent("garbage") is None
+    assert parse_traceparent(None) is None
+
+def test_request_spans(traced_app):
+    response, spans = traced_app()
+    assert response.json() == {"id": "drug-1", "name": "DRUG-1"}
+    by_name = {span["name"]: span for span in spans}
+    assert set(by_name) == {
+        "GET /drugs/{drug_id}", "handler get_drug", "db.query", "response.encode", "response.render",
+    }
+
+    root = by_name["GET /drugs/{drug_id}"]
+    assert root["parentSpanId"] == ""
+    assert root["kind"] == "SPAN_KIND_SERVER"
+    assert root["attributes"]["http.status_code"] == 200
+    assert {span["traceId"] for span in spans} == {root["traceId"]}
+    assert response.headers["traceparent"] == f"00-{root['traceId']}-{root['spanId']}-01"
+
+    handler = by_name["handler get_drug"]
+    assert handler["parentSpanId"] == root["spanId"]
+    assert by_name["db.query"]["parentSpanId"] == handler["spanId"]
+    assert by_name["db.query"]["attributes"]["db.statement"] == "SELECT upper(?)"
+    assert by_name["response.encode"]["parentSpanId"] == handler["spanId"]
+    assert by_name["response.render"]["parentSpanId"] == root["spanId"]
+
+def test_sampling(traced_app):
+    response, spans = traced_app(traceparent=PARENT)
+    assert {span["traceId"] for span in spans} == {"0af7651916cd43dd8448eb211c80319c"}
+    root = next(span for span in spans if span["kind"] == "SPAN_KIND_SERVER")
+    assert root["parentSpanId"] == "b7ad6b7169203331"
+
+    # The caller's sampling decision wins over the local rate, both ways
+    assert traced_app(sample_rate=0.0, traceparent=PARENT)[1]
+    assert traced_app(traceparent=PARENT[:-2] + "00")[1] == []
+
+    response, spans = traced_app(sample_rate=0.0)
+    assert spans == []
+    assert "traceparent" not in response.headers
@@ -0,0 +1,298 @@
+"""
+Lightweight request tracing, compatible with OpenTelemetry.
+
+Spans cover request handling (ASGI middleware), endpoint execution, every
+SQLAlchemy statement, ORM-to-model validation and JSON encoding/rendering.
+Trace context follows the W3C ``traceparent`` header, so spans join traces
+started by OpenTelemetry-instrumented callers and the trace id is returned
+to the client. Finished spans are written by a background thread as JSON
+lines using OTLP field names (``traceId``, ``spanId``,
+``startTimeUnixNano``...), to stdout (``tracing_exporter="console"``) or
+``tracing_file`` (``"file"``).
+
+Sampling is decided once per trace: an incoming ``traceparent`` is
+honoured, otherwise ``tracing_sample_rate`` of new traces are kept. An
+unsampled request creates no spans; the hooks only look up a context
+variable, so tracing can stay on in production at a low sample rate.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from config import Settings
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+# Longest SQL statement recorded on a span
+MAX_STATEMENT_LENGTH = 2000
+
+class Span:
+    __slots__ = (
+        "name", "kind", "trace_id", "span_id", "parent_span_id", "attributes",
+        "start_ns", "end_ns", "error",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 kind: str = "INTERNAL", attributes: Optional[Dict] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_json(self, resource: Dict) -> str:
+        record = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": f"SPAN_KIND_{self.kind}",
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": (
+                {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error else {"code": "STATUS_CODE_UNSET"}
+            ),
+            "resource": resource,
+        }
+        return json.dumps(record, default=str)
+
+def parse_traceparent(header: Optional[str]):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent, or None"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if set(parts[1]) == {"0"} or set(parts[2]) == {"0"}:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+class Tracer:
+    """Creates spans for sampled traces and exports them in the background"""
+
+    def __init__(self):
+        self.exporter = "none"
+        self.sample_rate = 1.0
+        self.resource: Dict = {}
+        self._file = None
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter != "none"
+
+    def configure(self, app_settings: Settings):
+        self.shutdown()
+        self.exporter = app_settings.tracing_exporter
+        self.sample_rate = app_settings.tracing_sample_rate
+        self.resource = {"service.name": app_settings.api_title, "service.version": app_settings.api_version}
+        if self.enabled:
+            self._file = open(app_settings.tracing_file, "a") if self.exporter == "file" else None
+            self._thread = threading.Thread(target=self._export, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        """Write out queued spans and stop the exporter thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+        """The root (server) span for a request, or None if not sampled"""
+        if not self.enabled:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_span_id, sampled = parent
+        else:
+            trace_id, parent_span_id = f"{random.getrandbits(128):032x}", None
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return None
+        return Span(name, trace_id, parent_span_id, "SERVER", attributes)
+
+    def end(self, span: Span):
+        span.end_ns = time.time_ns()
+        self._queue.put(span)
+
+    def _export(self):
+        output = self._file or sys.stdout
+        while True:
+            span = self._queue.get()
+            batch = [span]
+            # Drain whatever else is queued so a burst is one write
+            while span is not None:
+                try:
+                    span = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(span)
+            lines = [span.to_json(self.resource) for span in batch if span is not None]
+            if lines:
+                output.write("\n".join(lines) + "\n")
+                output.flush()
+            if batch[-1] is None:
+                return
+
+tracer = Tracer()
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """A child of the current span; does nothing outside a sampled trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.error = repr(exc)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.end(span)
+
+class TracingMiddleware:
+    """ASGI middleware opening the server span for each sampled request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        traceparent = headers.get(b"traceparent")
+        span = tracer.start_trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent.decode("latin-1") if traceparent else None,
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        if span is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                span.attributes["http.status_code"] = status_code
+                if status_code >= 500:
+                    span.error = f"HTTP {status_code}"
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", span.traceparent.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = _current_span.set(span)
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as exc:
+            span.error = repr(exc)
+            raise
+        finally:
+            _current_span.reset(token)
+            # The router records the matched route in the scope
+            route = scope.get("route")
+            if route is not None:
+                span.name = f"{scope['method']} {route.path}"
+                span.attributes["http.route"] = route.path
+            tracer.end(span)
+
+class TracedRoute(APIRoute):
+    """Wraps the endpoint in a ``handler`` span, separating the endpoint's
+    own time from request parsing and response serialization"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # include_router() builds the route again from the wrapped endpoint
+        if getattr(endpoint, "_traced", False):
+            super().__init__(path, endpoint, **kwargs)
+            return
+        name = f"handler {endpoint.__name__}"
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def traced(*args, **kw):
+                with start_span(name):
+                    return await endpoint(*args, **kw)
+        else:
+            @functools.wraps(endpoint)
+            def traced(*args, **kw):
+                with start_span(name):
+                    return endpoint(*args, **kw)
+        traced._traced = True
+        super().__init__(path, traced, **kwargs)
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with start_span("response.render"):
+            return super().render(content)
+
+def instrument_engine(engine):
+    """Record a ``db.query`` span for every statement run on ``engine``"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    span = Span("db.query", parent.trace_id, parent.span_id, "CLIENT", {
+        "db.system": conn.dialect.name,
+        "db.statement": statement[:MAX_STATEMENT_LENGTH],
+    })
+    conn.info.setdefault("trace_spans", []).append(span)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.attributes["db.rowcount"] = cursor.rowcount
+        tracer.end(span)
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get("trace_spans") if connection is not None else None
+    if spans:
+        span = spans.pop()
+        span.error = repr(exception_context.original_exception)
+        tracer.end(span)
@@ -0,0 +1,118 @@
+"""
+Trigram index for typo-tolerant drug name search.
+
+On PostgreSQL the work is pushed down to ``pg_trgm`` with a GIN index. Other
+databases use the in-process inverted index below, which mirrors pg_trgm's
+trigram extraction and similarity so rankings agree across backends.
+"""
+
+import math
+import re
+from threading import Lock
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import text
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+def trigrams(value: str) -> Set[str]:
+    """Extract pg_trgm style trigrams: each word padded with two leading
+    spaces and one trailing space"""
+    grams = set()
+    for word in _WORD_RE.findall(value.casefold()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def similarity(left: Set[str], right: Set[str]) -> float:
+    """Share of trigrams two values have in common, as computed by pg_trgm"""
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+class TrigramIndex:
+    """Inverted index from trigram to the drugs whose name contains it"""
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def build(self, drugs: Iterable[Tuple[str, str]]):
+        """Replace the index contents with ``(id, name)`` rows"""
+        postings: Dict[str, Set[str]] = {}
+        grams: Dict[str, Set[str]] = {}
+        for drug_id, name in drugs:
+            grams[drug_id] = trigrams(name)
+            for gram in grams[drug_id]:
+                postings.setdefault(gram, set()).add(drug_id)
+        with self._lock:
+            self._postings = postings
+            self._grams = grams
+
+    def add(self, drug_id: str, name: str):
+        """Insert or replace a single drug"""
+        with self._lock:
+            self._discard(drug_id)
+            self._grams[drug_id] = trigrams(name)
+            for gram in self._grams[drug_id]:
+                self._postings.setdefault(gram, set()).add(drug_id)
+
+    def remove(self, drug_id: str):
+        """Drop a drug from the index if present"""
+        with self._lock:
+            self._discard(drug_id)
+
+    def _discard(self, drug_id: str):
+        for gram in self._grams.pop(drug_id, ()):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(drug_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def search(self, query: str, threshold: float, limit: int) -> List[Tuple[str, float]]:
+        """Return up to ``limit`` ``(id, similarity)`` pairs, best first.
+
+        A name reaching ``threshold`` must share at least
+        ``ceil(threshold * |query trigrams|)`` trigrams with the query, so
+        candidates only need to be drawn from the rarest posting lists
+        (prefix filtering); the frequent ones are used for verification.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            postings = sorted(
+                (self._postings.get(gram, set()) for gram in query_grams),
+                key=len
+            )
+            required = max(1, math.ceil(threshold * len(query_grams)))
+            candidates: Set[str] = set()
+            for posting in postings[:len(postings) - required + 1]:
+                candidates.update(posting)
+
+            matches = []
+            for drug_id in candidates:
+                score = similarity(query_grams, self._grams[drug_id])
+                if score >= threshold:
+                    matches.append((drug_id, score))
+
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
+
+def ensure_pg_trgm_index(engine):
+    """Install pg_trgm and the GIN trigram index on ``drugs.name``"""
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_drugs_name_trgm "
+            "ON drugs USING gin (name gin_trgm_ops)"
+        ))
+
+trigram_index = TrigramIndex()
@@ -0,0 +1,135 @@
+"""
+Group commit for single-item writes.
+
+Every write endpoint normally commits its own transaction, which on SQLite
+costs one fsync per request. With ``group_commit`` enabled, writes are
+queued to one background flusher instead: it collects whatever arrives
+within a short window (up to ``max_batch`` writes), runs each in its own
+SAVEPOINT of a shared transaction and commits them together. A failing
+write only rolls back its savepoint, so every caller still gets its own
+result or exception.
+"""
+
+import contextvars
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_STOP = object()
+
+class GroupCommitWriter:
+    """Queue plus background flusher coalescing writes into one transaction"""
+
+    def __init__(self, session_factory: Callable[..., Session], max_batch: int = 64, window: float = 0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.window = window
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush everything already queued, then stop the flusher"""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, operation: Callable[[Session], T]) -> T:
+        """Run ``operation(db)`` in the next batch and wait for it to commit.
+
+        Returns the operation's result, or raises its exception (or the
+        batch's commit error).
+        """
+        if not self.running:
+            raise RuntimeError("Group commit writer is not running")
+        future: Future = Future()
+        # Run in the caller's context so its trace span is the parent
+        self._queue.put((functools.partial(contextvars.copy_context().run, operation), future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            batch = [job]
+            stopping = False
+            deadline = monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch: List[Tuple[Callable[[Session], object], Future]]):
+        # Results stay readable after the session closes
+        db = self.session_factory(expire_on_commit=False)
+        callbacks: list = []
+        db.info["after_commit"] = callbacks
+        outcomes = []
+        try:
+            for operation, future in batch:
+                pending = len(callbacks)
+                savepoint = db.begin_nested()
+                try:
+                    result = operation(db)
+                    if savepoint.is_active:
+                        savepoint.commit()
+                    outcomes.append((future, result, None))
+                except Exception as exc:
+                    if db.in_nested_transaction():
+                        savepoint.rollback()
+                    del callbacks[pending:]
+                    outcomes.append((future, None, exc))
+            db.commit()
+        except Exception as exc:
+            logger.error("Group commit of %d writes failed: %s", len(batch), exc)
+            db.rollback()
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        finally:
+            db.close()
+
+        for callback in callbacks:
+            callback()
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+group_writer = GroupCommitWriter(SessionLocal)
@@ -1,157 +1,423 @@
+"""
+Create the normalized drug catalogue schema and bulk load it.
+
+Tables: categories, drugs, drug_uses, drug_dosages, side_effects,
+drug_interactions and food_interactions. Rows are loaded in batches with
+parameterized executemany (COPY on PostgreSQL with psycopg2); secondary
+indexes are built after the load. Rows/sec is reported per table.
+
+Usage:
+    python database_setup.py                          # schema + sample data
+    python database_setup.py --input drugs.jsonl      # load JSON lines
+    python database_setup.py --generate 1000000 --rebuild --batch-size 20000
+
+The catalogue uses its own database (``--database-url``, default
+``$CATALOG_DATABASE_URL`` or ``sqlite:///./drug_catalog.db``), not the one
+the API serves: its ``drugs`` table is not the API's, and loading into the
+API's database is refused. Records name their category by ``category_id``
+(and optionally ``category``); missing categories are created as they load.
+"""
+
+import argparse
+import csv
+import io
 import json
-import sys
 import os
-from datetime import datetime
-
-# This script demonstrates how you might set up a database for the drug data application
-# In a real application, this would connect to a real database
-
-def create_database_schema():
-    """Create the database schema for the drug data application"""
-    print("Creating database schema...")
-    
-    # In a real application, this would execute SQL statements to create tables
-    # For this example, we'll just print the SQL that would be executed
-    
-    schema_sql = """
-    -- Create drugs table
-    CREATE TABLE IF NOT EXISTS drugs (
-        id VARCHAR(100) PRIMARY KEY,
-        name VARCHAR(255) NOT NULL,
-        category_id VARCHAR(100) REFERENCES categories(id),
-        description TEXT,
-        full_description TEXT,
-        how_it_works TEXT,
-        administration TEXT,
-        image_url VARCHAR(255),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-
-    -- Create categories table
-    CREATE TABLE IF NOT EXISTS categories (
-        id VARCHAR(100) PRIMARY KEY,
-        name VARCHAR(255) NOT NULL,
-        description TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-
-    -- Create drug_uses table
-    CREATE TABLE IF NOT EXISTS drug_uses (
-        id SERIAL PRIMARY KEY,
-        drug_id VARCHAR(100) REFERENCES drugs(id),
-        description TEXT NOT NULL
-    );
-
-    -- Create drug_dosages table
-    CREATE TABLE IF NOT EXISTS drug_dosages (
-        id SERIAL PRIMARY KEY,
-        drug_id VARCHAR(100) REFERENCES drugs(id),
-        condition VARCHAR(255) NOT NULL,
-        recommendation TEXT NOT NULL
-    );
-
-    -- Create side_effects table
-    CREATE TABLE IF NOT EXISTS side_effects (
-        id SERIAL PRIMARY KEY,
-        drug_id VARCHAR(100) REFERENCES drugs(id),
-        description TEXT NOT NULL,
-        is_serious BOOLEAN DEFAULT FALSE
-    );
-
-    -- Create drug_interactions table
-    CREATE TABLE IF NOT EXISTS drug_interactions (
-        id SERIAL PRIMARY KEY,
-        drug_id VARCHAR(100) REFERENCES drugs(id),
-        interacting_drug VARCHAR(255),
-        effect TEXT,
-        severity VARCHAR(50)
-    );
-
-    -- Create food_interactions table
-    CREATE TABLE IF NOT EXISTS food_interactions (
-        id SERIAL PRIMARY KEY,
-        drug_id VARCHAR(100) REFERENCES drugs(id),
-        description TEXT NOT NULL
-    );
-    """
-    
-    print(schema_sql)
-    print("\nSchema creation SQL generated successfully.")
-    
-    return True
-
-def seed_sample_data():
-    """Seed the database with sample data"""
-    print("\nSeeding database with sample data...")
-    
-    # Sample categories
-    categories = [
-        {"id": "antibiotics", "name": "Antibiotics", "description": "Medications used to treat bacterial infections"},
-        {"id": "analgesics", "name": "Analgesics", "description": "Pain relievers and medications that reduce inflammation"},
-        {"id": "cardiovascular", "name": "Cardiovascular Drugs", "description": "Medications for heart conditions and blood pressure"},
-        {"id": "antidiabetic", "name": "Antidiabetic", "description": "Medications used to treat diabetes"},
-        {"id": "hormones", "name": "Hormones", "description": "Medications that replace or supplement natural hormones"}
+import sys
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+    bindparam, create_engine, event, func, inspect, select,
+)
+
+DEFAULT_DATABASE_URL = os.environ.get("CATALOG_DATABASE_URL", "sqlite:///./drug_catalog.db")
+DEFAULT_BATCH_SIZE = 10000
+
+metadata = MetaData()
+
+categories = Table(
+    "categories", metadata,
+    Column("id", String(100), primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("description", Text),
+    Column("created_at", DateTime, server_default=func.current_timestamp()),
+)
+
+drugs = Table(
+    "drugs", metadata,
+    Column("id", String(100), primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("category_id", String(100), ForeignKey("categories.id")),
+    Column("description", Text),
+    Column("full_description", Text),
+    Column("how_it_works", Text),
+    Column("administration", Text),
+    Column("image_url", String(255)),
+    Column("created_at", DateTime, server_default=func.current_timestamp()),
+    Column("updated_at", DateTime, server_default=func.current_timestamp()),
+)
+
+drug_uses = Table(
+    "drug_uses", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("drug_id", String(100), ForeignKey("drugs.id")),
+    Column("description", Text, nullable=False),
+)
+
+drug_dosages = Table(
+    "drug_dosages", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("drug_id", String(100), ForeignKey("drugs.id")),
+    Column("condition", String(255), nullable=False),
+    Column("recommendation", Text, nullable=False),
+)
+
+side_effects = Table(
+    "side_effects", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("drug_id", String(100), ForeignKey("drugs.id")),
+    Column("description", Text, nullable=False),
+    Column("is_serious", Boolean, default=False),
+)
+
+drug_interactions = Table(
+    "drug_interactions", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("drug_id", String(100), ForeignKey("drugs.id")),
+    Column("interacting_drug", String(255)),
+    Column("effect", Text),
+    Column("severity", String(50)),
+)
+
+food_interactions = Table(
+    "food_interactions", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("drug_id", String(100), ForeignKey("drugs.id")),
+    Column("description", Text, nullable=False),
+)
+
+CHILD_TABLES = (drug_uses, drug_dosages, side_effects, drug_interactions, food_interactions)
+
+def secondary_indexes() -> List[Index]:
+    """Indexes built after the load, which is much faster than maintaining
+    them row by row"""
+    indexes = [Index("ix_drugs_category_id", drugs.c.category_id), Index("ix_drugs_name", drugs.c.name)] + [
+        Index(f"ix_{table.name}_drug_id", table.c.drug_id) for table in CHILD_TABLES
     ]
-    
-    # Sample drugs (simplified for this example)
-    drugs = [
-        {
-            "id": "amoxicillin",
-            "name": "Amoxicillin",
-            "category_id": "antibiotics",
-            "description": "A penicillin antibiotic that fights bacteria",
-            "full_description": "Amoxicillin is a penicillin antibiotic that fights bacteria. It is used to treat many different types of infection caused by bacteria, such as tonsillitis, bronchitis, pneumonia, and infections of the ear, nose, throat, skin, or urinary tract."
-        },
-        {
-            "id": "ibuprofen",
-            "name": "Ibuprofen",
-            "category_id": "analgesics",
-            "description": "Reduces inflammation and treats pain or fever",
-            "full_description": "Ibuprofen is a nonsteroidal anti-inflammatory drug (NSAID). It works by reducing hormones that cause inflammation and pain in the body."
-        },
-        {
-            "id": "lisinopril",
-            "name": "Lisinopril",
-            "category_id": "cardiovascular",
-            "description": "ACE inhibitor that treats high blood pressure",
-            "full_description": "Lisinopril is an ACE inhibitor that is used to treat high blood pressure (hypertension) in adults and children who are at least 6 years old."
+    # Index() attaches itself to its table; detach it so a later create_all
+    # (--rebuild) doesn't build it before the load, or twice
+    for index in indexes:
+        index.table.indexes.discard(index)
+    return indexes
+
+def create_catalog_engine(database_url: str):
+    engine = create_engine(database_url)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def tune_sqlite_for_bulk_load(dbapi_connection, connection_record):
+            # A rebuild can simply be rerun, so trade durability for speed
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=MEMORY")
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.execute("PRAGMA cache_size=-200000")
+            cursor.close()
+    return engine
+
+def create_database_schema(engine, rebuild: bool = False):
+    """Create the catalogue tables, dropping existing ones with ``rebuild``"""
+    existing = inspect(engine)
+    if existing.has_table("drugs"):
+        columns = {column["name"] for column in existing.get_columns("drugs")}
+        if "category_id" not in columns:
+            raise SystemExit(
+                "The target database holds the API's drugs table; "
+                "point --database-url at a separate catalogue database"
+            )
+    if rebuild:
+        metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+def create_indexes(engine):
+    with engine.begin() as connection:
+        for index in secondary_indexes():
+            index.create(connection, checkfirst=True)
+
+def _copy_value(value):
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+def copy_rows(connection, table: Table, rows: List[dict]):
+    """Load ``rows`` through PostgreSQL COPY"""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row.get(column)) for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+def executemany_rows(connection, table: Table, rows: List[dict]):
+    """Load ``rows`` with one parameterized executemany on the DBAPI cursor.
+
+    The INSERT is compiled once for the driver's paramstyle; skipping
+    SQLAlchemy's per-row parameter processing roughly doubles throughput.
+    """
+    columns = list(rows[0])
+    compiled = table.insert().values({column: bindparam(column) for column in columns}).compile(
+        dialect=connection.dialect
+    )
+    if compiled.positional:
+        parameters = [tuple(row[name] for name in compiled.positiontup) for row in rows]
+    else:
+        parameters = rows
+    cursor = connection.connection.cursor()
+    try:
+        cursor.executemany(str(compiled), parameters)
+    finally:
+        cursor.close()
+
+def insert_rows(connection, table: Table, rows: List[dict]):
+    if not rows:
+        return
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        copy_rows(connection, table, rows)
+    else:
+        executemany_rows(connection, table, rows)
+
+def flatten_drug(drug: dict) -> Dict[str, List[dict]]:
+    """Split one nested drug record into rows for each table"""
+    drug_id = drug["id"]
+    rows: Dict[str, List[dict]] = {
+        "drugs": [{
+            "id": drug_id,
+            "name": drug["name"],
+            "category_id": drug.get("category_id"),
+            "description": drug.get("description"),
+            "full_description": drug.get("full_description"),
+            "how_it_works": drug.get("how_it_works"),
+            "administration": drug.get("administration"),
+            "image_url": drug.get("image_url"),
+        }],
+        "drug_uses": [
+            {"drug_id": drug_id, "description": use} for use in drug.get("uses", [])
+        ],
+        "drug_dosages": [
+            {"drug_id": drug_id, "condition": dosage["condition"], "recommendation": dosage["recommendation"]}
+            for dosage in drug.get("dosages", [])
+        ],
+        "side_effects": [
+            {"drug_id": drug_id, "description": effect, "is_serious": False}
+            if isinstance(effect, str) else
+            {"drug_id": drug_id, "description": effect["description"], "is_serious": effect.get("is_serious", False)}
+            for effect in drug.get("side_effects", [])
+        ],
+        "drug_interactions": [
+            {
+                "drug_id": drug_id,
+                "interacting_drug": interaction.get("interacting_drug"),
+                "effect": interaction.get("effect"),
+                "severity": interaction.get("severity"),
+            }
+            for interaction in drug.get("drug_interactions", [])
+        ],
+        "food_interactions": [
+            {"drug_id": drug_id, "description": food} for food in drug.get("food_interactions", [])
+        ],
+    }
+    return rows
+
+class LoadStats:
+    """Rows written and time spent per table"""
+
+    def __init__(self):
+        self.rows: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+
+    def record(self, table: str, rows: int, seconds: float):
+        self.rows[table] = self.rows.get(table, 0) + rows
+        self.seconds[table] = self.seconds.get(table, 0.0) + seconds
+
+    def report(self, elapsed: float):
+        print(f"\n{'table':<20} {'rows':>12} {'rows/sec':>12}")
+        for table, rows in self.rows.items():
+            seconds = self.seconds[table] or 1e-9
+            print(f"{table:<20} {rows:>12,} {rows / seconds:>12,.0f}")
+        total = sum(self.rows.values())
+        print(f"{'total':<20} {total:>12,} {total / (elapsed or 1e-9):>12,.0f}  ({elapsed:.1f}s wall)")
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def load_categories(engine, rows: List[dict], stats: LoadStats):
+    """Insert the categories that don't exist yet"""
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        existing = set(connection.execute(select(categories.c.id)).scalars())
+        rows = [row for row in rows if row["id"] not in existing]
+        insert_rows(connection, categories, rows)
+    stats.record("categories", len(rows), time.perf_counter() - started)
+
+def category_row(record: dict) -> dict:
+    """A categories row for a drug record's ``category_id``, named by the
+    record's ``category`` if it has one"""
+    category_id = record["category_id"]
+    name = record.get("category") or category_id.replace("-", " ").replace("_", " ").title()
+    return {"id": category_id, "name": name, "description": None}
+
+def load_drugs(engine, records: Iterable[dict], batch_size: int, stats: LoadStats):
+    """Load nested drug records, one transaction per ``batch_size`` drugs.
+
+    Categories the records reference but the database lacks are created in
+    the same transaction, ahead of their drugs, so the foreign key holds
+    whatever the input contains.
+    """
+    tables = [drugs, *CHILD_TABLES]
+    with engine.connect() as connection:
+        known_categories = set(connection.execute(select(categories.c.id)).scalars())
+    for batch in _batches(records, batch_size):
+        rows: Dict[str, List[dict]] = {table.name: [] for table in tables}
+        new_categories: Dict[str, dict] = {}
+        for record in batch:
+            if record.get("category_id") and record["category_id"] not in known_categories:
+                new_categories.setdefault(record["category_id"], category_row(record))
+            for table_name, table_rows in flatten_drug(record).items():
+                rows[table_name].extend(table_rows)
+        with engine.begin() as connection:
+            started = time.perf_counter()
+            insert_rows(connection, categories, list(new_categories.values()))
+            stats.record("categories", len(new_categories), time.perf_counter() - started)
+            for table in tables:
+                started = time.perf_counter()
+                insert_rows(connection, table, rows[table.name])
+                stats.record(table.name, len(rows[table.name]), time.perf_counter() - started)
+        known_categories.update(new_categories)
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def generate_drugs(count: int, category_ids: List[str]) -> Iterator[dict]:
+    """Synthetic records with a realistic number of child rows, for load tests"""
+    for i in range(count):
+        yield {
+            "id": f"drug-{i}",
+            "name": f"Drug {i}",
+            "category_id": category_ids[i % len(category_ids)],
+            "description": f"Synthetic drug {i}",
+            "uses": [f"Condition {i % 97}", f"Condition {i % 89}"],
+            "dosages": [{"condition": f"Condition {i % 97}", "recommendation": f"{(i % 4 + 1) * 50} mg daily"}],
+            "side_effects": [f"Side effect {i % 31}", {"description": f"Side effect {i % 37}", "is_serious": i % 10 == 0}],
+            "drug_interactions": [
+                {"interacting_drug": f"Drug {(i * 7) % max(count, 1)}", "effect": "Increased levels", "severity": "moderate"}
+            ],
+            "food_interactions": ["Grapefruit juice"] if i % 5 == 0 else [],
         }
-    ]
-    
-    # Generate SQL for inserting categories
-    insert_categories_sql = "-- Insert categories\n"
-    for category in categories:
-        insert_categories_sql += f"INSERT INTO categories (id, name, description) VALUES ('{category['id']}', '{category['name']}', '{category['description']}');\n"
-    
-    # Generate SQL for inserting drugs
-    insert_drugs_sql = "\n-- Insert drugs\n"
-    for drug in drugs:
-        insert_drugs_sql += f"INSERT INTO drugs (id, name, category_id, description, full_description) VALUES ('{drug['id']}', '{drug['name']}', '{drug['category_id']}', '{drug['description']}', '{drug['full_description']}');\n"
-    
-    print(insert_categories_sql)
-    print(insert_drugs_sql)
-    print("\nSample data SQL generated successfully.")
-    
-    return True
-
-def main():
+
+SAMPLE_CATEGORIES = [
+    {"id": "antibiotics", "name": "Antibiotics", "description": "Medications used to treat bacterial infections"},
+    {"id": "analgesics", "name": "Analgesics", "description": "Pain relievers and medications that reduce inflammation"},
+    {"id": "cardiovascular", "name": "Cardiovascular Drugs", "description": "Medications for heart conditions and blood pressure"},
+    {"id": "antidiabetic", "name": "Antidiabetic", "description": "Medications used to treat diabetes"},
+    {"id": "hormones", "name": "Hormones", "description": "Medications that replace or supplement natural hormones"}
+]
+
+SAMPLE_DRUGS = [
+    {
+        "id": "amoxicillin",
+        "name": "Amoxicillin",
+        "category_id": "antibiotics",
+        "description": "A penicillin antibiotic that fights bacteria",
+        "full_description": "Amoxicillin is a penicillin antibiotic that fights bacteria. It is used to treat many different types of infection caused by bacteria, such as tonsillitis, bronchitis, pneumonia, and infections of the ear, nose, throat, skin, or urinary tract.",
+        "uses": ["Bacterial infections", "H. pylori eradication"],
+        "side_effects": ["Diarrhea", "Stomach upset", "Nausea", {"description": "Anaphylaxis", "is_serious": True}],
+        "drug_interactions": [{"interacting_drug": "Probenecid", "effect": "Raises amoxicillin levels", "severity": "minor"}]
+    },
+    {
+        "id": "ibuprofen",
+        "name": "Ibuprofen",
+        "category_id": "analgesics",
+        "description": "Reduces inflammation and treats pain or fever",
+        "full_description": "Ibuprofen is a nonsteroidal anti-inflammatory drug (NSAID). It works by reducing hormones that cause inflammation and pain in the body.",
+        "uses": ["Pain", "Fever", "Inflammation"],
+        "dosages": [{"condition": "Pain", "recommendation": "200-400 mg every 4-6 hours"}],
+        "side_effects": ["Upset stomach", "Heartburn", "Dizziness"],
+        "food_interactions": ["Alcohol increases the risk of stomach bleeding"]
+    },
+    {
+        "id": "lisinopril",
+        "name": "Lisinopril",
+        "category_id": "cardiovascular",
+        "description": "ACE inhibitor that treats high blood pressure",
+        "full_description": "Lisinopril is an ACE inhibitor that is used to treat high blood pressure (hypertension) in adults and children who are at least 6 years old.",
+        "uses": ["Hypertension", "Heart failure"],
+        "side_effects": ["Dizziness", "Headache", "Dry cough"],
+        "food_interactions": ["Salt substitutes containing potassium"]
+    }
+]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create and bulk load the drug catalogue database")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="drugs per transaction")
+    parser.add_argument("--rebuild", action="store_true", help="drop and recreate the catalogue tables first")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--input", help="JSON lines file of nested drug records")
+    source.add_argument("--generate", type=int, metavar="N", help="load N synthetic drugs")
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
     print("Database Setup for Drug Data Application")
     print("========================================")
-    
-    # Create schema
-    schema_created = create_database_schema()
-    
-    if schema_created:
-        # Seed data
-        data_seeded = seed_sample_data()
-        
-        if data_seeded:
-            print("\nDatabase setup completed successfully!")
-        else:
-            print("\nError: Failed to seed database with sample data.")
+    engine = create_catalog_engine(args.database_url)
+    create_database_schema(engine, rebuild=args.rebuild)
+    print(f"Schema ready on {engine.url.render_as_string(hide_password=True)}")
+    with engine.connect() as connection:
+        if connection.execute(select(drugs.c.id).limit(1)).first() is not None:
+            raise SystemExit("The catalogue already has drugs; rerun with --rebuild to reload it")
+
+    if args.input:
+        records = read_jsonl(args.input)
+    elif args.generate is not None:
+        records = generate_drugs(args.generate, [category["id"] for category in SAMPLE_CATEGORIES])
     else:
-        print("\nError: Failed to create database schema.")
+        records = SAMPLE_DRUGS
+
+    stats = LoadStats()
+    started = time.perf_counter()
+    if not args.input:
+        # The sample and synthetic drugs use these, descriptions included;
+        # categories for --input records come from the records themselves
+        load_categories(engine, SAMPLE_CATEGORIES, stats)
+    load_drugs(engine, records, args.batch_size, stats)
+    index_started = time.perf_counter()
+    create_indexes(engine)
+    elapsed = time.perf_counter() - started
+    stats.report(elapsed)
+    print(f"Indexes built in {time.perf_counter() - index_started:.1f}s")
+    engine.dispose()
+    print("\nDatabase setup completed successfully!")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())